@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""Checkout load test against the local PayPal stand-in.
+
+Runs simulated checkouts end to end without Discord or the PayPal sandbox by
+driving the real PurchaseSteamModal.on_submit and ThreadPaymentView buttons with
+stub interactions: coupon reservation -> PayPalPayment.create_payment -> buyer
+approval (scripted by the stand-in) -> Check Payment clicks -> finalize_payment
+-> process_approved_payment -> delivery. Reports latency per phase, end-to-end
+latency, throughput and the PayPal client's own metrics.
+
+    python bench_checkout.py                                   # 2000 checkouts, 100 concurrent
+    python bench_checkout.py --latency 0.15 --jitter 0.1 --fail-rate 0.02
+    python bench_checkout.py --approve-after 3 --approve-rate 0.9 --poll 1
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+from types import SimpleNamespace
+
+from bench_delivery import load_bot, percentile
+from paypal_standin import PayPalStandin, FaultInjector
+
+PHASES = ("create", "approval", "finalize", "delivery", "total")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load-test checkout against the PayPal stand-in")
+    parser.add_argument("--checkouts", type=int, default=2000, help="Number of simulated checkouts")
+    parser.add_argument("--concurrency", type=int, default=100, help="Checkouts in flight at once")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every PayPal API call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random extra PayPal latency, 0..jitter seconds")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of PayPal API calls answered with HTTP 500")
+    parser.add_argument("--approve-after", type=float, default=0.5, help="Seconds until the simulated buyer approves")
+    parser.add_argument("--approve-rate", type=float, default=1.0, help="Fraction of buyers who approve; the rest cancel")
+    parser.add_argument("--poll", type=float, default=0.5, help="Seconds between Check Payment clicks")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Give up on a checkout after this many seconds")
+    parser.add_argument("--coupon-share", type=float, default=0.25, help="Fraction of checkouts that use a coupon")
+    parser.add_argument("--pool-size", type=int, default=10, help="PAYPAL_POOL_SIZE (connections to PayPal)")
+    parser.add_argument("--status-ttl", type=float, default=None, help="PAYMENT_STATUS_TTL (default: --poll)")
+    parser.add_argument("--workers", type=int, default=8, help="DELIVERY_WORKERS for the outbox")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    # load_bot also reads the SFTP settings of the delivery benchmark; checkout runs on memory storage
+    args.coalesce_window = 0.0
+    return args
+
+
+def summarize(samples: list) -> dict:
+    return {
+        "p50_ms": round(percentile(samples, 50) * 1000, 1),
+        "p95_ms": round(percentile(samples, 95) * 1000, 1),
+        "p99_ms": round(percentile(samples, 99) * 1000, 1),
+    }
+
+
+class StubResponse:
+    """interaction.response: records what the bot answers"""
+    def __init__(self, interaction):
+        self._interaction = interaction
+
+    async def send_message(self, content=None, **kwargs):
+        self._interaction.messages.append(content)
+
+    async def defer(self, **kwargs):
+        pass
+
+
+class StubFollowup:
+    def __init__(self, interaction):
+        self._interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        self._interaction.messages.append(content)
+
+
+class StubThread:
+    """Order thread; keeps the ThreadPaymentView the modal posts in it"""
+    def __init__(self, thread_id: int):
+        self.id = thread_id
+        self.mention = f"<#{thread_id}>"
+        self.view = None
+
+    async def add_user(self, user):
+        pass
+
+    async def send(self, content=None, embed=None, view=None):
+        if view is not None:
+            self.view = view
+
+    async def delete(self):
+        pass
+
+
+class StubSalesChannel:
+    def __init__(self):
+        self.threads = {}
+
+    async def create_thread(self, name=None, **kwargs):
+        # The modal names threads after the item and the buyer
+        thread = StubThread(len(self.threads) + 1)
+        self.threads[name] = thread
+        return thread
+
+
+class StubInteraction:
+    """Just enough of discord.Interaction for PurchaseSteamModal and ThreadPaymentView"""
+    def __init__(self, user_id: int, channel=None):
+        self.user = SimpleNamespace(id=user_id, name=f"buyer{user_id}")
+        self.channel = channel
+        self.messages = []
+        self.response = StubResponse(self)
+        self.followup = StubFollowup(self)
+
+    @property
+    def last(self) -> str:
+        return self.messages[-1] if self.messages else ""
+
+
+def submit_modal(modal, interaction, values: dict):
+    """Fill the modal's text inputs the way Discord's modal submit payload does"""
+    components = [{"type": 4, "custom_id": item.custom_id, "value": values.get(name, "")}
+                  for name, item in (("steam_id", modal.steam_id), ("coupon_code", modal.coupon_code))]
+    modal._refresh(interaction, [{"type": 1, "components": components}])
+
+
+async def checkout(bot, n: int, args, channel, timings: dict, outcomes: dict):
+    """One buyer submitting PurchaseSteamModal and clicking the thread's Check Payment button"""
+    item_data = bot.items_catalog["bench_checkout"]
+    coupon_code = "BENCH" if (n % 100) < args.coupon_share * 100 else ""
+    started = time.perf_counter()
+
+    def outcome(name: str):
+        outcomes[name] = outcomes.get(name, 0) + 1
+
+    phase = time.perf_counter()
+    modal = bot.PurchaseSteamModal("bench_checkout", "item", item_data)
+    interaction = StubInteraction(n)
+    submit_modal(modal, interaction, {"steam_id": str(76561198000000000 + n), "coupon_code": coupon_code})
+    await modal.on_submit(interaction)
+    thread = channel.threads.get(f"Purchase of {item_data['name']} - {interaction.user.name}")
+    if thread is None or thread.view is None:
+        outcome("coupon_exhausted" if "no uses" in interaction.last else "create_error")
+        return
+    view = thread.view
+    payment_id = view.payment_id
+    timings["create"].append(time.perf_counter() - phase)
+
+    # The buyer pays on PayPal and clicks Check Payment until it goes through
+    phase = time.perf_counter()
+    deadline = phase + args.timeout
+    button = StubInteraction(n, channel=thread)
+    while True:
+        await asyncio.sleep(args.poll)
+        clicked = time.perf_counter()
+        await view.check_payment.callback(button)
+        # Still pending, or PayPal failed to answer: the buyer clicks again
+        if not (button.last.startswith("ℹ️") or button.last == "❌ Status: error."):
+            break
+        if clicked > deadline:
+            await view.cancel_purchase.callback(button)
+            outcome("timeout")
+            return
+    if button.last.startswith("❌ Status"):
+        # The buyer gave up on PayPal and cancels the order
+        await view.cancel_purchase.callback(button)
+        outcome(button.messages[-2].split(": ", 1)[-1].rstrip("."))
+        return
+    timings["approval"].append(clicked - phase)
+    # The click that found the payment approved also ran finalize_payment
+    timings["finalize"].append(time.perf_counter() - clicked)
+    if not button.last.startswith("✅ Payment approved"):
+        outcome("already_taken" if "already processed" in button.last else "finalize_failed")
+        return
+
+    phase = time.perf_counter()
+    delivered = await bot.delivery_outbox.wait_for_payment(payment_id, timeout=args.timeout)
+    timings["delivery"].append(time.perf_counter() - phase)
+    if not delivered:
+        outcome("delivery_failed")
+        return
+    timings["total"].append(time.perf_counter() - started)
+    outcome("delivered")
+
+
+async def main_async(args, bot) -> dict:
+    bot.storage = bot.MemoryStorage()
+    bot.PLAYER_FILES_PATH, bot.BANKING_PATH, bot.VEHICLE_SPAWN_PATH = "/players", "/banking", "/vehicles"
+    bot.items_catalog["bench_checkout"] = {"name": "Bench checkout", "price": 9.99,
+                                           "variations": [{"name": "Default", "script": {"itemToGive": "AKM"}}]}
+    bot.catalog.refresh('item', "bench_checkout")
+    bot.coupons["BENCH"] = {"discount": 10, "uses": 10 ** 9}
+
+    faults = FaultInjector(latency=args.latency, jitter=args.jitter, fail_rate=args.fail_rate, seed=args.seed)
+    standin = PayPalStandin(client_id=bot.PAYPAL_CLIENT_ID, client_secret=bot.PAYPAL_CLIENT_SECRET, faults=faults,
+                            approve_after=args.approve_after, approve_rate=args.approve_rate, seed=args.seed)
+    await standin.start()
+    bot.paypal_client.base_url = standin.url
+    bot.delivery_outbox.start()
+    channel = StubSalesChannel()
+    bot.bot.get_channel = lambda channel_id: channel
+
+    timings = {phase: [] for phase in PHASES}
+    outcomes = {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def run(n: int):
+        async with semaphore:
+            try:
+                await checkout(bot, n, args, channel, timings, outcomes)
+            except Exception as e:
+                outcomes[type(e).__name__] = outcomes.get(type(e).__name__, 0) + 1
+
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(run(n) for n in range(args.checkouts)))
+        elapsed = time.perf_counter() - started
+    finally:
+        await bot.delivery_outbox.stop()
+        await bot.paypal_client.close()
+        await standin.stop()
+
+    return {
+        "checkouts": args.checkouts,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_per_s": round(outcomes.get("delivered", 0) / elapsed, 2) if elapsed else 0.0,
+        "outcomes": outcomes,
+        "phases": {phase: summarize(samples) for phase, samples in timings.items()},
+        "paypal_client": bot.paypal_client.metrics(),
+        "status_cache": dict(bot.payment_status_cache.stats),
+        "standin": dict(standin.counts, injected_failures=faults.failures),
+    }
+
+
+def main():
+    args = parse_args()
+    os.environ.update({
+        "PAYPAL_POOL_SIZE": str(args.pool_size),
+        "PAYMENT_STATUS_TTL": str(args.poll if args.status_ttl is None else args.status_ttl),
+        "RECONCILE_INTERVAL_MIN": "3600",
+    })
+    with tempfile.TemporaryDirectory(prefix="bench_checkout_") as workdir:
+        cwd = os.getcwd()
+        bot = load_bot(args, workdir)
+        logging.getLogger().setLevel(logging.CRITICAL)
+        try:
+            results = asyncio.run(main_async(args, bot))
+        finally:
+            os.chdir(cwd)
+            bot.ftp_executor.shutdown(wait=True)
+
+    print(f"{results['checkouts']} checkouts in {results['elapsed_s']} s, "
+          f"{results['throughput_per_s']} delivered/s, outcomes {results['outcomes']}")
+    for phase in PHASES:
+        stats = results["phases"][phase]
+        print(f"  {phase:<10} p50 {stats['p50_ms']:>9.1f} ms  p95 {stats['p95_ms']:>9.1f} ms  p99 {stats['p99_ms']:>9.1f} ms")
+    print(f"PayPal client: {results['paypal_client']}")
+    print(f"Status cache:  {results['status_cache']}")
+    print(f"Stand-in:      {results['standin']}")
+    return 0 if results["outcomes"].get("delivered", 0) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""Delivery throughput benchmark.
+
+Drives process_approved_payment end to end (outbox -> workers -> FTPManager -> storage)
+for every delivery kind, against local files and the in-process SFTP stand-in, at
+several concurrency levels. Reports p50/p95/p99 latency and throughput, and can save
+or compare against a baseline file so regressions show up as numbers.
+
+    python bench_delivery.py                         # local + sftp, 1/10/100 concurrent
+    python bench_delivery.py --rtt 0.02 --save       # 20 ms per SFTP op, store baseline
+    python bench_delivery.py --compare               # diff against bench_baselines.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baselines.json")
+
+KINDS = {
+    "item": {"itemToGive": "AKM"},
+    "items_list": {"itemsToGive": ["M4A1", "Mag_STANAG_30Rnd", "Mag_STANAG_30Rnd", "ACOGOptic"]},
+    "banking": {"banking": True, "currencyAmount": 250000},
+    "spawn_vehicle": {"vehicleClassName": "OffroadHatchback", "amountOfAvailableSpawns": 3,
+                      "timeBeforeNextSpawn": 600, "guaranteePeriod": 604800, "isUnique": True},
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark bot deliveries")
+    parser.add_argument("--backends", default="local,sftp", help="Comma list of: local, sftp, memory")
+    parser.add_argument("--kinds", default=",".join(KINDS), help="Comma list of: " + ", ".join(KINDS))
+    parser.add_argument("--concurrency", default="1,10,100", help="Comma list of concurrent purchases")
+    parser.add_argument("--purchases", type=int, default=200, help="Purchases per scenario (at least the concurrency)")
+    parser.add_argument("--rtt", type=float, default=0.0, help="Simulated seconds per SFTP operation")
+    parser.add_argument("--workers", type=int, default=8, help="DELIVERY_WORKERS for the outbox")
+    parser.add_argument("--pool-size", type=int, default=4, help="SFTP_POOL_SIZE")
+    parser.add_argument("--coalesce-window", type=float, default=0.0, help="DELIVERY_COALESCE_WINDOW in seconds")
+    parser.add_argument("--same-player", action="store_true", help="Send every purchase to one SteamID")
+    parser.add_argument("--save", action="store_true", help=f"Write results to {os.path.basename(BASELINE_FILE)}")
+    parser.add_argument("--compare", action="store_true", help="Compare against the saved baseline")
+    return parser.parse_args()
+
+
+def load_bot(args, workdir: str):
+    """Import bot.py inside a scratch directory with a self-contained environment"""
+    env = {
+        "BOT_TOKEN": "bench", "SALES_CHANNEL_ID": "1", "ADMIN_ID": "1", "SEGUROS_CHANNEL_ID": "1",
+        "PAYPAL_CLIENT_ID": "bench", "PAYPAL_CLIENT_SECRET": "bench",
+        "USE_LOCAL": "true",
+        "LOCAL_BASE_PATH": os.path.join(workdir, "players"),
+        "BANKING_PATH": os.path.join(workdir, "banking"),
+        "VEHICLE_SPAWN_PATH": os.path.join(workdir, "vehicles"),
+        "DELIVERY_WORKERS": str(args.workers),
+        "SFTP_POOL_SIZE": str(args.pool_size),
+        "FTP_WORKERS": str(max(args.workers, args.pool_size)),
+        "DELIVERY_COALESCE_WINDOW": str(args.coalesce_window),
+    }
+    os.environ.update(env)
+    os.chdir(workdir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import bot
+    logging.getLogger().setLevel(logging.WARNING)
+    return bot
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def use_backend(bot, name: str, workdir: str, standin):
+    """Point FTPManager at one backend; returns the session pool to close, if any"""
+    if name == "local":
+        bot.storage = bot.LocalStorage()
+        bot.PLAYER_FILES_PATH = os.path.join(workdir, "players")
+        bot.BANKING_PATH = os.path.join(workdir, "banking")
+        bot.VEHICLE_SPAWN_PATH = os.path.join(workdir, "vehicles")
+        return None
+    if name == "memory":
+        bot.storage = bot.MemoryStorage()
+        bot.PLAYER_FILES_PATH, bot.BANKING_PATH, bot.VEHICLE_SPAWN_PATH = "/players", "/banking", "/vehicles"
+        return None
+    pool = bot.SFTPSessionPool("127.0.0.1", standin.port, standin.username, standin.password,
+                               size=bot.SFTP_POOL_SIZE, keepalive=bot.SFTP_KEEPALIVE, idle_check=bot.SFTP_IDLE_CHECK)
+    bot.storage = bot.SFTPStorage(pool)
+    bot.PLAYER_FILES_PATH, bot.BANKING_PATH, bot.VEHICLE_SPAWN_PATH = "/players", "/banking", "/vehicles"
+    return pool
+
+
+async def run_scenario(bot, kind: str, concurrency: int, purchases: int, same_player: bool, tag: str) -> dict:
+    item_id = f"bench_{kind}"
+    latencies = []
+    failures = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def purchase(n: int):
+        nonlocal failures
+        steam_id = "76561198000000000" if same_player else str(76561198000000000 + n)
+        payment_id = f"{tag}-{kind}-{concurrency}-{n}"
+        async with semaphore:
+            start = time.perf_counter()
+            ok = await bot.process_approved_payment(None, item_id, "item", steam_id, "BENCH", 1.0, payment_id, 1)
+            if ok:
+                ok = await bot.delivery_outbox.wait_for_payment(payment_id, timeout=120)
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                failures += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(purchase(n) for n in range(purchases)))
+    elapsed = time.perf_counter() - started
+    return {
+        "purchases": purchases,
+        "failures": failures,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "throughput_per_s": round(purchases / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+def bench_save_json(bot, records: int = 5000, rounds: int = 20) -> dict:
+    """Cost of persisting a purchase history of the given size"""
+    compras = {f"compra_{n}": {"user_id": "1", "steam_id": str(76561198000000000 + n), "item_id": "bench_item",
+                               "item_name": "Bench", "drops": 3} for n in range(records)}
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        bot.save_json("bench_compras.json", compras)
+        timings.append(time.perf_counter() - start)
+    return {"records": records, "p50_ms": round(percentile(timings, 50) * 1000, 2),
+            "p95_ms": round(percentile(timings, 95) * 1000, 2)}
+
+
+def compare(results: dict, baseline: dict):
+    print("\nChange vs baseline (throughput / p95):")
+    for key, current in results.items():
+        old = baseline.get(key)
+        if not old or "throughput_per_s" not in current:
+            continue
+        tput = (current["throughput_per_s"] - old["throughput_per_s"]) / old["throughput_per_s"] * 100 if old["throughput_per_s"] else 0.0
+        p95 = (current["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100 if old["p95_ms"] else 0.0
+        flag = "  <-- regression" if tput < -10 or p95 > 20 else ""
+        print(f"  {key:<32} throughput {tput:+6.1f}%  p95 {p95:+6.1f}%{flag}")
+
+
+async def main_async(args, bot, workdir: str) -> dict:
+    from sftp_standin import SFTPStandin, FaultInjector
+
+    for kind, script in KINDS.items():
+        item = {"name": f"Bench {kind}", "price": 1.0, "variations": [{"name": "Default", "script": script}]}
+        if kind == "spawn_vehicle":
+            item["vehicle_type"] = "spawn_vehicle"
+            item["is_vehicle"] = True
+        bot.items_catalog[f"bench_{kind}"] = item
+        bot.catalog.refresh('item', f"bench_{kind}")
+    bot.coupons["BENCH"] = {"discount": 10, "uses": 10 ** 9}
+    bot.delivery_outbox.start()
+
+    kinds = [k for k in args.kinds.split(",") if k]
+    levels = [int(c) for c in args.concurrency.split(",") if c]
+    results = {}
+    standin = None
+    if "sftp" in args.backends.split(","):
+        standin = SFTPStandin(root=os.path.join(workdir, "sftp_root"), faults=FaultInjector(latency=args.rtt)).start()
+    try:
+        for backend in [b for b in args.backends.split(",") if b]:
+            pool = use_backend(bot, backend, workdir, standin)
+            try:
+                for kind in kinds:
+                    for level in levels:
+                        key = f"{backend}/{kind}/c{level}"
+                        stats = await run_scenario(bot, kind, level, max(args.purchases, level), args.same_player, backend)
+                        results[key] = stats
+                        print(f"{key:<32} p50 {stats['p50_ms']:>9.2f} ms  p95 {stats['p95_ms']:>9.2f} ms  "
+                              f"p99 {stats['p99_ms']:>9.2f} ms  {stats['throughput_per_s']:>8.2f}/s  failures {stats['failures']}")
+                if pool:
+                    print(f"{backend} session pool: {pool.stats()}")
+            finally:
+                if pool:
+                    pool.close()
+    finally:
+        await bot.delivery_outbox.stop()
+        if standin:
+            standin.stop()
+
+    results["save_json"] = bench_save_json(bot)
+    print(f"{'save_json (5000 purchases)':<32} p50 {results['save_json']['p50_ms']:>9.2f} ms  p95 {results['save_json']['p95_ms']:>9.2f} ms")
+    return results
+
+
+def main():
+    args = parse_args()
+    with tempfile.TemporaryDirectory(prefix="bench_delivery_") as workdir:
+        cwd = os.getcwd()
+        bot = load_bot(args, workdir)
+        try:
+            results = asyncio.run(main_async(args, bot, workdir))
+        finally:
+            os.chdir(cwd)
+            bot.ftp_executor.shutdown(wait=True)
+
+    meta = {"rtt": args.rtt, "workers": args.workers, "pool_size": args.pool_size,
+            "coalesce_window": args.coalesce_window, "same_player": args.same_player}
+    if args.compare and os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get("meta") != meta:
+            print(f"\nNote: baseline was recorded with {baseline.get('meta')}, current run uses {meta}")
+        compare(results, baseline.get("results", {}))
+    if args.save:
+        with open(BASELINE_FILE, 'w', encoding='utf-8') as f:
+            json.dump({"saved_at": time.strftime("%Y-%m-%d %H:%M:%S"), "meta": meta, "results": results}, f, indent=4)
+        print(f"\nBaseline saved to {BASELINE_FILE}")
+
+
+if __name__ == "__main__":
+    main()
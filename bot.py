@@ -1,5 +1,6 @@
 import os
 import json
+import re
 import discord
 from discord import app_commands
 from discord.ext import commands
@@ -7,15 +8,30 @@ from discord.ui import View, Button, Select, Modal, TextInput
 import logging
 import asyncio
 import traceback
-import paypalrestsdk
+import aiohttp
+from aiohttp import web
 import qrcode
 import io
 import ftplib
 import paramiko
-import tempfile
+import threading
+import queue
+import time
+import random
+import functools
+import sqlite3
+import gzip
+from contextlib import contextmanager, asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from abc import ABC, abstractmethod
 from datetime import datetime
 import sys
 from dotenv import load_dotenv
+try:
+    import orjson  # Optional: faster JSON serializer
+except ImportError:
+    orjson = None
 
 # Load .env
 load_dotenv()
@@ -27,6 +43,11 @@ PAYPAL_CLIENT_ID = os.getenv('PAYPAL_CLIENT_ID')
 PAYPAL_CLIENT_SECRET = os.getenv('PAYPAL_CLIENT_SECRET')
 PAYPAL_MODE = os.getenv('PAYPAL_MODE', 'sandbox')
 PAYPAL_CURRENCY = os.getenv('PAYPAL_CURRENCY', 'EUR').upper()
+PAYPAL_API_BASE = os.getenv('PAYPAL_API_BASE') or ('https://api-m.paypal.com' if PAYPAL_MODE == 'live' else 'https://api-m.sandbox.paypal.com')
+PAYPAL_TIMEOUT = float(os.getenv('PAYPAL_TIMEOUT') or '15')  # Seconds per PayPal API call
+PAYPAL_POOL_SIZE = int(os.getenv('PAYPAL_POOL_SIZE') or '10')  # Max open connections to PayPal
+PAYMENT_STATUS_TTL = float(os.getenv('PAYMENT_STATUS_TTL') or '5')  # Seconds a non-final payment status is reused
+PAYPAL_WEBHOOK_ID = os.getenv('PAYPAL_WEBHOOK_ID')  # ID of the webhook registered in the PayPal app, used to verify signatures
 USE_LOCAL = os.getenv('USE_LOCAL', 'false').lower() == 'true'
 LOCAL_BASE_PATH = os.getenv('LOCAL_BASE_PATH')
 BANKING_PATH = os.getenv('BANKING_PATH')  # New: Specific path for banking
@@ -40,6 +61,36 @@ SEGUROS_CHANNEL_ID = int(os.getenv('SEGUROS_CHANNEL_ID') or '0')
 GUILD_ID = int(os.getenv('GUILD_ID') or '0')
 PELTCURRENCY_PATH = os.getenv('PELTCURRENCY_PATH')
 CAC_ROLE_ID = int(os.getenv('CAC_ROLE_ID') or '0')
+SFTP_POOL_SIZE = int(os.getenv('SFTP_POOL_SIZE') or '2')  # Max simultaneous SFTP sessions
+SFTP_KEEPALIVE = int(os.getenv('SFTP_KEEPALIVE') or '30')  # Seconds between SSH keepalive packets
+SFTP_IDLE_CHECK = int(os.getenv('SFTP_IDLE_CHECK') or '60')  # Idle seconds before a pooled session is health-checked
+FTP_WORKERS = int(os.getenv('FTP_WORKERS') or '4')  # Threads running blocking delivery I/O off the event loop
+DELIVERY_COALESCE_WINDOW = float(os.getenv('DELIVERY_COALESCE_WINDOW') or '0.25')  # Seconds to merge deliveries to one SteamID
+DELIVERY_WORKERS = int(os.getenv('DELIVERY_WORKERS') or '2')  # Async workers draining the delivery outbox
+DELIVERY_MAX_ATTEMPTS = int(os.getenv('DELIVERY_MAX_ATTEMPTS') or '8')  # Attempts before a delivery is dead-lettered
+DELIVERY_RETRY_BASE = float(os.getenv('DELIVERY_RETRY_BASE') or '5')  # Seconds before the first retry, doubled each attempt
+DELIVERY_RETRY_MAX = float(os.getenv('DELIVERY_RETRY_MAX') or '600')  # Upper bound for the retry delay
+BULK_GRANT_CONCURRENCY = int(os.getenv('BULK_GRANT_CONCURRENCY') or '8')  # Parallel deliveries in !grant
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'sqlite').lower()  # 'sqlite' (default) or 'json' for the old per-file layout
+SAVE_FLUSH_INTERVAL = float(os.getenv('SAVE_FLUSH_INTERVAL') or '2')  # Seconds between write-behind flushes of JSON files
+SAVE_FLUSH_MAX_PENDING = int(os.getenv('SAVE_FLUSH_MAX_PENDING') or '50')  # Unflushed saves that force an early flush
+JSON_COMPACT = os.getenv('JSON_COMPACT', 'false').lower() == 'true'  # Save bot data files without indentation
+JSON_BACKEND = os.getenv('JSON_BACKEND', 'json').lower()  # 'json' or 'orjson' (faster; files get 2-space indentation)
+LOG_SAVE_PAYLOADS = os.getenv('LOG_SAVE_PAYLOADS', 'false').lower() == 'true'  # Debug: also log the saved content
+STATE_JOURNAL_MAX_BYTES = int(os.getenv('STATE_JOURNAL_MAX_BYTES') or '1048576')  # Journal size that triggers compaction
+ARCHIVE_HOT_DAYS = float(os.getenv('ARCHIVE_HOT_DAYS') or '30')  # Days an exhausted purchase stays in memory before archiving
+ARCHIVE_INTERVAL = float(os.getenv('ARCHIVE_INTERVAL') or '3600')  # Seconds between archive sweeps (0 disables)
+WEBHOOK_PORT = int(os.getenv('PORT') or '0')  # PayPal webhook listener port (PORT is set for the 'web' process); 0 disables it
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/paypal/webhook')
+WEBHOOK_VERIFY = os.getenv('WEBHOOK_VERIFY', 'paypal').lower()  # 'paypal' (verify signatures) or 'off' for local replay only
+RECONCILE_INTERVAL_MIN = float(os.getenv('RECONCILE_INTERVAL_MIN') or '15')  # Seconds between checks of a new open order
+RECONCILE_INTERVAL_MAX = float(os.getenv('RECONCILE_INTERVAL_MAX') or '900')  # Upper bound as orders age
+RECONCILE_CONCURRENCY = int(os.getenv('RECONCILE_CONCURRENCY') or '4')  # Parallel PayPal status calls per pass
+LEDGER_RETENTION_DAYS = float(os.getenv('LEDGER_RETENTION_DAYS') or '90')  # Days delivered payments stay in the delivery ledger
+LEDGER_COMPACT_BYTES = int(os.getenv('LEDGER_COMPACT_BYTES') or str(1024 * 1024))  # Journal size that triggers a ledger snapshot
+LEDGER_COMPACT_INTERVAL = float(os.getenv('LEDGER_COMPACT_INTERVAL') or '3600')  # Seconds between ledger snapshots (and retention pruning)
+RECONCILE_MAX_AGE = float(os.getenv('RECONCILE_MAX_AGE') or '10800')  # Seconds before an unpaid order is closed (0 keeps it)
 
 # Minimum validations
 if not BOT_TOKEN:
@@ -62,6 +113,7 @@ if not BANKING_PATH:  # New: Validate BANKING_PATH
     print("Error: BANKING_PATH not defined in .env"); sys.exit(1)
 if USE_LOCAL and not os.path.exists(BANKING_PATH):
     os.makedirs(BANKING_PATH, exist_ok=True)
+PLAYER_FILES_PATH = LOCAL_BASE_PATH if USE_LOCAL else FTP_BASE_PATH  # Where <steamid>.json item files live
 
 # Logging
 logging.basicConfig(
@@ -74,17 +126,106 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Initialize PayPal
-try:
-    paypalrestsdk.configure({
-        "mode": PAYPAL_MODE,
-        "client_id": PAYPAL_CLIENT_ID,
-        "client_secret": PAYPAL_CLIENT_SECRET
-    })
-    logger.info("PayPal SDK initialized successfully")
-except Exception as e:
-    logger.error(f"Error initializing PayPal SDK: {str(e)}")
-    sys.exit(1)
+# PayPal REST client: one pooled aiohttp session, OAuth token cached until shortly before it expires
+class PayPalClient:
+    def __init__(self, base_url: str, client_id: str, client_secret: str, timeout: float, pool_size: int):
+        self.base_url = base_url.rstrip('/')
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._session = None
+        self._token = None
+        self._token_expires = 0.0
+        self._token_lock = None
+        self._latency = {}  # operation -> deque of recent call durations (seconds)
+        self._counts = {}  # operation -> {"calls", "errors"}
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    def _record(self, operation: str, start: float, ok: bool):
+        self._latency.setdefault(operation, deque(maxlen=500)).append(time.perf_counter() - start)
+        counts = self._counts.setdefault(operation, {"calls": 0, "errors": 0})
+        counts["calls"] += 1
+        if not ok:
+            counts["errors"] += 1
+
+    async def _access_token(self, refresh: bool = False) -> str:
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+        async with self._token_lock:
+            # Concurrent callers wait here for one token request instead of each fetching their own
+            if self._token and not refresh and time.time() < self._token_expires:
+                return self._token
+            start = time.perf_counter()
+            try:
+                async with self._get_session().post(
+                    f"{self.base_url}/v1/oauth2/token",
+                    data={"grant_type": "client_credentials"},
+                    auth=aiohttp.BasicAuth(self.client_id, self.client_secret),
+                    headers={"Accept": "application/json"}
+                ) as response:
+                    data = await response.json(content_type=None)
+                    if response.status != 200:
+                        raise RuntimeError(f"PayPal OAuth failed ({response.status}): {data}")
+            except Exception:
+                self._record("oauth", start, False)
+                raise
+            self._record("oauth", start, True)
+            self._token = data["access_token"]
+            # Renew a minute early so a token never expires mid-request
+            self._token_expires = time.time() + max(0, int(data.get("expires_in", 0)) - 60)
+            return self._token
+
+    async def request(self, method: str, path: str, operation: str, payload: dict = None) -> tuple:
+        """Authenticated JSON call; returns (status, body). A rejected token is renewed once"""
+        for attempt in range(2):
+            token = await self._access_token(refresh=attempt > 0)
+            start = time.perf_counter()
+            try:
+                async with self._get_session().request(
+                    method, f"{self.base_url}{path}", json=payload,
+                    headers={"Authorization": f"Bearer {token}", "Accept": "application/json"}
+                ) as response:
+                    data = await response.json(content_type=None)
+                    status = response.status
+            except Exception:
+                self._record(operation, start, False)
+                raise
+            self._record(operation, start, status < 400)
+            if status != 401:
+                return status, data
+        return status, data
+
+    async def create_payment(self, body: dict) -> tuple:
+        return await self.request("POST", "/v1/payments/payment", "create_payment", body)
+
+    async def find_payment(self, payment_id: str) -> tuple:
+        return await self.request("GET", f"/v1/payments/payment/{payment_id}", "find_payment")
+
+    async def verify_webhook_signature(self, payload: dict) -> tuple:
+        return await self.request("POST", "/v1/notifications/verify-webhook-signature", "verify_webhook", payload)
+
+    def metrics(self) -> dict:
+        """Per operation: calls, errors and p50/p95/max latency in ms over the recent calls"""
+        out = {}
+        for operation, samples in self._latency.items():
+            ordered = sorted(samples)
+            pick = lambda pct: ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))] * 1000
+            out[operation] = dict(self._counts[operation], p50_ms=round(pick(50), 1), p95_ms=round(pick(95), 1), max_ms=round(ordered[-1] * 1000, 1))
+        return out
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+paypal_client = PayPalClient(PAYPAL_API_BASE, PAYPAL_CLIENT_ID, PAYPAL_CLIENT_SECRET, PAYPAL_TIMEOUT, PAYPAL_POOL_SIZE)
 
 # Files
 ITEMS_FILE = "items_catalog.json"
@@ -96,6 +237,41 @@ PASSES_LIST_TXT = "lista_passes_venda.txt"
 SEGUROS_FILE = "seguros.json"
 SEGUROS_LOG = "seguros_acionados.txt"
 COMPRAS_FILE = "compras.json"  # NEW: File to register purchases with insurance
+DELIVERY_OUTBOX_FILE = "delivery_outbox.json"  # Approved orders waiting for delivery + dead letters
+BULK_GRANTS_FILE = "bulk_grants.json"  # Progress of admin bulk grants, for resuming
+PENDING_PAYMENTS_FILE = "pending_payments.json"  # Open PayPal orders waiting for "Check Payment"
+DELIVERY_LEDGER_FILE = "delivery_ledger.json"  # Per-payment delivery state and finished steps
+ARCHIVE_DIR = "archive"  # Monthly gzip'd JSONL archives of cold purchases/insurance
+STATE_DB_FILE = "store.db"  # SQLite state store (STATE_BACKEND=sqlite)
+STATE_JOURNAL_FILE = "state_journal.jsonl"  # Purchase/insurance event journal (STATE_BACKEND=json); compacted ones are kept as state_journal-<date>.jsonl
+
+if JSON_BACKEND == 'orjson' and orjson is None:
+    print("Error: JSON_BACKEND=orjson but orjson is not installed"); sys.exit(1)
+USE_ORJSON = JSON_BACKEND == 'orjson'
+
+def dump_json(data) -> bytes:
+    """Serialize bot data files (compact with JSON_COMPACT). The json module keeps the original 4-space
+    layout; orjson only supports 2-space indentation, so it is used only with JSON_BACKEND=orjson"""
+    if USE_ORJSON:
+        return orjson.dumps(data) if JSON_COMPACT else orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    if JSON_COMPACT:
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return json.dumps(data, indent=4, ensure_ascii=False).encode('utf-8')
+
+def write_file_atomic(filename: str, payload: bytes):
+    tmp_path = f"{filename}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+    os.replace(tmp_path, filename)
+
+def append_line(filename: str, line: str):
+    with open(filename, 'a', encoding='utf-8') as f:
+        f.write(line)
+
+def log_save(filename: str, payload: bytes, start: float):
+    logger.info(f"Saved {filename} ({len(payload)} bytes) in {(time.perf_counter() - start) * 1000:.1f} ms")
+    if LOG_SAVE_PAYLOADS:
+        logger.info(f"{filename} payload: {payload.decode('utf-8')}")
 
 def load_json(filename, default=None):
     if default is None:
@@ -104,21 +280,101 @@ def load_json(filename, default=None):
         save_json(filename, default)
         return default
     try:
-        with open(filename, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        with open(filename, 'rb') as f:
+            raw = f.read()
+        return orjson.loads(raw) if USE_ORJSON else json.loads(raw.decode('utf-8'))
     except Exception as e:
         logger.error(f"Error loading {filename}: {str(e)}")
         save_json(filename, default)
         return default
 
 def save_json(filename, data):
-    logger.info(f"Saving {filename} with data: {data}")
+    # Once the write-behind flusher runs, saves only mark the file dirty
+    if write_behind.active:
+        write_behind.mark(filename, data)
+        return
+    start = time.perf_counter()
     try:
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
+        payload = dump_json(data)
+        write_file_atomic(filename, payload)
+        log_save(filename, payload, start)
     except Exception as e:
         logger.error(f"Error saving {filename}: {str(e)}")
 
+class WriteBehind:
+    """Dirty tracking for save_json: each dirty file is written once per flush, off the event loop"""
+    def __init__(self, interval: float, max_pending: int):
+        self.interval = interval
+        self.max_pending = max(1, max_pending)
+        self.active = False
+        self._dirty = {}  # filename -> data (live reference, serialized at flush time)
+        self._mutations = 0
+        self._task = None
+        self._wakeup = None
+        self._stopping = False
+
+    def start(self):
+        if self.active:
+            return
+        self.active = True
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def mark(self, filename: str, data):
+        self._dirty[filename] = data
+        self._mutations += 1
+        if self._mutations >= self.max_pending:
+            self._wakeup.set()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> int:
+        """Write every dirty file now; returns how many files were written"""
+        dirty, self._dirty = self._dirty, {}
+        mutations, self._mutations = self._mutations, 0
+        remaining = list(dirty.items())
+        try:
+            while remaining:
+                filename, data = remaining[0]
+                start = time.perf_counter()
+                try:
+                    # Serialize on the loop (the dicts are only mutated here), write in the executor
+                    payload = dump_json(data)
+                    async with file_locks.hold(filename):
+                        await run_blocking(write_file_atomic, filename, payload)
+                    log_save(filename, payload, start)
+                except Exception as e:
+                    logger.error(f"Error saving {filename}: {str(e)}")
+                    self._dirty.setdefault(filename, data)
+                remaining.pop(0)
+        finally:
+            # Cancelled mid-flush: whatever was not written yet stays dirty for the next flush
+            for filename, data in remaining:
+                self._dirty.setdefault(filename, data)
+        if dirty and mutations > len(dirty):
+            logger.info(f"Write-behind merged {mutations} saves into {len(dirty)} file write(s)")
+        return len(dirty)
+
+    async def stop(self):
+        """Stop the flusher once its current flush is done and write whatever is still dirty"""
+        if not self.active:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await asyncio.gather(self._task, return_exceptions=True)
+        await self.flush()
+        self.active = False
+
+write_behind = WriteBehind(SAVE_FLUSH_INTERVAL, SAVE_FLUSH_MAX_PENDING)
+
 def save_list_to_txt(filename, catalog):
     try:
         with open(filename, 'w', encoding='utf-8') as f:
@@ -136,19 +392,449 @@ def save_list_to_txt(filename, catalog):
     except Exception as e:
         logger.error(f"Error saving list in {filename}: {str(e)}")
 
+# State stores: persistence for catalog, coupons, user links, insurance and purchases.
+# The bot works on in-memory dicts; after a mutation it calls state_store.save(collection, key...)
+# which persists exactly those keys (a key missing from the dict is deleted).
+JOURNALED_COLLECTIONS = ('compras', 'seguros')  # Purchase/insurance changes are journaled as events
+STATE_FILES = {
+    'items': ITEMS_FILE,
+    'coupons': COUPONS_FILE,
+    'users': USER_DATA_FILE,
+    'seguros': SEGUROS_FILE,
+    'compras': COMPRAS_FILE,
+    'pending': PENDING_PAYMENTS_FILE,
+}
+
+class JsonStateStore:
+    """Original layout: one JSON file per collection. Append-and-decrement collections
+    (JOURNALED_COLLECTIONS) are persisted as O(1) appends to a JSONL journal instead,
+    rebuilt at load from the snapshot file plus the journal and compacted in the background."""
+    def __init__(self, files: dict, journal_file: str, journal_max_bytes: int):
+        self.files = files
+        self.journal_file = journal_file
+        self.journal_max_bytes = journal_max_bytes
+        self.data = {}
+        self._depth = 0
+        self._dirty = set()
+        self._pending_records = []  # journal lines waiting for the end of a transaction
+        self._journal = None
+        self._compaction = None
+
+    def load(self, name: str) -> dict:
+        self.data[name] = load_json(self.files[name], {})
+        if name in JOURNALED_COLLECTIONS:
+            self._replay(name)
+        return self.data[name]
+
+    def scan(self, name: str, lo: str, hi: str) -> dict:
+        """Records with lo <= key < hi, in key order"""
+        return {key: self.data[name][key] for key in sorted(key for key in self.data[name] if lo <= key < hi)}
+
+    def _replay(self, name: str):
+        # A leftover '.compacting' file (crash during compaction) is older than the live journal
+        values = self.data[name]
+        applied = 0
+        for path in (f"{self.journal_file}.compacting", self.journal_file):
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        logger.warning(f"Skipping unreadable record in {path}")
+                        continue
+                    if record.get("c") != name:
+                        continue
+                    if record.get("op") == "del":
+                        values.pop(record["k"], None)
+                    else:
+                        values[record["k"]] = record["v"]
+                    applied += 1
+        if applied:
+            logger.info(f"Replayed {applied} journal record(s) into {name}")
+
+    def save(self, name: str, *keys, event: str = 'update'):
+        if name in JOURNALED_COLLECTIONS:
+            values = self.data[name]
+            ts = time.time()
+            for key in keys:
+                if key in values:
+                    record = {"ts": ts, "event": event, "c": name, "op": "put", "k": key, "v": values[key]}
+                else:
+                    record = {"ts": ts, "event": event, "c": name, "op": "del", "k": key}
+                self._pending_records.append(json.dumps(record, ensure_ascii=False))
+            if not self._depth:
+                self._append_records()
+        elif self._depth:
+            self._dirty.add(name)
+        else:
+            save_json(self.files[name], self.data[name])
+
+    def delete(self, name: str, *keys, event: str = 'update'):
+        """Persist the removal of keys that are still in memory; raises if it could not be written,
+        so the caller drops them from memory only afterwards"""
+        if name in JOURNALED_COLLECTIONS:
+            ts = time.time()
+            self._write_journal([json.dumps({"ts": ts, "event": event, "c": name, "op": "del", "k": key}, ensure_ascii=False) for key in keys])
+        else:
+            write_file_atomic(self.files[name], dump_json({key: value for key, value in self.data[name].items() if key not in keys}))
+
+    def _write_journal(self, lines: list):
+        if self._journal is None:
+            self._journal = open(self.journal_file, 'a', encoding='utf-8')
+        self._journal.write("\n".join(lines) + "\n")
+        self._journal.flush()
+
+    def _append_records(self):
+        if not self._pending_records:
+            return
+        lines, self._pending_records = self._pending_records, []
+        try:
+            self._write_journal(lines)
+        except Exception as e:
+            logger.error(f"Error appending to {self.journal_file}: {str(e)}")
+            return
+        if self._journal.tell() >= self.journal_max_bytes and self._compaction is None:
+            try:
+                self._compaction = asyncio.get_running_loop().create_task(self.compact())
+            except RuntimeError:
+                # No event loop (startup/shutdown): compact inline
+                self._rotate_journal()
+                self._compact_files(self._snapshot_payloads())
+
+    def _snapshot_payloads(self) -> dict:
+        return {name: dump_json(self.data[name]) for name in JOURNALED_COLLECTIONS if name in self.data}
+
+    def _rotate_journal(self):
+        """Move the live journal aside so new appends start a fresh file"""
+        if self._journal:
+            self._journal.close()
+            self._journal = None
+        compacting = f"{self.journal_file}.compacting"
+        if not os.path.exists(self.journal_file):
+            return
+        if os.path.exists(compacting):
+            with open(compacting, 'a', encoding='utf-8') as dst, open(self.journal_file, 'r', encoding='utf-8') as src:
+                dst.write(src.read())
+            os.remove(self.journal_file)
+        else:
+            os.replace(self.journal_file, compacting)
+
+    def _compact_files(self, payloads: dict):
+        for name, payload in payloads.items():
+            write_file_atomic(self.files[name], payload)
+        compacting = f"{self.journal_file}.compacting"
+        if os.path.exists(compacting):
+            # Folded into the snapshots, but kept as the audit trail of purchase/insurance events
+            root, ext = os.path.splitext(self.journal_file)
+            os.replace(compacting, f"{root}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}{ext}")
+
+    async def compact(self):
+        """Fold the journal into fresh snapshots; records are absolute values, so replay stays idempotent"""
+        start = time.perf_counter()
+        try:
+            self._rotate_journal()
+            payloads = self._snapshot_payloads()
+            await run_blocking(self._compact_files, payloads)
+            logger.info(f"Compacted {self.journal_file} into snapshots in {(time.perf_counter() - start) * 1000:.1f} ms")
+        except Exception as e:
+            logger.error(f"Error compacting {self.journal_file}: {str(e)}")
+        finally:
+            self._compaction = None
+
+    @contextmanager
+    def transaction(self):
+        """Group several saves; each touched file is written once and journal records in one append"""
+        self._depth += 1
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            if not self._depth:
+                self._append_records()
+                dirty, self._dirty = self._dirty, set()
+                for name in dirty:
+                    save_json(self.files[name], self.data[name])
+
+    def close(self):
+        if self._journal:
+            self._journal.close()
+            self._journal = None
+
+class SQLiteStateStore:
+    """Row-level, transactional persistence in an SQLite database in WAL mode. Rows are encoded on
+    the caller's thread; commits run in order on one dedicated writer thread with its own connection,
+    so the event loop never waits on SQLite's fsync."""
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS catalog (item_id TEXT PRIMARY KEY, data TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS coupons (code TEXT PRIMARY KEY, discount REAL NOT NULL, uses INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS user_links (user_id TEXT PRIMARY KEY, steam_id TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS insurance (steam_id TEXT PRIMARY KEY, drops INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS purchases (
+            purchase_id TEXT PRIMARY KEY,
+            user_id TEXT,
+            steam_id TEXT,
+            item_id TEXT,
+            drops INTEGER NOT NULL DEFAULT 0,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS purchases_owner ON purchases (steam_id, user_id);
+        CREATE TABLE IF NOT EXISTS pending_payments (payment_id TEXT PRIMARY KEY, data TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts REAL NOT NULL,
+            event TEXT NOT NULL,
+            collection TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT
+        );
+    """
+    # collection -> (table, key column, value columns, encode(value) -> tuple, decode(row) -> value)
+    TABLES = {
+        'items': ("catalog", "item_id", ("data",),
+                  lambda v: (json.dumps(v, ensure_ascii=False),),
+                  lambda r: json.loads(r[0])),
+        'coupons': ("coupons", "code", ("discount", "uses"),
+                    lambda v: (float(v.get('discount', 0)), int(v.get('uses', 0))),
+                    lambda r: {"discount": r[0], "uses": r[1]}),
+        'users': ("user_links", "user_id", ("steam_id",),
+                  lambda v: (str(v),),
+                  lambda r: r[0]),
+        'seguros': ("insurance", "steam_id", ("drops",),
+                    lambda v: (int(v),),
+                    lambda r: r[0]),
+        'compras': ("purchases", "purchase_id", ("user_id", "steam_id", "item_id", "drops", "data"),
+                    lambda v: (v.get('user_id'), v.get('steam_id'), v.get('item_id'), int(v.get('drops', 0)), json.dumps(v, ensure_ascii=False)),
+                    lambda r: json.loads(r[4])),
+        'pending': ("pending_payments", "payment_id", ("data",),
+                    lambda v: (json.dumps(v, ensure_ascii=False),),
+                    lambda r: json.loads(r[0])),
+    }
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.data = {}
+        self.conn = sqlite3.connect(filename, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        self._depth = 0
+        self._batch = []  # (sql, params, many) of the open transaction
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
+        self._write_conn = sqlite3.connect(filename, isolation_level=None, check_same_thread=False)
+        self._write_conn.execute("PRAGMA synchronous=NORMAL")
+
+    def load(self, name: str) -> dict:
+        self.flush()
+        table, key_col, cols, _, decode = self.TABLES[name]
+        # rowid is the insertion order (upserts in _write keep it), which PurchaseIndex relies on
+        rows = self.conn.execute(f"SELECT {key_col}, {', '.join(cols)} FROM {table} ORDER BY rowid")
+        self.data[name] = {row[0]: decode(row[1:]) for row in rows}
+        return self.data[name]
+
+    def scan(self, name: str, lo: str, hi: str) -> dict:
+        """Records with lo <= key < hi, in key order, served by the primary key index"""
+        # Admin queries only: wait for queued commits so the scan sees the latest saves
+        self.flush()
+        table, key_col, cols, _, decode = self.TABLES[name]
+        rows = self.conn.execute(
+            f"SELECT {key_col}, {', '.join(cols)} FROM {table} WHERE {key_col} >= ? AND {key_col} < ? ORDER BY {key_col}",
+            (lo, hi)
+        )
+        return {row[0]: decode(row[1:]) for row in rows}
+
+    def _write(self, name: str, keys):
+        table, key_col, cols, encode, _ = self.TABLES[name]
+        values = self.data[name]
+        for key in keys:
+            if key in values:
+                # Upsert rather than INSERT OR REPLACE, which deletes the row and gives it a new rowid
+                self._execute(
+                    f"INSERT INTO {table} ({key_col}, {', '.join(cols)}) VALUES ({', '.join('?' * (len(cols) + 1))}) "
+                    f"ON CONFLICT ({key_col}) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in cols)}",
+                    (key, *encode(values[key]))
+                )
+            else:
+                self._execute(f"DELETE FROM {table} WHERE {key_col} = ?", (key,))
+
+    def _execute(self, sql: str, params=(), many: bool = False):
+        """Queue a statement for the commit of the current transaction"""
+        self._batch.append((sql, params, many))
+
+    def save(self, name: str, *keys, event: str = 'update'):
+        try:
+            with self.transaction():
+                self._write(name, keys)
+                if name in JOURNALED_COLLECTIONS:
+                    # Audit trail of purchase/insurance changes
+                    ts = time.time()
+                    values = self.data[name]
+                    self._execute(
+                        "INSERT INTO events (ts, event, collection, key, value) VALUES (?, ?, ?, ?, ?)",
+                        [(ts, event, name, key, json.dumps(values[key], ensure_ascii=False) if key in values else None) for key in keys],
+                        many=True
+                    )
+        except Exception as e:
+            # Inside an outer transaction the caller must see the failure, so the whole group rolls back
+            if self._depth > 0:
+                raise
+            logger.error(f"Error saving {name} {keys} to {self.filename}: {str(e)}")
+
+    def delete(self, name: str, *keys, event: str = 'update'):
+        """Persist the removal of keys that are still in memory, so the caller drops them from memory
+        only afterwards. The delete is committed before any later save."""
+        table, key_col = self.TABLES[name][:2]
+        with self.transaction():
+            self._execute(f"DELETE FROM {table} WHERE {key_col} = ?", [(key,) for key in keys], many=True)
+            if name in JOURNALED_COLLECTIONS:
+                ts = time.time()
+                self._execute(
+                    "INSERT INTO events (ts, event, collection, key, value) VALUES (?, ?, ?, ?, ?)",
+                    [(ts, event, name, key, None) for key in keys],
+                    many=True
+                )
+
+    @contextmanager
+    def transaction(self):
+        """Group several saves into one atomic commit"""
+        self._depth += 1
+        try:
+            yield
+        except Exception:
+            self._depth -= 1
+            if self._depth == 0:
+                self._batch = []
+            raise
+        self._depth -= 1
+        if self._depth == 0:
+            batch, self._batch = self._batch, []
+            if batch:
+                self._writer.submit(self._commit, batch)
+
+    def _commit(self, batch: list):
+        """Writer thread: apply one transaction's statements atomically"""
+        try:
+            self._write_conn.execute("BEGIN")
+            for sql, params, many in batch:
+                if many:
+                    self._write_conn.executemany(sql, params)
+                else:
+                    self._write_conn.execute(sql, params)
+            self._write_conn.execute("COMMIT")
+        except Exception as e:
+            if self._write_conn.in_transaction:
+                self._write_conn.execute("ROLLBACK")
+            logger.error(f"Error committing {len(batch)} statement(s) to {self.filename}: {str(e)}")
+
+    def flush(self):
+        """Block until every queued commit is written"""
+        self._writer.submit(lambda: None).result()
+
+    def import_json_once(self, files: dict):
+        """First start on SQLite: copy the existing JSON files into the database, once per collection"""
+        imported = {row[0] for row in self.conn.execute("SELECT key FROM meta WHERE key LIKE 'json_imported%'")}
+        if 'json_imported' in imported:
+            # Databases from before pending payments moved here imported everything else in one go
+            imported.update(f"json_imported:{name}" for name in files if name != 'pending')
+        counts = {}
+        with self.transaction():
+            for name, filename in files.items():
+                if f"json_imported:{name}" in imported:
+                    continue
+                self._execute("INSERT INTO meta (key, value) VALUES (?, ?)", (f"json_imported:{name}", datetime.now().isoformat()))
+                if not os.path.exists(filename):
+                    continue
+                try:
+                    with open(filename, 'r', encoding='utf-8') as f:
+                        self.data[name] = json.load(f)
+                except Exception as e:
+                    logger.error(f"Error importing {filename}: {str(e)}")
+                    continue
+                self._write(name, list(self.data[name].keys()))
+                counts[name] = len(self.data[name])
+        if counts:
+            logger.info(f"Imported JSON state into {self.filename}: {counts}")
+
+    def close(self):
+        self._writer.shutdown(wait=True)
+        self._write_conn.close()
+        self.conn.close()
+
+if STATE_BACKEND == 'json':
+    state_store = JsonStateStore(STATE_FILES, STATE_JOURNAL_FILE, STATE_JOURNAL_MAX_BYTES)
+else:
+    state_store = SQLiteStateStore(STATE_DB_FILE)
+    state_store.import_json_once(STATE_FILES)
+
 # Load data
-items_catalog = load_json(ITEMS_FILE, {})
-coupons = load_json(COUPONS_FILE, {})
+items_catalog = state_store.load('items')
+coupons = state_store.load('coupons')
 passes_catalog = load_json(PASSES_FILE, {})
-user_data = load_json(USER_DATA_FILE, {})
-seguros = load_json(SEGUROS_FILE, {})
-compras = load_json(COMPRAS_FILE, {})  # NEW: Load compras.json
+user_data = state_store.load('users')
+seguros = state_store.load('seguros')
+compras = state_store.load('compras')
+
+class PurchaseIndex:
+    """(steam_id, user_id) -> purchase IDs that still have insurance drops, in purchase order"""
+    def __init__(self, purchases: dict):
+        self.purchases = purchases
+        self._open = {}
+        self.rebuild()
+
+    def rebuild(self):
+        self._open = {}
+        for cid in self.purchases:
+            self.sync(cid)
+
+    def sync(self, cid: str):
+        """Call after inserting a purchase or changing its drops"""
+        compra = self.purchases.get(cid)
+        if compra is None:
+            owners = [owner for owner, cids in self._open.items() if cid in cids]
+        else:
+            owner = (compra.get("steam_id"), compra.get("user_id"))
+            if compra.get("drops", 0) > 0:
+                self._open.setdefault(owner, {})[cid] = None
+                return
+            owners = [owner]
+        for owner in owners:
+            cids = self._open.get(owner, {})
+            cids.pop(cid, None)
+            if not cids:
+                self._open.pop(owner, None)
+
+    def first_open(self, steam_id: str, user_id: str):
+        cids = self._open.get((steam_id, user_id))
+        return next(iter(cids), None) if cids else None
+
+purchase_index = PurchaseIndex(compras)
+
+# Purchase IDs from before the time-sortable format (compra_<unix seconds>) sort after every new ID, so a
+# key range never reaches them. No new ones are created, so they are listed once and checked directly.
+legacy_purchase_ids = [cid for cid in compras if len(cid.rsplit('_', 1)[-1]) != 20]
+
+def purchases_between(start: float, end: float) -> dict:
+    """Hot purchases created in [start, end) (unix seconds), oldest first; IDs are time-sortable, so this is a key range scan"""
+    lo, hi = IdGenerator.bounds("compra", start, end)
+    found = state_store.scan('compras', lo, hi)
+    legacy = {}
+    for cid in legacy_purchase_ids:
+        compra = compras.get(cid)
+        ts = (compra.get("created_at") or IdGenerator.timestamp(cid)) if compra else None
+        if ts is not None and start <= ts < end:
+            legacy[cid] = compra
+    if not legacy:
+        return found
+    legacy.update(found)
+    return dict(sorted(legacy.items(), key=lambda kv: kv[1].get("created_at") or IdGenerator.timestamp(kv[0]) or 0))
 save_list_to_txt(ITEMS_LIST_TXT, items_catalog)
 save_list_to_txt(PASSES_LIST_TXT, passes_catalog)
 
 # Automatic migration function: converts old items (with root 'script') to new format with 'variations'
 def migrate_items_to_variations():
-    migrated = False
+    migrated = []
     for iid, data in list(items_catalog.items()):
         if 'variations' not in data:
             # if there is old 'script' key or 'itemsToGive' keys
@@ -161,15 +847,107 @@ def migrate_items_to_variations():
                     # remove legacy 'script' to avoid confusion
                     if 'script' in items_catalog[iid]:
                         del items_catalog[iid]['script']
-                    migrated = True
+                    migrated.append(iid)
                 except Exception as e:
                     logger.error(f"Error migrating item {iid}: {str(e)}")
     if migrated:
-        save_json(ITEMS_FILE, items_catalog)
+        state_store.save('items', *migrated)
         logger.info("Migration to 'variations' executed and items_catalog saved.")
 # Execute migration right after defining the function
 migrate_items_to_variations()
 
+# Compiled catalog: variation fallbacks, drop counts and script parsing are resolved once per
+# load/edit. items_catalog / passes_catalog stay the persisted source; call catalog.refresh after editing them.
+def parse_script(script) -> dict:
+    if isinstance(script, dict):
+        return script
+    if isinstance(script, str) and script.strip():
+        try:
+            value = json.loads(script)
+            return value if isinstance(value, dict) else {}
+        except ValueError as e:
+            logger.error(f"Error parsing JSON script: {str(e)}")
+    return {}
+
+def _to_int(value, default: int = 0) -> int:
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return default
+
+class CatalogVariation:
+    __slots__ = ("index", "name", "script", "is_vehicle", "insurance_drops")
+
+    def __init__(self, index: int, raw: dict, item: dict):
+        self.index = index
+        self.name = raw.get('name', f"Var{index}")
+        self.script = parse_script(raw.get('script'))
+        # Flags not set on the variation fall back to the item
+        self.is_vehicle = bool(raw.get('is_vehicle', item.get('is_vehicle', False)))
+        self.insurance_drops = _to_int(raw.get('insurance_drops', item.get('insurance_drops', 0)))
+
+    @property
+    def insurable(self) -> bool:
+        return self.is_vehicle and self.insurance_drops > 0
+
+class CatalogEntry:
+    __slots__ = ("id", "kind", "name", "price", "vehicle_type", "raw", "variations", "is_vehicle", "insurance_drops")
+
+    def __init__(self, item_id: str, kind: str, raw: dict):
+        self.id = item_id
+        self.kind = kind
+        self.raw = raw
+        self.name = raw.get('name')
+        self.price = float(raw.get('price', 0.0) or 0.0)
+        self.vehicle_type = raw.get('vehicle_type')
+        self.is_vehicle = bool(raw.get('is_vehicle', False))
+        self.insurance_drops = _to_int(raw.get('insurance_drops', 0))
+        if kind == 'item':
+            self.variations = tuple(CatalogVariation(i, v, raw) for i, v in enumerate(raw.get('variations') or []))
+        else:
+            # Passes keep a single script at the root
+            self.variations = (CatalogVariation(0, {"name": "Default", "script": raw.get('script')}, raw),)
+
+    def variation(self, index: int = 0):
+        """Selected variation, falling back to the first; None if the item has none"""
+        if 0 <= index < len(self.variations):
+            return self.variations[index]
+        return self.variations[0] if self.variations else None
+
+    def script(self, index: int = 0) -> dict:
+        variation = self.variation(index)
+        return variation.script if variation else {}
+
+    def insured_drops(self, index: int = 0) -> int:
+        """Insurance drops bought with this variation; 0 unless it is a vehicle with drops"""
+        variation = self.variation(index)
+        if variation:
+            return variation.insurance_drops if variation.insurable else 0
+        return self.insurance_drops if self.is_vehicle else 0
+
+class Catalog:
+    def __init__(self, items: dict, passes: dict):
+        self.sources = {'item': items, 'pass': passes}
+        self.entries = {'item': {}, 'pass': {}}
+        for kind in self.sources:
+            self.refresh(kind)
+
+    def refresh(self, kind: str = 'item', item_id: str = None):
+        """Recompile one entry (or the whole kind) after its raw dict changed"""
+        source, entries = self.sources[kind], self.entries[kind]
+        if item_id is None:
+            entries.clear()
+        for iid in (source if item_id is None else [item_id]):
+            if iid in source:
+                entries[iid] = CatalogEntry(iid, kind, source[iid])
+            else:
+                entries.pop(iid, None)
+
+    def get(self, item_id: str, kind: str = 'item'):
+        return self.entries[kind].get(item_id)
+
+catalog = Catalog(items_catalog, passes_catalog)
+
 # Bot
 intents = discord.Intents.default()
 intents.messages = True
@@ -177,191 +955,491 @@ intents.message_content = True
 intents.guilds = True
 bot = commands.Bot(command_prefix='!', intents=intents)
 
-# Pending payment
-pending_payments = {}  # payment_id -> {user_id, item_id, type, steam_target, insurance, amount, coupon}
+# Pending payment (persisted so open orders and their thread buttons survive a restart).
+# After a change, state_store.save('pending', payment_id) writes just that order.
+pending_payments = state_store.load('pending')  # payment_id -> {user_id, item_id, type, steam_target, insurance, amount, coupon, coupon_reservation, variation_index, script, thread_id, created_at}
+
+# Coupon reservations: a checkout holds one use of its coupon for as long as its order is open, until
+# the payment is approved (commit) or the order is canceled or closed by the reconciler (release).
+# Checks and updates never await, so they are atomic on the event loop without a lock.
+class CouponReservations:
+    def __init__(self):
+        self.active = {}  # reservation_id -> coupon code
+        self._held = {}  # code -> number of active reservations
+
+    def restore(self, pending: dict):
+        """Rebuild reservations from persisted pending payments"""
+        for info in pending.values():
+            rid = info.get("coupon_reservation")
+            if rid and info.get("coupon"):
+                self._hold(rid, info["coupon"])
+
+    def _hold(self, rid: str, code: str):
+        self.active[rid] = code
+        self._held[code] = self._held.get(code, 0) + 1
+
+    def _drop(self, rid: str):
+        code = self.active.pop(rid, None)
+        if code:
+            self._held[code] -= 1
+            if not self._held[code]:
+                del self._held[code]
+        return code
+
+    def available(self, code: str) -> int:
+        """Uses left after active reservations; negative 'uses' means unlimited"""
+        uses = coupons.get(code, {}).get('uses', 0)
+        return uses if uses < 0 else max(0, uses - self._held.get(code, 0))
+
+    def reserve(self, code: str):
+        """Hold one use of code; returns the reservation ID or None if none is left"""
+        if code not in coupons or self.available(code) == 0:
+            return None
+        rid = generate_unique_id("resv")
+        self._hold(rid, code)
+        return rid
+
+    def release(self, rid: str):
+        code = self._drop(rid) if rid else None
+        if code:
+            logger.info(f"Coupon reservation {rid} released ({code})")
+
+    def commit(self, code: str, rid: str = None) -> bool:
+        """Consume the reserved use. Without an active reservation (orders from before reservations,
+        or one already released) the use is only taken if one is still free; False if it was not"""
+        if rid is None or self._drop(rid) is None:
+            if code in coupons and self.available(code) == 0:
+                logger.error(f"Coupon {code} was applied to a paid order but has no use left (reservation {rid}); not decremented")
+                return False
+        if code and code in coupons and coupons[code]['uses'] > 0:
+            coupons[code]['uses'] -= 1
+            state_store.save('coupons', code)
+            logger.info(f"Coupon {code} used. {coupons[code]['uses']} remaining")
+        return True
+
+coupon_reservations = CouponReservations()
+coupon_reservations.restore(pending_payments)
 
 def validate_steam_id(steam_id: str) -> bool:
     return isinstance(steam_id, str) and steam_id.isdigit() and len(steam_id) == 17
 
+class IdGenerator:
+    """Monotonic, time-sortable IDs: <prefix>_<12 hex ms timestamp><4 hex sequence><4 hex process tag>.
+    IDs from one process never repeat and sort by creation time, so a key range is a time range"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._seq = 0
+        self._node = f"{random.getrandbits(16):04x}"  # Keeps a second process (or a fast restart) from colliding
+
+    def new(self, prefix: str) -> str:
+        with self._lock:
+            ms = int(time.time() * 1000)
+            if ms <= self._last_ms:
+                # Same millisecond or clock stepped back: keep counting from the last timestamp
+                ms = self._last_ms
+                self._seq += 1
+                if self._seq > 0xffff:
+                    ms += 1
+                    self._seq = 0
+            else:
+                self._seq = 0
+            self._last_ms = ms
+            seq = self._seq
+        return f"{prefix}_{ms:012x}{seq:04x}{self._node}"
+
+    @staticmethod
+    def bounds(prefix: str, start: float, end: float) -> tuple:
+        """Key range [lo, hi) holding every ID of prefix created in [start, end) (unix seconds)"""
+        return f"{prefix}_{int(start * 1000):012x}", f"{prefix}_{int(end * 1000):012x}"
+
+    @staticmethod
+    def timestamp(id_: str):
+        """Creation time of an ID in unix seconds, including the old prefix_<seconds> format"""
+        suffix = id_.rsplit('_', 1)[-1]
+        if len(suffix) == 20:
+            try:
+                return int(suffix[:12], 16) / 1000
+            except ValueError:
+                return None
+        return int(suffix) if suffix.isdigit() else None
+
+ids = IdGenerator()
+
 def generate_unique_id(prefix: str) -> str:
-    return f"{prefix}_{int(datetime.now().timestamp())}"
+    return ids.new(prefix)
+
+# SFTP session pool
+class SFTPSessionPool:
+    """Keeps authenticated SFTP sessions open and shares them between deliveries"""
+    def __init__(self, host: str, port: int, username: str, password: str, size: int = 2, keepalive: int = 30, idle_check: int = 60):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.size = max(1, size)
+        self.keepalive = keepalive
+        self.idle_check = idle_check
+        self._idle = queue.LifoQueue()  # (sftp, transport, last_used)
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self._counters = {"connects": 0, "reuses": 0, "reconnects": 0, "discarded": 0}
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _connect(self):
+        transport = paramiko.Transport((self.host, self.port))
+        try:
+            transport.set_keepalive(self.keepalive)
+            transport.connect(username=self.username, password=self.password)
+            sftp = paramiko.SFTPClient.from_transport(transport)
+        except Exception:
+            transport.close()
+            raise
+        self._count("connects")
+        logger.info(f"SFTP session opened to {self.host}:{self.port}")
+        return sftp, transport
+
+    @staticmethod
+    def _close(sftp, transport):
+        try:
+            sftp.close()
+        except Exception:
+            pass
+        try:
+            transport.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, sftp, transport, last_used: float) -> bool:
+        if not transport.is_active():
+            return False
+        if time.monotonic() - last_used < self.idle_check:
+            return True
+        try:
+            sftp.stat('.')
+            return True
+        except Exception:
+            return False
+
+    def _acquire(self):
+        """Return (sftp, transport, reused) from the idle stack, reconnecting dead sessions"""
+        while True:
+            try:
+                sftp, transport, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                sftp, transport = self._connect()
+                return sftp, transport, False
+            if self._is_healthy(sftp, transport, last_used):
+                self._count("reuses")
+                return sftp, transport, True
+            self._close(sftp, transport)
+            self._count("reconnects")
+
+    def run(self, func):
+        """Call func(sftp) with a pooled session, retrying once if a reused connection turned out to be dead"""
+        self._slots.acquire()
+        try:
+            for attempt in range(2):
+                sftp, transport, reused = self._acquire()
+                try:
+                    result = func(sftp)
+                except Exception:
+                    if transport.is_active():
+                        # Operation-level error (missing file, permission...): the session is still good
+                        self._idle.put((sftp, transport, time.monotonic()))
+                        raise
+                    self._close(sftp, transport)
+                    self._count("discarded")
+                    if reused and attempt == 0:
+                        logger.warning(f"Pooled SFTP session to {self.host} was dead, reconnecting")
+                        self._count("reconnects")
+                        continue
+                    raise
+                self._idle.put((sftp, transport, time.monotonic()))
+                return result
+        finally:
+            self._slots.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+        checkouts = stats["connects"] + stats["reuses"]
+        stats["idle"] = self._idle.qsize()
+        stats["size"] = self.size
+        stats["hit_rate"] = round(stats["reuses"] / checkouts, 3) if checkouts else 0.0
+        return stats
+
+    def close(self):
+        while True:
+            try:
+                sftp, transport, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._close(sftp, transport)
+
+sftp_pool = None if USE_LOCAL else SFTPSessionPool(
+    FTP_HOST, int(FTP_PORT), FTP_USER, FTP_PASS,
+    size=SFTP_POOL_SIZE, keepalive=SFTP_KEEPALIVE, idle_check=SFTP_IDLE_CHECK
+)
+
+# Storage backends: where delivery files live. FTPManager is written once against this interface.
+class StorageBackend(ABC):
+    name = "base"
+
+    @abstractmethod
+    def path(self, base: str, filename: str) -> str:
+        """Full path of filename inside the base directory"""
+
+    @abstractmethod
+    def read_json(self, path: str):
+        """Return the parsed file, raising FileNotFoundError if it does not exist"""
+
+    @abstractmethod
+    def write_json(self, path: str, data):
+        """Replace the file atomically"""
+
+    def update_json(self, path: str, mutate, default):
+        """Read the file (or default() if missing/corrupt), mutate it in place and write it back"""
+        data = self._read_or_default(self.read_json, path, default)
+        mutate(data)
+        self.write_json(path, data)
+        return data
+
+    @staticmethod
+    def _read_or_default(read, path: str, default):
+        try:
+            data = read(path)
+        except FileNotFoundError:
+            return default()
+        except ValueError as e:
+            logger.warning(f"Could not read existing file {path}: {str(e)}")
+            return default()
+        return data if isinstance(data, dict) else default()
+
+    @staticmethod
+    def _dumps(data) -> bytes:
+        return json.dumps(data, indent=4, ensure_ascii=False).encode('utf-8')
+
+class LocalStorage(StorageBackend):
+    name = "local"
+
+    def path(self, base: str, filename: str) -> str:
+        return os.path.join(base, filename)
+
+    def read_json(self, path: str):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def write_json(self, path: str, data):
+        # Write to a temp file next to the target and atomically replace it
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(self._dumps(data))
+        os.replace(tmp_path, path)
+
+class SFTPStorage(StorageBackend):
+    name = "sftp"
+
+    def __init__(self, pool: SFTPSessionPool):
+        self.pool = pool
+
+    def path(self, base: str, filename: str) -> str:
+        if not base.startswith('/'):
+            base = '/' + base
+        return f"{base}/{filename}"
+
+    @staticmethod
+    def _read(sftp, path: str):
+        """Read a remote JSON file straight into memory"""
+        buf = io.BytesIO()
+        sftp.getfo(path, buf)
+        return json.loads(buf.getvalue().decode('utf-8'))
+
+    @staticmethod
+    def _unsupported(e: IOError) -> bool:
+        # paramiko reports SSH_FX_OP_UNSUPPORTED as a bare IOError carrying the server's message
+        return e.errno is None and "unsupported" in str(e).lower()
+
+    @staticmethod
+    def _write(sftp, path: str, data):
+        """Write a temp file in one pipelined write, then rename it over the target"""
+        # Unique per thread, so two pooled sessions writing the same file never share a temp file
+        tmp_path = f"{path}.{threading.get_ident():x}.tmp"
+        with sftp.open(tmp_path, 'wb') as f:
+            f.set_pipelined(True)
+            f.write(StorageBackend._dumps(data))
+        try:
+            if not getattr(sftp, 'no_posix_rename', False):
+                try:
+                    sftp.posix_rename(tmp_path, path)
+                    return
+                except IOError as e:
+                    if not SFTPStorage._unsupported(e):
+                        raise
+                    # Remembered per session: the server lacks posix-rename@openssh.com
+                    sftp.no_posix_rename = True
+            SFTPStorage._replace(sftp, tmp_path, path)
+        except Exception:
+            try:
+                sftp.remove(tmp_path)
+            except IOError:
+                pass
+            raise
+
+    @staticmethod
+    def _replace(sftp, tmp_path: str, path: str):
+        """Overwrite path without posix-rename: plain rename refuses to overwrite, so move the old
+        file aside first and put it back if the new one cannot be moved in"""
+        backup = f"{tmp_path}.old"
+        try:
+            sftp.rename(path, backup)
+        except FileNotFoundError:
+            backup = None
+        try:
+            sftp.rename(tmp_path, path)
+        except Exception:
+            if backup:
+                sftp.rename(backup, path)
+            raise
+        if backup:
+            sftp.remove(backup)
+
+    def read_json(self, path: str):
+        return self.pool.run(lambda sftp: self._read(sftp, path))
+
+    def write_json(self, path: str, data):
+        self.pool.run(lambda sftp: self._write(sftp, path, data))
+
+    def update_json(self, path: str, mutate, default):
+        # Read and write back over the same pooled session
+        def _update(sftp):
+            data = self._read_or_default(lambda p: self._read(sftp, p), path, default)
+            mutate(data)
+            self._write(sftp, path, data)
+            return data
+        return self.pool.run(_update)
+
+class MemoryStorage(StorageBackend):
+    """Keeps serialized files in a dict, for tests and benchmarks"""
+    name = "memory"
+
+    def __init__(self):
+        self.files = {}  # path -> bytes
+        self._lock = threading.Lock()
+
+    def path(self, base: str, filename: str) -> str:
+        return f"{base.rstrip('/')}/{filename}"
+
+    def read_json(self, path: str):
+        with self._lock:
+            if path not in self.files:
+                raise FileNotFoundError(path)
+            payload = self.files[path]
+        return json.loads(payload.decode('utf-8'))
+
+    def write_json(self, path: str, data):
+        payload = self._dumps(data)
+        with self._lock:
+            self.files[path] = payload
+
+storage = LocalStorage() if USE_LOCAL else SFTPStorage(sftp_pool)
+
+# Bounded thread pool for blocking file/SFTP work, so the gateway loop never waits on it
+ftp_executor = ThreadPoolExecutor(max_workers=max(1, FTP_WORKERS), thread_name_prefix='ftp')
+
+async def run_blocking(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(ftp_executor, functools.partial(func, *args, **kwargs))
+
+class PathLocks:
+    """One asyncio.Lock per file path, dropped again once nobody holds or waits for it"""
+    def __init__(self):
+        self._locks = {}  # path -> [lock, holders]
+
+    @asynccontextmanager
+    async def hold(self, path: str):
+        entry = self._locks.setdefault(path, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[path]
+
+file_locks = PathLocks()
 
 # FTP / local manager
 class FTPManager:
     @staticmethod
-    def _get_sftp_connection():
-        """Create SFTP connection using paramiko"""
-        transport = paramiko.Transport((FTP_HOST, int(FTP_PORT)))
-        transport.connect(username=FTP_USER, password=FTP_PASS)
-        sftp = paramiko.SFTPClient.from_transport(transport)
-        return sftp, transport
+    def file_path(base: str, filename: str) -> str:
+        """Path of a delivery file in the active storage backend"""
+        return storage.path(base, filename)
+
+    @staticmethod
+    def _apply_items(existing_data: dict, item_name: str = None, item_list: list = None):
+        # Avoid duplication
+        existing_data.setdefault('itemsToGive', [])
+        current_items = set(existing_data['itemsToGive'])
+        if item_list:
+            new_items = [item for item in item_list if item not in current_items]
+            existing_data['itemsToGive'].extend(new_items)
+            existing_data['itemToGive'] = "none"
+        elif item_name and item_name != "none" and item_name not in current_items:
+            existing_data['itemsToGive'].append(item_name)
+            existing_data['itemToGive'] = "none"
 
     @staticmethod
     def update_player_file(steam_id: str, item_name: str = None, item_list: list = None) -> bool:
+        return FTPManager.update_player_file_batch(steam_id, [(item_name, item_list)])
+
+    @staticmethod
+    def update_player_file_batch(steam_id: str, updates: list) -> bool:
+        """Apply several (item_name, item_list) additions in one read-modify-write"""
         if not validate_steam_id(steam_id):
             logger.error(f"Attempt to update file with invalid SteamID: {steam_id}")
             return False
         filename = f"{steam_id}.json"
-        if USE_LOCAL:
-            local_base = LOCAL_BASE_PATH
-            full_path = os.path.join(local_base, filename)
-            try:
-                os.makedirs(local_base, exist_ok=True)
-                existing_data = {}
-                if os.path.exists(full_path):
-                    with open(full_path, 'r', encoding='utf-8') as f:
-                        try:
-                            existing_data = json.load(f)
-                        except:
-                            existing_data = {}
-                else:
-                    existing_data = {"itemToGive": "none", "itemsToGive": []}
-                # Avoid duplication
-                current_items = set(existing_data.get('itemsToGive', []))
-                if item_list:
-                    new_items = [item for item in item_list if item not in current_items]
-                    existing_data['itemsToGive'].extend(new_items)
-                    existing_data['itemToGive'] = "none"
-                elif item_name and item_name != "none" and item_name not in current_items:
-                    existing_data['itemsToGive'].append(item_name)
-                    existing_data['itemToGive'] = "none"
-                with open(full_path, 'w', encoding='utf-8') as f:
-                    json.dump(existing_data, f, indent=4, ensure_ascii=False)
-                logger.info(f"File {filename} updated at {full_path} for SteamID {steam_id}")
-                return True
-            except Exception as e:
-                logger.error(f"Error saving local file {filename}: {str(e)}")
-                return False
-        else:
-            # SFTP Mode
-            sftp = None
-            transport = None
-            try:
-                remote_path = FTP_BASE_PATH
-                if not remote_path.startswith('/'):
-                    remote_path = '/' + remote_path
-                remote_file = f"{remote_path}/{filename}"
-                
-                sftp, transport = FTPManager._get_sftp_connection()
-                existing_data = {}
-                # Try to download existing file
-                try:
-                    with tempfile.NamedTemporaryFile(mode='w+', delete=False, suffix='.json') as tmp:
-                        tmp_path = tmp.name
-                    sftp.get(remote_file, tmp_path)
-                    with open(tmp_path, 'r', encoding='utf-8') as f:
-                        existing_data = json.load(f)
-                    os.unlink(tmp_path)
-                except FileNotFoundError:
-                    existing_data = {"itemToGive": "none", "itemsToGive": []}
-                except Exception as e:
-                    logger.warning(f"Could not read existing file {remote_file}: {str(e)}")
-                    existing_data = {"itemToGive": "none", "itemsToGive": []}
-                
-                # Avoid duplication
-                current_items = set(existing_data.get('itemsToGive', []))
-                if item_list:
-                    new_items = [item for item in item_list if item not in current_items]
-                    existing_data['itemsToGive'].extend(new_items)
-                    existing_data['itemToGive'] = "none"
-                elif item_name and item_name != "none" and item_name not in current_items:
-                    existing_data['itemsToGive'].append(item_name)
-                    existing_data['itemToGive'] = "none"
-                
-                # Upload updated file
-                with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.json', encoding='utf-8') as tmp:
-                    json.dump(existing_data, tmp, indent=4, ensure_ascii=False)
-                    tmp_path = tmp.name
-                
-                sftp.put(tmp_path, remote_file)
-                os.unlink(tmp_path)
-                logger.info(f"File {filename} updated via SFTP at {remote_file} for SteamID {steam_id}")
-                return True
-            except Exception as e:
-                logger.error(f"Error updating file via SFTP {filename}: {str(e)}")
-                logger.error(f"Full traceback: {traceback.format_exc()}")
-                return False
-            finally:
-                if sftp:
-                    sftp.close()
-                if transport:
-                    transport.close()
+        full_path = FTPManager.file_path(PLAYER_FILES_PATH, filename)
+
+        def mutate(existing_data):
+            for item_name, item_list in updates:
+                FTPManager._apply_items(existing_data, item_name, item_list)
+
+        try:
+            storage.update_json(full_path, mutate, default=lambda: {"itemToGive": "none", "itemsToGive": []})
+            logger.info(f"File {filename} updated at {full_path} ({storage.name}) for SteamID {steam_id}")
+            return True
+        except Exception as e:
+            logger.error(f"Error updating file {filename}: {str(e)}")
+            logger.error(f"Full traceback: {traceback.format_exc()}")
+            return False
 
     @staticmethod
     def update_banking_file(steam_id: str, amount: int = 100000) -> bool:
         if not validate_steam_id(steam_id):
             logger.error(f"Attempt to update banking with invalid SteamID: {steam_id}")
             return False
-        
         filename = f"{steam_id}.json"
-        
-        if USE_LOCAL:
-            full_path = os.path.join(BANKING_PATH, filename)
-            try:
-                os.makedirs(BANKING_PATH, exist_ok=True)
-                data = {}
-                # Load existing file without overwriting
-                if os.path.exists(full_path):
-                    with open(full_path, 'r', encoding='utf-8') as f:
-                        try:
-                            data = json.load(f)
-                        except:
-                            data = {}
-                # Only update m_OwnedCurrency, keeping other fields
-                data['m_OwnedCurrency'] = amount
-                with open(full_path, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, indent=4, ensure_ascii=False)
-                logger.info(f"Balance updated to {amount} in {full_path} for SteamID {steam_id}")
-                return True
-            except Exception as e:
-                logger.error(f"Error updating banking {filename}: {str(e)}")
-                return False
-        else:
-            # SFTP mode for banking
-            sftp = None
-            transport = None
-            try:
-                remote_path = BANKING_PATH
-                if not remote_path.startswith('/'):
-                    remote_path = '/' + remote_path
-                remote_file = f"{remote_path}/{filename}"
-                
-                sftp, transport = FTPManager._get_sftp_connection()
-                data = {}
-                # Try to download existing file
-                try:
-                    with tempfile.NamedTemporaryFile(mode='w+', delete=False, suffix='.json') as tmp:
-                        tmp_path = tmp.name
-                    sftp.get(remote_file, tmp_path)
-                    with open(tmp_path, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                    os.unlink(tmp_path)
-                except FileNotFoundError:
-                    pass  # File doesn't exist, will create new
-                except Exception as e:
-                    logger.warning(f"Could not read existing banking file {remote_file}: {str(e)}")
-                
-                # Only update m_OwnedCurrency, keeping other fields
-                data['m_OwnedCurrency'] = amount
-                
-                # Upload updated file
-                with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.json', encoding='utf-8') as tmp:
-                    json.dump(data, tmp, indent=4, ensure_ascii=False)
-                    tmp_path = tmp.name
-                
-                sftp.put(tmp_path, remote_file)
-                os.unlink(tmp_path)
-                logger.info(f"Banking file {filename} updated via SFTP at {remote_file} with balance {amount} for SteamID {steam_id}")
-                return True
-            except Exception as e:
-                logger.error(f"Error updating banking via SFTP {filename}: {str(e)}")
-                logger.error(f"Full traceback: {traceback.format_exc()}")
-                return False
-            finally:
-                if sftp:
-                    sftp.close()
-                if transport:
-                    transport.close()
+        full_path = FTPManager.file_path(BANKING_PATH, filename)
+
+        def mutate(data):
+            # Only update m_OwnedCurrency, keeping other fields
+            data['m_OwnedCurrency'] = amount
+
+        try:
+            storage.update_json(full_path, mutate, default=dict)
+            logger.info(f"Balance updated to {amount} in {full_path} ({storage.name}) for SteamID {steam_id}")
+            return True
+        except Exception as e:
+            logger.error(f"Error updating banking {filename}: {str(e)}")
+            logger.error(f"Full traceback: {traceback.format_exc()}")
+            return False
 
     @staticmethod
     def create_vehicle_file(steam_id: str, class_name: str, spawns: int, cooldown: int, guarantee: int, unique: bool, vehicle_path: str) -> bool:
@@ -369,10 +1447,11 @@ class FTPManager:
         if not validate_steam_id(steam_id):
             logger.error(f"Attempt to create vehicle file with invalid SteamID: {steam_id}")
             return False
-        
+
         # Vehicle filename: use className as filename
         filename = f"{class_name}.json"
-        
+        full_path = FTPManager.file_path(vehicle_path, filename)
+
         vehicle_data = {
             "steamID": steam_id,
             "className": class_name,
@@ -381,57 +1460,169 @@ class FTPManager:
             "guaranteePeriod": guarantee,
             "isUnique": 1 if unique else 0
         }
-        
-        if USE_LOCAL:
-            full_path = os.path.join(vehicle_path, filename)
-            try:
-                os.makedirs(vehicle_path, exist_ok=True)
-                with open(full_path, 'w', encoding='utf-8') as f:
-                    json.dump(vehicle_data, f, indent=4, ensure_ascii=False)
-                logger.info(f"Vehicle file {filename} created at {full_path} for SteamID {steam_id}")
-                return True
-            except Exception as e:
-                logger.error(f"Error creating vehicle file {filename}: {str(e)}")
-                return False
+
+        try:
+            storage.write_json(full_path, vehicle_data)
+            logger.info(f"Vehicle file {filename} created at {full_path} ({storage.name}) for SteamID {steam_id}")
+            return True
+        except Exception as e:
+            logger.error(f"Error creating vehicle file {filename}: {str(e)}")
+            logger.error(f"Full traceback: {traceback.format_exc()}")
+            return False
+
+    # Awaitable counterparts, used from coroutines. Each holds the lock of the file it
+    # rewrites, so writes to one file run one after another and different files in parallel.
+    @staticmethod
+    async def update_player_file_async(steam_id: str, item_name: str = None, item_list: list = None) -> bool:
+        return await FTPManager.update_player_file_batch_async(steam_id, [(item_name, item_list)])
+
+    @staticmethod
+    async def update_player_file_batch_async(steam_id: str, updates: list) -> bool:
+        async with file_locks.hold(FTPManager.file_path(PLAYER_FILES_PATH, f"{steam_id}.json")):
+            return await run_blocking(FTPManager.update_player_file_batch, steam_id, updates)
+
+    @staticmethod
+    async def update_banking_file_async(steam_id: str, amount: int = 100000) -> bool:
+        async with file_locks.hold(FTPManager.file_path(BANKING_PATH, f"{steam_id}.json")):
+            return await run_blocking(FTPManager.update_banking_file, steam_id, amount)
+
+    @staticmethod
+    async def create_vehicle_file_async(steam_id: str, class_name: str, spawns: int, cooldown: int, guarantee: int, unique: bool, vehicle_path: str) -> bool:
+        if not vehicle_path:
+            logger.error("VEHICLE_SPAWN_PATH not defined in .env, cannot create vehicle file")
+            return False
+        async with file_locks.hold(FTPManager.file_path(vehicle_path, f"{class_name}.json")):
+            return await run_blocking(
+                FTPManager.create_vehicle_file,
+                steam_id=steam_id, class_name=class_name, spawns=spawns, cooldown=cooldown,
+                guarantee=guarantee, unique=unique, vehicle_path=vehicle_path
+            )
+
+
+# Per-SteamID delivery coalescing
+class DeliveryCoalescer:
+    """Merges deliveries to the same SteamID that arrive within a short window into one write per file"""
+    def __init__(self, window: float):
+        self.window = window
+        self._pending = {}  # steam_id -> {"items": [((item_name, item_list), future)], "banking": [(amount, future)]}
+        self._tails = {}  # steam_id -> last flush task, so flushes for one player never overlap
+
+    async def add_items(self, steam_id: str, item_name: str = None, item_list: list = None) -> bool:
+        if self.window <= 0:
+            return await FTPManager.update_player_file_async(steam_id, item_name=item_name, item_list=item_list)
+        return await self._enqueue(steam_id, "items", (item_name, item_list))
+
+    async def set_banking(self, steam_id: str, amount: int) -> bool:
+        if self.window <= 0:
+            return await FTPManager.update_banking_file_async(steam_id, amount)
+        return await self._enqueue(steam_id, "banking", amount)
+
+    async def _enqueue(self, steam_id: str, kind: str, payload) -> bool:
+        future = asyncio.get_running_loop().create_future()
+        batch = self._pending.get(steam_id)
+        if batch is None:
+            batch = self._pending[steam_id] = {"items": [], "banking": []}
+            task = asyncio.create_task(self._flush(steam_id, self._tails.get(steam_id)))
+            self._tails[steam_id] = task
+            task.add_done_callback(functools.partial(self._forget, steam_id))
+        batch[kind].append((payload, future))
+        return await asyncio.shield(future)
+
+    def _forget(self, steam_id: str, task):
+        if self._tails.get(steam_id) is task:
+            del self._tails[steam_id]
+
+    @staticmethod
+    def _resolve(entries: list, result: bool):
+        for _, future in entries:
+            if not future.done():
+                future.set_result(result)
+
+    async def _flush(self, steam_id: str, previous):
+        await asyncio.sleep(self.window)
+        if previous:
+            await asyncio.wait([previous])
+        batch = self._pending.pop(steam_id)
+        items, banking = batch["items"], batch["banking"]
+        size = len(items) + len(banking)
+        if size > 1:
+            logger.info(f"Coalescing {size} deliveries for SteamID {steam_id}")
+
+        async def write_items():
+            if items:
+                ok = await FTPManager.update_player_file_batch_async(steam_id, [payload for payload, _ in items])
+                self._resolve(items, ok)
+
+        async def write_banking():
+            if banking:
+                # Banking sets an absolute balance, so the latest request wins
+                ok = await FTPManager.update_banking_file_async(steam_id, banking[-1][0])
+                self._resolve(banking, ok)
+
+        try:
+            await asyncio.gather(write_items(), write_banking())
+        except Exception as e:
+            logger.error(f"Error flushing deliveries for SteamID {steam_id}: {str(e)}")
+        finally:
+            self._resolve(items, False)
+            self._resolve(banking, False)
+
+delivery_queue = DeliveryCoalescer(DELIVERY_COALESCE_WINDOW)
+
+# Payment status cache: repeated checks of one payment share a single PayPal lookup
+class PaymentStatusCache:
+    TERMINAL = ("approved", "delivered", "failed", "canceled", "expired")
+
+    def __init__(self, ttl: float, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}  # payment_id -> (status, expires_at); terminal states never expire
+        self._inflight = {}  # payment_id -> future of the PayPal lookup in progress
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0}
+
+    def mark(self, payment_id: str, status: str):
+        self._entries.pop(payment_id, None)
+        self._entries[payment_id] = (status, float('inf') if status in self.TERMINAL else time.monotonic() + self.ttl)
+        while len(self._entries) > self.max_entries:
+            self._entries.pop(next(iter(self._entries)))
+
+    async def _load(self, payment_id: str, fetch) -> str:
+        status = await fetch(payment_id)
+        if status != "error":
+            # A later 'delivered' mark must not be downgraded by a lookup that was already running
+            current = self._entries.get(payment_id)
+            if not current or current[0] != "delivered":
+                self.mark(payment_id, status)
+            else:
+                status = current[0]
+        return status
+
+    async def get(self, payment_id: str, fetch) -> str:
+        entry = self._entries.get(payment_id)
+        if entry and entry[1] > time.monotonic():
+            self.stats["hits"] += 1
+            return entry[0]
+        future = self._inflight.get(payment_id)
+        if future is None:
+            self.stats["misses"] += 1
+            future = asyncio.ensure_future(self._load(payment_id, fetch))
+            self._inflight[payment_id] = future
+            future.add_done_callback(lambda _: self._inflight.pop(payment_id, None))
         else:
-            # SFTP mode for vehicle
-            sftp = None
-            transport = None
-            try:
-                remote_path = vehicle_path
-                if not remote_path.startswith('/'):
-                    remote_path = '/' + remote_path
-                remote_file = f"{remote_path}/{filename}"
-                
-                sftp, transport = FTPManager._get_sftp_connection()
-                
-                # Upload vehicle file directly
-                with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.json', encoding='utf-8') as tmp:
-                    json.dump(vehicle_data, tmp, indent=4, ensure_ascii=False)
-                    tmp_path = tmp.name
-                
-                sftp.put(tmp_path, remote_file)
-                os.unlink(tmp_path)
-                logger.info(f"Vehicle file {filename} created via SFTP at {remote_file} for SteamID {steam_id}")
-                return True
-            except Exception as e:
-                logger.error(f"Error creating vehicle file via SFTP {filename}: {str(e)}")
-                logger.error(f"Full traceback: {traceback.format_exc()}")
-                return False
-            finally:
-                if sftp:
-                    sftp.close()
-                if transport:
-                    transport.close()
+            self.stats["coalesced"] += 1
+        # Shielded so one caller giving up does not cancel the lookup the others wait on
+        return await asyncio.shield(future)
+
+payment_status_cache = PaymentStatusCache(PAYMENT_STATUS_TTL)
 
 # PayPal helpers
 class PayPalPayment:
     @staticmethod
-    async def create_payment(amount: float, description: str, user_id: int, item_id: str, item_type: str, steam_target: str, insurance: bool, coupon_code: str = None):
+    async def create_payment(amount: float, description: str, user_id: int, item_id: str, item_type: str, steam_target: str, insurance: bool, coupon_code: str = None, reservation: str = None):
         if amount <= 0:
             return {"status": "free", "message": "Free item"}
         try:
-            payment = paypalrestsdk.Payment({
+            status, payment = await paypal_client.create_payment({
                 "intent": "sale",
                 "payer": {
                     "payment_method": "paypal"
@@ -448,15 +1639,15 @@ class PayPalPayment:
                     "cancel_url": "http://cancel.url"
                 }
             })
-            
-            if payment.create():
-                payment_id = payment.id
+
+            if status in (200, 201) and payment.get("id"):
+                payment_id = payment["id"]
                 approval_url = None
-                for link in payment.links:
-                    if link.rel == "approval_url":
-                        approval_url = link.href
+                for link in payment.get("links", []):
+                    if link.get("rel") == "approval_url":
+                        approval_url = link.get("href")
                         break
-                
+
                 pending_payments[payment_id] = {
                     "user_id": user_id,
                     "item_id": item_id,
@@ -464,26 +1655,36 @@ class PayPalPayment:
                     "steam_target": steam_target,
                     "insurance": insurance,
                     "amount": amount,
-                    "coupon": coupon_code
+                    "coupon": coupon_code,
+                    "coupon_reservation": reservation,
+                    "created_at": time.time()
                 }
+                state_store.save('pending', payment_id)
                 return {"status": "pending", "payment_id": payment_id, "approval_url": approval_url}
             else:
-                logger.error(f"Error creating PayPal payment: {payment.error}")
-                return {"status": "error", "message": str(payment.error)}
+                logger.error(f"Error creating PayPal payment ({status}): {payment}")
+                return {"status": "error", "message": str(payment.get("message") or payment)}
         except Exception as e:
             logger.error(f"Error creating payment: {str(e)}")
             return {"status": "error", "message": str(e)}
 
     @staticmethod
     async def check_payment_status(payment_id: str) -> str:
+        return await payment_status_cache.get(payment_id, PayPalPayment._fetch_status)
+
+    @staticmethod
+    async def _fetch_status(payment_id: str) -> str:
         try:
-            payment = paypalrestsdk.Payment.find(payment_id)
-            if payment.state == "approved":
+            status, payment = await paypal_client.find_payment(payment_id)
+            if status != 200:
+                logger.error(f"Error checking payment status {payment_id} ({status}): {payment}")
+                return "error"
+            if payment.get("state") == "approved":
                 return "approved"
-            elif payment.state == "created":
+            elif payment.get("state") == "created":
                 return "pending"
             else:
-                return payment.state
+                return payment.get("state")
         except Exception as e:
             logger.error(f"Error checking payment status {payment_id}: {str(e)}")
             return "error"
@@ -503,7 +1704,8 @@ class DeleteItemModal(Modal):
             return
         if self.item_id in items_catalog:
             del items_catalog[self.item_id]
-            save_json(ITEMS_FILE, items_catalog)
+            state_store.save('items', self.item_id)
+            catalog.refresh('item', self.item_id)
             save_list_to_txt(ITEMS_LIST_TXT, items_catalog)
             sales_channel = bot.get_channel(SALES_CHANNEL_ID)
             if sales_channel:
@@ -528,7 +1730,7 @@ class DeleteCouponModal(Modal):
             return
         if self.code in coupons:
             del coupons[self.code]
-            save_json(COUPONS_FILE, coupons)
+            state_store.save('coupons', self.code)
             await interaction.response.send_message(f"✅ Coupon **{self.code}** deleted successfully.", ephemeral=True)
         else:
             await interaction.response.send_message("Coupon not found.", ephemeral=True)
@@ -547,7 +1749,8 @@ class DeleteVehicleModal(Modal):
             return
         if self.item_id in items_catalog:
             del items_catalog[self.item_id]
-            save_json(ITEMS_FILE, items_catalog)
+            state_store.save('items', self.item_id)
+            catalog.refresh('item', self.item_id)
             save_list_to_txt(ITEMS_LIST_TXT, items_catalog)
             sales_channel = bot.get_channel(SALES_CHANNEL_ID)
             if sales_channel:
@@ -622,7 +1825,8 @@ class CreateItemModal(Modal):
                 "variations": variations
             }
             items_catalog[item_id] = item_obj
-            save_json(ITEMS_FILE, items_catalog)
+            state_store.save('items', item_id)
+            catalog.refresh('item', item_id)
             save_list_to_txt(ITEMS_LIST_TXT, items_catalog)
             await interaction.response.send_message(f"✅ Item **{self.name.value}** created with ID `{item_id}`.", ephemeral=True)
         except Exception as e:
@@ -703,7 +1907,8 @@ class EditItemModal(Modal):
                 "is_vehicle": is_vehicle,
                 "insurance_drops": drops
             }
-            save_json(ITEMS_FILE, items_catalog)
+            state_store.save('items', self.item_id)
+            catalog.refresh('item', self.item_id)
             save_list_to_txt(ITEMS_LIST_TXT, items_catalog)
 
             sales_channel = bot.get_channel(SALES_CHANNEL_ID)
@@ -746,7 +1951,7 @@ class CreateCouponModal(Modal):
             if discount < 0 or discount > 100:
                 await interaction.response.send_message("Invalid discount.", ephemeral=True); return
             coupons[code] = {"discount": discount, "uses": uses}
-            save_json(COUPONS_FILE, coupons)
+            state_store.save('coupons', code)
             await interaction.response.send_message(f"✅ Coupon {code} created.", ephemeral=True)
         except Exception as e:
             await interaction.response.send_message(f"Error: {str(e)}", ephemeral=True)
@@ -767,7 +1972,7 @@ class EditCouponModal(Modal):
             if discount < 0 or discount > 100:
                 await interaction.response.send_message("Invalid discount.", ephemeral=True); return
             coupons[self.code] = {"discount": discount, "uses": uses}
-            save_json(COUPONS_FILE, coupons)
+            state_store.save('coupons', self.code)
             await interaction.response.send_message(f"✅ Coupon {self.code} updated.", ephemeral=True)
         except Exception as e:
             await interaction.response.send_message(f"Error: {str(e)}", ephemeral=True)
@@ -871,7 +2076,8 @@ class CreateVehicleModal(Modal):
                 ]
             }
             items_catalog[item_id] = item_obj
-            save_json(ITEMS_FILE, items_catalog)
+            state_store.save('items', item_id)
+            catalog.refresh('item', item_id)
             save_list_to_txt(ITEMS_LIST_TXT, items_catalog)
             await interaction.response.send_message(f"✅ Vehicle **{self.name.value}** created with ID `{item_id}`.", ephemeral=True)
         except Exception as e:
@@ -888,9 +2094,107 @@ class VincularSteamModal(Modal):
         if not validate_steam_id(steam):
             await interaction.response.send_message("Invalid SteamID.", ephemeral=True); return
         user_data[str(interaction.user.id)] = steam
-        save_json(USER_DATA_FILE, user_data)
+        state_store.save('users', str(interaction.user.id))
         await interaction.response.send_message("✅ SteamID linked (used for insurance).", ephemeral=True)
 
+async def finalize_payment(payment_id: str, interaction=None):
+    """Deliver an approved pending payment exactly once, whichever of the Check Payment button
+    or the webhook gets here first. Returns None if it was already taken, else True/False"""
+    # Popping before any await claims the order; a concurrent caller sees it gone
+    info = pending_payments.pop(payment_id, None)
+    if info is None:
+        return None
+    item_id = info.get("item_id")
+    item_type = info.get("type")
+    variation_index = info.get("variation_index", 0)
+    entry = catalog.get(item_id, item_type)
+    success = await process_approved_payment(
+        interaction,
+        item_id,
+        item_type,
+        info.get("steam_target"),
+        info.get("coupon"),
+        info.get("amount"),
+        payment_id,
+        info.get("user_id"),
+        override_script=info.get("script"),
+        variation_index=variation_index,
+        coupon_reservation=info.get("coupon_reservation")
+    )
+    if not success:
+        # Put the order back so it can be retried
+        pending_payments[payment_id] = info
+        logger.error(f"Failed to process delivery for payment {payment_id}")
+        return False
+    state_store.save('pending', payment_id)
+    payment_status_cache.mark(payment_id, "delivered")
+    # Registrar compra com seguro se aplicável
+    drops = entry.insured_drops(variation_index) if entry else 0
+    if info.get("insurance") and drops > 0:
+        compra_id = generate_unique_id("compra")
+        compras[compra_id] = {
+            "user_id": str(info.get("user_id")),
+            "steam_id": info.get("steam_target"),
+            "item_id": item_id,
+            "item_name": entry.name,
+            "variation_index": variation_index,
+            "drops": drops,
+            "created_at": time.time()
+        }
+        state_store.save('compras', compra_id, event='purchase')
+        purchase_index.sync(compra_id)
+        logger.info(f"Purchase registered: {compra_id} for user {info.get('user_id')}, SteamID {info.get('steam_target')}")
+    return True
+
+class ThreadPaymentView(View):
+    """Buttons of an order thread. Custom IDs carry the payment ID and everything else comes from
+    pending_payments, so the view can be re-registered after a restart (see on_ready)"""
+    def __init__(self, payment_id: str):
+        super().__init__(timeout=None)
+        self.payment_id = payment_id
+        self.check_payment.custom_id = f"payment_check:{payment_id}"
+        self.confirm_receipt.custom_id = f"payment_confirm:{payment_id}"
+        self.cancel_purchase.custom_id = f"payment_cancel:{payment_id}"
+
+    @discord.ui.button(label="🔁 Check Payment", style=discord.ButtonStyle.primary)
+    async def check_payment(self, interaction: discord.Interaction, button: Button):
+        status = await PayPalPayment.check_payment_status(self.payment_id)
+        if status == "delivered":
+            await interaction.response.send_message("✅ This order was already delivered.", ephemeral=True)
+        elif status == "approved":
+            result = await finalize_payment(self.payment_id, interaction)
+            if result is None:
+                await interaction.response.send_message("Payment already processed or not found.", ephemeral=True)
+            elif result:
+                await interaction.response.send_message("✅ Payment approved, your item will arrive in-game shortly! Use the insurance channel to activate.", ephemeral=True)
+            else:
+                await interaction.response.send_message("❌ Error processing delivery.", ephemeral=True)
+        elif status in ("pending", "in_process"):
+            await interaction.response.send_message(f"ℹ️ Payment still pending ({status}).", ephemeral=True)
+        else:
+            logger.error(f"Invalid payment status: {status} for payment {self.payment_id}")
+            await interaction.response.send_message(f"❌ Status: {status}.", ephemeral=True)
+
+    @discord.ui.button(label="✅ Confirm Receipt", style=discord.ButtonStyle.success)
+    async def confirm_receipt(self, interaction: discord.Interaction, button: Button):
+        await interaction.response.send_message("Thread will be closed.", ephemeral=True)
+        try:
+            await interaction.channel.delete()
+        except Exception as e:
+            logger.error(f"Erro ao deletar thread: {str(e)}")
+
+    @discord.ui.button(label="❌ Cancel Purchase", style=discord.ButtonStyle.danger)
+    async def cancel_purchase(self, interaction: discord.Interaction, button: Button):
+        info = pending_payments.pop(self.payment_id, None)
+        if info is not None:
+            coupon_reservations.release(info.get("coupon_reservation"))
+            state_store.save('pending', self.payment_id)
+        await interaction.response.send_message("Purchase canceled. Thread will be closed.", ephemeral=True)
+        try:
+            await interaction.channel.delete()
+        except Exception as e:
+            logger.error(f"Erro ao deletar thread: {str(e)}")
+
 class PurchaseSteamModal(Modal):
     def __init__(self, item_id: str, item_type: str, item_data: dict, variation_index: int = 0):
         title = "Enter SteamID for delivery"
@@ -899,23 +2203,10 @@ class PurchaseSteamModal(Modal):
         self.item_type = item_type
         self.item_data = item_data
         self.variation_index = variation_index
+        self.entry = catalog.get(item_id, item_type) or CatalogEntry(item_id, item_type, item_data)
         self.steam_id = TextInput(label="SteamID64 (destination)", required=True)
-        # Determine if insurance should be prompted: check variation or item flags
-        variation = None
-        if item_data.get('variations'):
-            try:
-                variation = item_data['variations'][variation_index]
-            except:
-                variation = item_data['variations'][0] if item_data['variations'] else None
-        is_vehicle = False
-        drops = int(item_data.get('insurance_drops', 0) or 0)
-        if variation:
-            is_vehicle = variation.get('is_vehicle', item_data.get('is_vehicle', False))
-            drops = int(variation.get('insurance_drops', drops) or drops)
-        else:
-            is_vehicle = item_data.get('is_vehicle', False)
         # Only show insurance choice if vehicle and drops > 0
-        if is_vehicle and drops > 0:
+        if self.entry.insured_drops(variation_index) > 0:
             self.insurance_choice = TextInput(label="Want insurance? (y/n)", default="n", required=False)
             self.add_item(self.insurance_choice)
         else:
@@ -944,6 +2235,7 @@ class PurchaseSteamModal(Modal):
         original_price = self.item_data.get('price', 0.0)
         final_price = original_price
         applied_coupon = None
+        reservation = None
 
         # Validate and apply coupon
         if coupon_code:
@@ -951,7 +2243,8 @@ class PurchaseSteamModal(Modal):
                 logger.error(f"Invalid coupon: {coupon_code}")
                 await interaction.response.send_message("Invalid coupon.", ephemeral=True)
                 return
-            if coupons[coupon_code]['uses'] == 0:
+            reservation = coupon_reservations.reserve(coupon_code)
+            if not reservation:
                 logger.error(f"Coupon {coupon_code} has no uses available")
                 await interaction.response.send_message("Coupon has no uses available.", ephemeral=True)
                 return
@@ -959,14 +2252,8 @@ class PurchaseSteamModal(Modal):
             final_price = max(0.0, original_price * (1 - discount / 100))
             applied_coupon = coupon_code
 
-        # Determine override_script from variation
-        override_script = None
-        try:
-            variation = self.item_data.get('variations', [None])[self.variation_index]
-            if variation:
-                override_script = variation.get('script')
-        except Exception:
-            override_script = None
+        # Delivery script of the selected variation, parsed when the catalog was compiled
+        override_script = self.entry.script(self.variation_index) or None
 
         # If final price is 0 -> immediate delivery
         if final_price == 0.0:
@@ -980,34 +2267,37 @@ class PurchaseSteamModal(Modal):
                 steam_target,
                 applied_coupon,
                 0.0,
-                "free_item",
+                generate_unique_id("free"),
                 interaction.user.id,
-                override_script=override_script
+                override_script=override_script,
+                coupon_reservation=reservation
             )
             if success:
-                if applied_coupon and coupons[applied_coupon]['uses'] > 0:
-                    coupons[applied_coupon]['uses'] -= 1
-                    save_json(COUPONS_FILE, coupons)
-                # Registrar seguros se aplicável
-                is_vehicle = False
-                drops = 0
-                if variation:
-                    is_vehicle = variation.get('is_vehicle', self.item_data.get('is_vehicle', False))
-                    drops = int(variation.get('insurance_drops', self.item_data.get('insurance_drops', 0) or 0))
-                if insurance_choice and is_vehicle and drops > 0:
-                    seguros[steam_target] = seguros.get(steam_target, 0) + drops
-                    save_json(SEGUROS_FILE, seguros)
-                    compra_id = generate_unique_id("compra")
-                    compras[compra_id] = {
-                        "user_id": str(interaction.user.id),
-                        "steam_id": steam_target,
-                        "item_id": self.item_id,
-                        "item_name": self.item_data.get("name"),
-                        "drops": drops
-                    }
-                    save_json(COMPRAS_FILE, compras)
-                await interaction.followup.send("✅ Free item delivered successfully! Use the insurance channel to activate.", ephemeral=True)
+                try:
+                    with state_store.transaction():
+                        # Registrar seguros se aplicável
+                        drops = self.entry.insured_drops(self.variation_index)
+                        if insurance_choice and drops > 0:
+                            seguros[steam_target] = seguros.get(steam_target, 0) + drops
+                            state_store.save('seguros', steam_target, event='insurance_grant')
+                            compra_id = generate_unique_id("compra")
+                            compras[compra_id] = {
+                                "user_id": str(interaction.user.id),
+                                "steam_id": steam_target,
+                                "item_id": self.item_id,
+                                "item_name": self.item_data.get("name"),
+                                "variation_index": self.variation_index,
+                                "drops": drops,
+                                "created_at": time.time()
+                            }
+                            state_store.save('compras', compra_id, event='purchase')
+                            purchase_index.sync(compra_id)
+                except Exception as e:
+                    # The item is already on its way; only the insurance record failed to save
+                    logger.error(f"Error registering insurance of free purchase for SteamID {steam_target}: {str(e)}")
+                await interaction.followup.send("✅ Free item confirmed, it will arrive in-game shortly! Use the insurance channel to activate.", ephemeral=True)
             else:
+                coupon_reservations.release(reservation)
                 await interaction.followup.send("Error delivering free item.", ephemeral=True)
             return
 
@@ -1023,8 +2313,11 @@ class PurchaseSteamModal(Modal):
             item_type=self.item_type,
             steam_target=steam_target,
             insurance=insurance_choice,
-            coupon_code=applied_coupon
+            coupon_code=applied_coupon,
+            reservation=reservation
         )
+        if payment_result["status"] != "pending":
+            coupon_reservations.release(reservation)
         sales_channel = bot.get_channel(SALES_CHANNEL_ID)
         if not sales_channel:
             logger.error("Sales channel not found")
@@ -1053,98 +2346,14 @@ class PurchaseSteamModal(Modal):
             )
             embed.set_footer(text=f"Payment ID: {payment_id}")
 
-            class ThreadPaymentView(View):
-                def __init__(self, thread_obj, payment_id, steam_target, item_id, item_type, item_data, insurance_choice, variation_index, override_script):
-                    super().__init__(timeout=None)
-                    self.thread = thread_obj
-                    self.payment_id = payment_id
-                    self.steam_target = steam_target
-                    self.item_id = item_id
-                    self.item_type = item_type
-                    self.item_data = item_data
-                    self.insurance_choice = insurance_choice
-                    self.variation_index = variation_index
-                    self.override_script = override_script
-
-                @discord.ui.button(label="🔁 Check Payment", style=discord.ButtonStyle.primary)
-                async def check_payment(self, interaction: discord.Interaction, button: Button):
-                    status = await PayPalPayment.check_payment_status(self.payment_id)
-                    if status == "approved":
-                        info = pending_payments.get(self.payment_id)
-                        if not info:
-                            logger.error(f"Payment {self.payment_id} not found in pending_payments")
-                            await interaction.response.send_message("Payment not found (bot restart?).", ephemeral=True)
-                            return
-                        success = await process_approved_payment(
-                            interaction,
-                            self.item_id,
-                            self.item_type,
-                            info.get("steam_target"),
-                            info.get("coupon"),
-                            info.get("amount"),
-                            self.payment_id,
-                            interaction.user.id,
-                            override_script=self.override_script,
-                            variation_index=self.variation_index
-                        )
-                        if success:
-                            try:
-                                del pending_payments[self.payment_id]
-                            except:
-                                pass
-                            # Registrar compra com seguro se aplicável
-                            is_vehicle = False
-                            drops = 0
-                            try:
-                                var = self.item_data.get('variations', [None])[self.variation_index]
-                                if var:
-                                    is_vehicle = var.get('is_vehicle', self.item_data.get('is_vehicle', False))
-                                    drops = int(var.get('insurance_drops', self.item_data.get('insurance_drops', 0) or 0))
-                            except:
-                                pass
-                            if self.insurance_choice and is_vehicle and drops > 0:
-                                compra_id = generate_unique_id("compra")
-                                compras[compra_id] = {
-                                    "user_id": str(interaction.user.id),
-                                    "steam_id": self.steam_target,
-                                    "item_id": self.item_id,
-                                    "item_name": self.item_data.get("name"),
-                                    "drops": drops
-                                }
-                                save_json(COMPRAS_FILE, compras)
-                                logger.info(f"Purchase registered: {compra_id} for user {interaction.user.id}, SteamID {self.steam_target}")
-                            await interaction.response.send_message("✅ Payment approved and item delivered! Use the insurance channel to activate.", ephemeral=True)
-                        else:
-                            logger.error(f"Failed to process delivery for payment {self.payment_id}")
-                            await interaction.response.send_message("❌ Error processing delivery.", ephemeral=True)
-                    elif status in ("pending", "in_process"):
-                        await interaction.response.send_message(f"ℹ️ Payment still pending ({status}).", ephemeral=True)
-                    else:
-                        logger.error(f"Invalid payment status: {status} for payment {self.payment_id}")
-                        await interaction.response.send_message(f"❌ Status: {status}.", ephemeral=True)
-
-                @discord.ui.button(label="✅ Confirm Receipt", style=discord.ButtonStyle.success)
-                async def confirm_receipt(self, interaction: discord.Interaction, button: Button):
-                    await interaction.response.send_message("Thread will be closed.", ephemeral=True)
-                    try:
-                        await self.thread.delete()
-                    except Exception as e:
-                        logger.error(f"Erro ao deletar thread: {str(e)}")
-
-                @discord.ui.button(label="❌ Cancel Purchase", style=discord.ButtonStyle.danger)
-                async def cancel_purchase(self, interaction: discord.Interaction, button: Button):
-                    try:
-                        if self.payment_id in pending_payments:
-                            del pending_payments[self.payment_id]
-                    except:
-                        pass
-                    await interaction.response.send_message("Purchase canceled. Thread will be closed.", ephemeral=True)
-                    try:
-                        await self.thread.delete()
-                    except Exception as e:
-                        logger.error(f"Erro ao deletar thread: {str(e)}")
-
-            view_thread = ThreadPaymentView(thread, payment_id, steam_target, self.item_id, self.item_type, self.item_data, insurance_choice, self.variation_index, override_script)
+            if payment_id in pending_payments:
+                pending_payments[payment_id].update({
+                    "variation_index": self.variation_index,
+                    "script": override_script,
+                    "thread_id": thread.id
+                })
+                state_store.save('pending', payment_id)
+            view_thread = ThreadPaymentView(payment_id)
             try:
                 await thread.send(embed=embed, view=view_thread)
             except Exception as e:
@@ -1154,18 +2363,10 @@ class PurchaseSteamModal(Modal):
 
             # Register insurance temporarily (only warning in thread)
             if insurance_choice:
-                is_vehicle = False
-                drops = 0
-                try:
-                    variation = self.item_data.get('variations', [None])[self.variation_index]
-                    if variation:
-                        is_vehicle = variation.get('is_vehicle', self.item_data.get('is_vehicle', False))
-                        drops = int(variation.get('insurance_drops', self.item_data.get('insurance_drops', 0) or 0))
-                except:
-                    pass
-                if is_vehicle and drops > 0:
+                drops = self.entry.insured_drops(self.variation_index)
+                if drops > 0:
                     seguros[steam_target] = seguros.get(steam_target, 0) + drops
-                    save_json(SEGUROS_FILE, seguros)
+                    state_store.save('seguros', steam_target, event='insurance_grant')
                     await thread.send(f"✅ Insurance contracted! {drops} insurance(s) added for SteamID `{steam_target}`. Use the insurance channel to activate.")
 
             await interaction.followup.send(f"✅ Order created. Check the thread: {thread.mention}", ephemeral=True)
@@ -1200,37 +2401,40 @@ class SegurosView(View):
                     return
                 # NEW: Verify if user is the buyer
                 user_id = str(interaction2.user.id)
-                compra_id = None
-                item_data = None
-                for cid, compra in compras.items():
-                    if compra["steam_id"] == steam and compra["user_id"] == user_id and compra["drops"] > 0:
-                        compra_id = cid
-                        item_data = items_catalog.get(compra["item_id"], {})
-                        break
-                if not item_data or not item_data.get("is_vehicle", False):
+                compra_id = purchase_index.first_open(steam, user_id)
+                entry = catalog.get(compras[compra_id]["item_id"]) if compra_id else None
+                # Purchases from before variation_index was recorded use the first insurable variation
+                variation = None
+                if entry:
+                    index = compras[compra_id].get("variation_index")
+                    variation = entry.variation(index) if index is not None else next((v for v in entry.variations if v.insurable), entry.variation())
+                if not variation or not variation.is_vehicle:
                     logger.error(f"User {user_id} is not the buyer or item is not a vehicle for SteamID {steam}")
                     await interaction2.response.send_message("You are not the buyer of this insurance or the item is not a vehicle.", ephemeral=True)
                     return
-                try:
-                    script_data = json.loads(item_data.get('script', '{}'))
-                    logger.info(f"JSON script loaded for item {item_data.get('name')}: {script_data}")
-                except Exception as e:
-                    logger.error(f"Error parsing JSON script: {str(e)}")
+                script_data = variation.script
+                if not script_data:
                     await interaction2.response.send_message("Invalid item script.", ephemeral=True)
                     return
-                success = FTPManager.update_player_file(steam, item_list=script_data.get('itemsToGive', []) or None, item_name=script_data.get('itemToGive'))
+                # Defer so the interaction survives a slow delivery
+                await interaction2.response.defer(ephemeral=True)
+                success = await delivery_queue.add_items(steam, item_list=script_data.get('itemsToGive', []) or None, item_name=script_data.get('itemToGive'))
                 if success:
                     seguros[steam] = max(0, seguros.get(steam, 0) - 1)
-                    save_json(SEGUROS_FILE, seguros)
                     compras[compra_id]["drops"] = max(0, compras[compra_id]["drops"] - 1)  # NEW: Reduce drops in purchase
-                    save_json(COMPRAS_FILE, compras)
+                    try:
+                        with state_store.transaction():
+                            state_store.save('seguros', steam, event='insurance_activation')
+                            state_store.save('compras', compra_id, event='insurance_activation')
+                    except Exception as e:
+                        logger.error(f"Error saving insurance activation for SteamID {steam}: {str(e)}")
+                    purchase_index.sync(compra_id)
                     logger.info(f"Insurance activated successfully for SteamID {steam}. Remaining insurance: {seguros.get(steam, 0)}")
-                    with open(SEGUROS_LOG, 'a', encoding='utf-8') as f:
-                        f.write(f"{datetime.now().isoformat()} - Insurance activated by {interaction2.user.id} for SteamID {steam} - Item {item_data.get('name')}\n")
-                    await interaction2.response.send_message("✅ Insurance activated. Vehicle dropped.", ephemeral=True)
+                    await run_blocking(append_line, SEGUROS_LOG, f"{datetime.now().isoformat()} - Insurance activated by {interaction2.user.id} for SteamID {steam} - Item {entry.name}\n")
+                    await interaction2.followup.send("✅ Insurance activated. Vehicle dropped.", ephemeral=True)
                 else:
                     logger.error(f"Failed to drop vehicle for SteamID {steam}")
-                    await interaction2.response.send_message("Error dropping vehicle.", ephemeral=True)
+                    await interaction2.followup.send("Error dropping vehicle.", ephemeral=True)
         modal = AcionarSeguroModal()
         await interaction.response.send_modal(modal)
 
@@ -1349,7 +2553,7 @@ class SaldoDeleteSelectView(View):
     @discord.ui.select(
         placeholder="Choose a balance package to delete...",
         options=[discord.SelectOption(label=data.get('name', 'Unknown Balance'), value=item_id)
-                 for item_id, data in items_catalog.items() if data.get('variations', [{}])[0].get('script', {}).get('banking', False)]
+                 for item_id, data in items_catalog.items() if catalog.get(item_id) and catalog.get(item_id).script().get('banking', False)]
                  or [discord.SelectOption(label="No balance packages available", value="none")]
     )
     async def select_saldo(self, interaction: discord.Interaction, select: discord.ui.Select):
@@ -1384,122 +2588,573 @@ class VehicleDeleteSelectView(View):
             return
         await interaction.response.send_modal(DeleteVehicleModal(item_id, item_data.get('name', '')))
 
-async def process_approved_payment(interaction, item_id, item_type, steam_id, coupon_code, amount, payment_id, user_id, override_script=None, variation_index=0):
-    try:
-        catalog = items_catalog if item_type == 'item' else passes_catalog
-        if item_id not in catalog:
-            logger.error(f"Item/Pass {item_id} not found.")
-            if interaction:
-                await interaction.followup.send("Item not found.", ephemeral=True)
+async def deliver_script(steam_id: str, item_data: dict, item_type: str, script_data: dict, steps: dict = None, checkpoint=None):
+    """Run the file deliveries of one order. Returns None on success or an error message.
+    With a steps dict from the delivery ledger, steps already done are skipped and each finished
+    step is recorded (then checkpoint is awaited), so a retry resumes from the failed step"""
+    steps = {} if steps is None else steps
+
+    async def run_step(name: str, action) -> bool:
+        if steps.get(name) == "done":
+            logger.info(f"Skipping {name} for {steam_id}: already delivered")
+            return True
+        ok = await action()
+        steps[name] = "done" if ok else "failed"
+        if checkpoint:
+            await checkpoint()
+        return ok
+
+    # Check if this is a vehicle spawn item
+    vehicle_type = item_data.get('vehicle_type')
+    if vehicle_type == 'spawn_vehicle':
+        # Vehicle spawn delivery - extract from script_data
+        class_name = script_data.get('vehicleClassName', '')
+        spawns = script_data.get('amountOfAvailableSpawns', 1)
+        cooldown = script_data.get('timeBeforeNextSpawn', 600)
+        guarantee = script_data.get('guaranteePeriod', 604800)
+        is_unique = script_data.get('isUnique', True)
+
+        success = await run_step("vehicle", lambda: FTPManager.create_vehicle_file_async(
+            steam_id=steam_id,
+            class_name=class_name,
+            spawns=spawns,
+            cooldown=cooldown,
+            guarantee=guarantee,
+            unique=is_unique,
+            vehicle_path=VEHICLE_SPAWN_PATH
+        ))
+
+        if not success:
+            logger.error(f"Failed to create vehicle spawn file for {class_name}")
+            return "Error delivering vehicle spawn."
+
+        logger.info(f"Vehicle spawn {class_name} delivered to {steam_id}")
+        return None
+
+    # Deliver normal items
+    item_to_give = script_data.get('itemToGive') if item_type == 'item' else None
+    items_to_give = script_data.get('itemsToGive', [])
+    if item_to_give and item_to_give != "none":
+        success = await run_step("items", lambda: delivery_queue.add_items(steam_id, item_name=item_to_give))
+    elif items_to_give:
+        success = await run_step("items", lambda: delivery_queue.add_items(steam_id, item_list=items_to_give))
+    else:
+        success = True  # Allow success if only banking
+
+    # Add balance if "banking": true in script
+    if script_data.get('banking', False):
+        banking_amount = script_data.get('currencyAmount', 100000)  # Use currencyAmount if present, fallback to 100000
+        banking_success = await run_step("banking", lambda: delivery_queue.set_banking(steam_id, banking_amount))
+        if not banking_success:
+            logger.error("Failed to update banking balance")
+            return "Error adding balance."
+        logger.info(f"Banking balance updated to {banking_amount} for {steam_id}")
+
+    if not success:
+        logger.error("Failed to deliver item via FTPManager")
+        return "Error delivering item."
+    return None
+
+# Delivery ledger: per payment, the overall state (reserved, delivering, delivered, failed) and
+# which steps (items, banking, vehicle) are done, so duplicates and retries never re-grant
+class DeliveryLedger:
+    """Per-payment delivery state. Every change is one appended journal line; the snapshot is
+    rewritten (dropping delivered payments past retention) only when the journal grows or ages"""
+    def __init__(self, filename: str, retention_days: float, compact_bytes: int, compact_interval: float):
+        self.filename = filename
+        self.journal_file = f"{filename}.journal"
+        self.retention = retention_days * 86400
+        self.compact_bytes = compact_bytes
+        self.compact_interval = compact_interval
+        self.entries = load_json(filename, {})  # payment_id -> {"state", "steps", "updated_at"}
+        replayed = self._replay()
+        pruned = self.prune()
+        if replayed or pruned:
+            # Fold the journal into the snapshot at startup, so appends never follow a torn line
+            write_file_atomic(self.filename, dump_json(self.entries))
+            write_file_atomic(self.journal_file, b"")
+        self._journal_bytes = 0
+        self._last_compaction = time.monotonic()
+
+    def _replay(self) -> bool:
+        if not os.path.exists(self.journal_file) or not os.path.getsize(self.journal_file):
             return False
-        item_data = catalog[item_id]
-        # Use override_script if provided (from selected variation)
-        if override_script:
-            script_data = override_script
-        else:
-            # try to get script from item (Pass/Item compatibility)
-            if item_type == 'item':
-                # look for selected variation
-                variations = item_data.get('variations', [])
+        with open(self.journal_file, 'r', encoding='utf-8') as f:
+            for line in f:
                 try:
-                    var = variations[variation_index]
-                    script_data = var.get('script', {})
-                except:
-                    # fallback
-                    script_data = variations[0].get('script', {}) if variations else {}
-            else:
-                # passes use main script
-                try:
-                    script_data = json.loads(item_data.get('script','{}'))
-                except:
-                    script_data = item_data.get('script', {}) if isinstance(item_data.get('script'), dict) else {}
-
-        # Check if this is a vehicle spawn item
-        vehicle_type = item_data.get('vehicle_type')
-        if vehicle_type == 'spawn_vehicle':
-            # Vehicle spawn delivery - extract from script_data
-            class_name = script_data.get('vehicleClassName', '')
-            spawns = script_data.get('amountOfAvailableSpawns', 1)
-            cooldown = script_data.get('timeBeforeNextSpawn', 600)
-            guarantee = script_data.get('guaranteePeriod', 604800)
-            is_unique = script_data.get('isUnique', True)
-            
-            success = FTPManager.create_vehicle_file(
-                steam_id=steam_id,
-                class_name=class_name,
-                spawns=spawns,
-                cooldown=cooldown,
-                guarantee=guarantee,
-                unique=is_unique,
-                vehicle_path=VEHICLE_SPAWN_PATH
-            )
-            
-            if not success:
-                logger.error(f"Failed to create vehicle spawn file for {class_name}")
-                if interaction:
-                    await interaction.followup.send("Error delivering vehicle spawn.", ephemeral=True)
-                return False
-            
-            logger.info(f"Vehicle spawn {class_name} delivered to {steam_id}")
-        else:
-            # Deliver normal items
-            success = False
-            if item_type == 'item':
-                item_to_give = script_data.get('itemToGive')
-                if item_to_give and item_to_give != "none":
-                    success = FTPManager.update_player_file(steam_id, item_name=item_to_give)
-                else:
-                    items_to_give = script_data.get('itemsToGive', [])
-                    if items_to_give:
-                        success = FTPManager.update_player_file(steam_id, item_list=items_to_give)
-                    else:
-                        success = True  # Allow success if only banking
-            else:
-                items_to_give = script_data.get('itemsToGive', [])
-                if items_to_give:
-                    success = FTPManager.update_player_file(steam_id, item_list=items_to_give)
+                    record = json.loads(line)
+                except ValueError:
+                    break  # Torn last line from a crash mid-append
+                if record.get("v") is None:
+                    self.entries.pop(record["k"], None)
                 else:
-                    success = True  # Allow success if only banking
-
-            # Add balance if "banking": true in script
-            if script_data.get('banking', False):
-                banking_amount = script_data.get('currencyAmount', 100000)  # Use currencyAmount if present, fallback to 100000
-                banking_success = FTPManager.update_banking_file(steam_id, banking_amount)
-                if not banking_success:
-                    logger.error("Failed to update banking balance")
-                    if interaction:
-                        await interaction.followup.send("Error adding balance.", ephemeral=True)
-                    return False
-                else:
-                    logger.info(f"Banking balance updated to {banking_amount} for {steam_id}")
-
-            if not success:
-                logger.error("Failed to deliver item via FTPManager")
-                if interaction:
-                    await interaction.followup.send("Error delivering item.", ephemeral=True)
-                return False
+                    self.entries[record["k"]] = record["v"]
+        return True
 
-        # Decrease coupon uses if applied
-        if coupon_code and coupon_code in coupons and coupons[coupon_code]['uses'] > 0:
-            coupons[coupon_code]['uses'] -= 1
-            save_json(COUPONS_FILE, coupons)
-            logger.info(f"Coupon {coupon_code} used. {coupons[coupon_code]['uses']} remaining")
+    def prune(self) -> int:
+        cutoff = time.time() - self.retention
+        expired = [pid for pid, e in self.entries.items() if e.get("state") == "delivered" and e.get("updated_at", 0) < cutoff]
+        for payment_id in expired:
+            del self.entries[payment_id]
+        return len(expired)
+
+    async def persist(self, payment_id: str):
+        """Journal the current state of one payment"""
+        line = json.dumps({"k": payment_id, "v": self.entries.get(payment_id)}, ensure_ascii=False) + "\n"
+        async with file_locks.hold(self.filename):
+            await run_blocking(append_line, self.journal_file, line)
+            self._journal_bytes += len(line.encode('utf-8'))
+            if self._journal_bytes >= self.compact_bytes or time.monotonic() - self._last_compaction >= self.compact_interval:
+                await self._compact()
+
+    async def _compact(self):
+        # Caller holds the file lock. Snapshot first: a crash before the journal is cleared only replays it again
+        pruned = self.prune()
+        await run_blocking(write_file_atomic, self.filename, dump_json(self.entries))
+        await run_blocking(write_file_atomic, self.journal_file, b"")
+        self._journal_bytes = 0
+        self._last_compaction = time.monotonic()
+        if pruned:
+            logger.info(f"Delivery ledger pruned {pruned} payment(s) older than {self.retention / 86400:g} days")
+
+    def reserve(self, payment_id: str) -> bool:
+        """Claim a payment for delivery; False if it was already claimed"""
+        if payment_id in self.entries:
+            return False
+        self.entries[payment_id] = {"state": "reserved", "steps": {}, "updated_at": time.time()}
+        return True
 
-        # Notify sales channel
+    def release(self, payment_id: str):
+        self.entries.pop(payment_id, None)
+
+    def entry(self, payment_id: str) -> dict:
+        # Jobs journaled just before a crash may have no ledger entry yet
+        return self.entries.setdefault(payment_id, {"state": "reserved", "steps": {}, "updated_at": time.time()})
+
+    def set_state(self, payment_id: str, state: str):
+        entry = self.entry(payment_id)
+        entry["state"] = state
+        entry["updated_at"] = time.time()
+
+# Durable delivery outbox: approved orders are journaled, then delivered by workers with retry/backoff
+class DeliveryOutbox:
+    def __init__(self, filename: str, workers: int, max_attempts: int, retry_base: float, retry_max: float):
+        self.filename = filename
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        state = load_json(filename, {"pending": {}, "dead": {}})
+        self.pending = state.get("pending", {})  # job_id -> job
+        self.dead = state.get("dead", {})  # job_id -> job that exhausted its attempts
+        self._queue = None
+        self._tasks = []
+        self._waiters = {}  # payment_id -> [future] resolved with True (delivered) or False (dead-lettered)
+
+    def start(self):
+        """Spawn the worker pool and requeue jobs left over from the last run"""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        for n in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(n)))
+        for job_id, job in self.pending.items():
+            self._schedule(job_id, job.get("next_attempt", 0))
+        if self.pending:
+            logger.info(f"Delivery outbox resumed with {len(self.pending)} pending job(s)")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _persist(self):
+        payload = dump_json({"pending": self.pending, "dead": self.dead})
+        async with file_locks.hold(self.filename):
+            await run_blocking(write_file_atomic, self.filename, payload)
+
+    def _schedule(self, job_id: str, when: float):
+        delay = max(0.0, when - time.time())
+        if delay:
+            asyncio.get_running_loop().call_later(delay, self._queue.put_nowait, job_id)
+        else:
+            self._queue.put_nowait(job_id)
+
+    async def enqueue(self, job: dict) -> str:
+        """Journal a job and hand it to the workers; returns once it is on disk"""
+        job_id = job.setdefault("id", generate_unique_id("delivery"))
+        job.setdefault("attempts", 0)
+        job.setdefault("created_at", time.time())
+        job["next_attempt"] = 0
+        self.pending[job_id] = job
+        await self._persist()
+        if self._queue is not None:
+            self._schedule(job_id, 0)
+        return job_id
+
+    async def wait_for_payment(self, payment_id: str, timeout: float = None) -> bool:
+        """Wait until the delivery of payment_id succeeds (True) or is dead-lettered (False)"""
+        # A fast delivery can settle before anyone waits on it; the ledger remembers how it ended
+        state = delivery_ledger.entries.get(payment_id, {}).get("state")
+        if state in ("delivered", "failed"):
+            return state == "delivered"
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(payment_id, []).append(future)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            waiters = self._waiters.get(payment_id, [])
+            if future in waiters:
+                waiters.remove(future)
+            if not waiters:
+                self._waiters.pop(payment_id, None)
+
+    def _settle(self, job: dict, delivered: bool):
+        for future in self._waiters.pop(job.get("payment_id"), []):
+            if not future.done():
+                future.set_result(delivered)
+
+    async def retry_dead(self, job_id: str = None) -> int:
+        """Move dead-lettered jobs (one or all) back into the outbox"""
+        ids = [job_id] if job_id else list(self.dead.keys())
+        moved = 0
+        for jid in ids:
+            job = self.dead.pop(jid, None)
+            if not job:
+                continue
+            job["attempts"] = 0
+            job["next_attempt"] = 0
+            self.pending[jid] = job
+            moved += 1
+        if moved:
+            await self._persist()
+            if self._queue is not None:
+                for jid in ids:
+                    if jid in self.pending:
+                        self._schedule(jid, 0)
+        return moved
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.retry_max, self.retry_base * (2 ** (attempts - 1)))
+        return delay + random.uniform(0, delay * 0.1)
+
+    async def _worker(self, n: int):
+        while True:
+            job_id = await self._queue.get()
+            job = self.pending.get(job_id)
+            if not job:
+                continue
+            try:
+                await self._run(n, job_id, job)
+            except Exception:
+                # A failed journal write or notification must not take the worker down with it
+                logger.error(f"Delivery worker {n} failed handling {job_id}: {traceback.format_exc()}")
+                if job_id in self.pending:
+                    self._schedule(job_id, time.time() + self._backoff(max(1, job.get("attempts", 0))))
+
+    async def _run(self, n: int, job_id: str, job: dict):
+        try:
+            error = await self._deliver(job)
+        except Exception:
+            logger.error(f"Delivery worker {n} crashed on {job_id}: {traceback.format_exc()}")
+            error = "Internal error"
+        if error is None:
+            self.pending.pop(job_id, None)
+            self._settle(job, True)
+            await self._persist()
+            await self._notify_delivered(job)
+            return
+        job["attempts"] = job.get("attempts", 0) + 1
+        job["last_error"] = error
+        if job["attempts"] >= self.max_attempts:
+            self.pending.pop(job_id, None)
+            self.dead[job_id] = job
+            logger.error(f"Delivery {job_id} moved to dead-letter list after {job['attempts']} attempts: {error}")
+            if job.get("payment_id"):
+                delivery_ledger.set_state(job["payment_id"], "failed")
+            self._settle(job, False)
+            await self._persist()
+            if job.get("payment_id"):
+                await delivery_ledger.persist(job["payment_id"])
+            await self._notify_dead(job)
+            return
+        delay = self._backoff(job["attempts"])
+        job["next_attempt"] = time.time() + delay
+        await self._persist()
+        logger.warning(f"Delivery {job_id} failed (attempt {job['attempts']}/{self.max_attempts}): {error} Retrying in {delay:.1f}s")
+        self._schedule(job_id, job["next_attempt"])
+
+    async def _deliver(self, job: dict):
+        source = items_catalog if job["item_type"] == 'item' else passes_catalog
+        item_data = source.get(job["item_id"]) or {"name": job.get("item_name"), "vehicle_type": job.get("vehicle_type")}
+        payment_id = job.get("payment_id")
+        if not payment_id:
+            return await deliver_script(job["steam_id"], item_data, job["item_type"], job.get("script") or {})
+        entry = delivery_ledger.entry(payment_id)
+        if entry["state"] == "delivered":
+            logger.info(f"Payment {payment_id} already delivered; skipping job {job['id']}")
+            return None
+        delivery_ledger.set_state(payment_id, "delivering")
+        error = await deliver_script(job["steam_id"], item_data, job["item_type"], job.get("script") or {},
+                                     steps=entry["steps"], checkpoint=functools.partial(delivery_ledger.persist, payment_id))
+        if error is None:
+            delivery_ledger.set_state(payment_id, "delivered")
+            await delivery_ledger.persist(payment_id)
+        return error
+
+    async def _notify_delivered(self, job: dict):
+        logger.info(f"Item {job['item_id']} delivered to {job['steam_id']} (job {job['id']})")
         sales_channel = bot.get_channel(SALES_CHANNEL_ID)
         if sales_channel:
             try:
-                await sales_channel.send(f"🎉 Item **{item_data.get('name')}** delivered to SteamID `{steam_id}` (payment {payment_id}).")
+                await sales_channel.send(f"🎉 Item **{job.get('item_name')}** delivered to SteamID `{job['steam_id']}` (payment {job.get('payment_id')}).")
             except Exception as e:
                 logger.error(f"Error notifying sales channel: {str(e)}")
 
+    async def _notify_dead(self, job: dict):
+        try:
+            admin = bot.get_user(ADMIN_ID) or await bot.fetch_user(ADMIN_ID)
+            await admin.send(
+                f"⚠️ Delivery `{job['id']}` failed {job['attempts']} times and was moved to the dead-letter list.\n"
+                f"Item: **{job.get('item_name')}** | SteamID: `{job['steam_id']}` | Payment: {job.get('payment_id')}\n"
+                f"Last error: {job.get('last_error')}\nUse `!outbox retry {job['id']}` once the server is reachable."
+            )
+        except Exception as e:
+            logger.error(f"Error notifying admin about dead delivery {job['id']}: {str(e)}")
+
+delivery_ledger = DeliveryLedger(DELIVERY_LEDGER_FILE, LEDGER_RETENTION_DAYS, LEDGER_COMPACT_BYTES, LEDGER_COMPACT_INTERVAL)
+delivery_outbox = DeliveryOutbox(DELIVERY_OUTBOX_FILE, DELIVERY_WORKERS, DELIVERY_MAX_ATTEMPTS, DELIVERY_RETRY_BASE, DELIVERY_RETRY_MAX)
+
+# Bulk admin grants: one item to many SteamIDs, with progress journaled so an interrupted run can resume
+class BulkGrantRunner:
+    def __init__(self, filename: str, concurrency: int):
+        self.filename = filename
+        self.concurrency = max(1, concurrency)
+        self.grants = load_json(filename, {})  # grant_id -> {item_id, variation_index, admin_id, created_at, status, results}
+        self._running = set()
+
+    async def _persist(self):
+        payload = dump_json(self.grants)
+        async with file_locks.hold(self.filename):
+            await run_blocking(write_file_atomic, self.filename, payload)
+
+    async def create(self, item_id: str, variation_index: int, steam_ids: list, admin_id: int) -> str:
+        grant_id = generate_unique_id("grant")
+        self.grants[grant_id] = {
+            "item_id": item_id,
+            "variation_index": variation_index,
+            "admin_id": str(admin_id),
+            "created_at": datetime.now().isoformat(),
+            "status": "pending",
+            "results": {sid: "pending" for sid in steam_ids}
+        }
+        await self._persist()
+        return grant_id
+
+    def summary(self, grant_id: str) -> dict:
+        results = self.grants[grant_id]["results"]
+        counts = {"ok": 0, "failed": 0, "pending": 0}
+        for state in results.values():
+            counts[state] = counts.get(state, 0) + 1
+        counts["total"] = len(results)
+        return counts
+
+    async def run(self, grant_id: str, progress=None) -> dict:
+        """Deliver to every SteamID not yet marked ok; progress(done, total) is awaited periodically"""
+        grant = self.grants[grant_id]
+        if grant_id in self._running:
+            raise RuntimeError(f"Grant {grant_id} is already running")
+        item_data = items_catalog.get(grant["item_id"])
+        entry = catalog.get(grant["item_id"])
+        if not item_data or not entry:
+            raise KeyError(f"Item {grant['item_id']} not found")
+        # variation() falls back to the first one; a grant must never deliver a different variation
+        if not 0 <= grant["variation_index"] < len(entry.variations):
+            raise ValueError(f"Item {grant['item_id']} has no variation {grant['variation_index']}")
+        script_data = entry.script(grant["variation_index"])
+        todo = [sid for sid, state in grant["results"].items() if state != "ok"]
+        semaphore = asyncio.Semaphore(self.concurrency)
+        done = 0
+        last_report = time.monotonic()
+
+        async def grant_one(steam_id):
+            nonlocal done, last_report
+            async with semaphore:
+                try:
+                    error = await deliver_script(steam_id, item_data, 'item', script_data)
+                except Exception as e:
+                    error = str(e)
+            grant["results"][steam_id] = "ok" if error is None else "failed"
+            if error:
+                logger.error(f"Bulk grant {grant_id}: delivery to {steam_id} failed: {error}")
+            done += 1
+            if done % 25 == 0:
+                await self._persist()
+            if progress and time.monotonic() - last_report >= 5:
+                last_report = time.monotonic()
+                await progress(done, len(todo))
+
+        self._running.add(grant_id)
+        grant["status"] = "running"
+        await self._persist()
+        try:
+            await asyncio.gather(*(grant_one(sid) for sid in todo))
+        finally:
+            counts = self.summary(grant_id)
+            grant["status"] = "done" if counts["ok"] == counts["total"] else "incomplete"
+            await self._persist()
+            self._running.discard(grant_id)
+        logger.info(f"Bulk grant {grant_id} finished: {counts}")
+        return counts
+
+bulk_grants = BulkGrantRunner(BULK_GRANTS_FILE, BULK_GRANT_CONCURRENCY)
+
+# Hot/cold tiering: exhausted purchases and zero insurance balances move to gzip'd monthly archives
+class ArchiveTier:
+    def __init__(self, directory: str, hot_days: float, interval: float):
+        self.directory = directory
+        self.hot_seconds = hot_days * 86400
+        self.interval = interval
+        self._task = None
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Error archiving cold records: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    def _cold_purchases(self, now: float) -> list:
+        # A purchase stays hot while it has drops left or is recent; the ID carries the creation time
+        return [cid for cid, compra in compras.items()
+                if compra.get("drops", 0) <= 0 and now - (compra.get("created_at") or IdGenerator.timestamp(cid) or 0) >= self.hot_seconds]
+
+    def _write(self, lines_by_month: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        for month, lines in lines_by_month.items():
+            # Each append is a new gzip member; gzip readers handle concatenated members transparently
+            with gzip.open(os.path.join(self.directory, f"archive-{month}.jsonl.gz"), 'ab') as f:
+                f.write(("\n".join(lines) + "\n").encode('utf-8'))
+
+    async def sweep(self) -> dict:
+        """Move cold records to the archive, then drop them from the hot tier"""
+        now = time.time()
+        cold = {'compras': self._cold_purchases(now), 'seguros': [steam for steam, qtd in seguros.items() if qtd <= 0]}
+        if not any(cold.values()):
+            return {}
+        lines_by_month = {}
+        archived = {}  # (collection, key) -> value as written, to spot changes made during the write
+        for name, keys in cold.items():
+            values = compras if name == 'compras' else seguros
+            for key in keys:
+                value = values[key]
+                archived[(name, key)] = dict(value) if isinstance(value, dict) else value
+                ts = (value.get("created_at") or IdGenerator.timestamp(key) or now) if isinstance(value, dict) else now
+                month = datetime.fromtimestamp(ts).strftime("%Y-%m")
+                record = {"c": name, "k": key, "v": value, "archived_at": now}
+                lines_by_month.setdefault(month, []).append(json.dumps(record, ensure_ascii=False))
+        # Archive first: a crash before the delete below only leaves a duplicate line, never a lost record
+        await run_blocking(self._write, lines_by_month)
+        # A purchase may have topped up a balance or touched a purchase while the archive was written;
+        # only drop records that are still exactly what was archived
+        cold = {name: [key for key in keys if (compras if name == 'compras' else seguros).get(key) == archived[(name, key)]]
+                for name, keys in cold.items()}
+        for name, keys in cold.items():
+            if not keys:
+                continue
+            # The store drops them first: if that fails they stay hot and are archived again next sweep
+            state_store.delete(name, *keys, event='archive')
+            values = compras if name == 'compras' else seguros
+            for key in keys:
+                values.pop(key, None)
+                if name == 'compras':
+                    purchase_index.sync(key)
+        counts = {name: len(keys) for name, keys in cold.items()}
+        logger.info(f"Archived cold records to {self.directory}: {counts}")
+        return counts
+
+    def _search(self, query: str, limit: int) -> list:
+        if not os.path.isdir(self.directory):
+            return []
+        found = {}
+        # Newest month first; files are streamed line by line, never loaded whole
+        for name in sorted(os.listdir(self.directory), reverse=True):
+            if not name.endswith(".jsonl.gz"):
+                continue
+            with gzip.open(os.path.join(self.directory, name), 'rt', encoding='utf-8') as f:
+                for line in f:
+                    if query not in line:
+                        continue
+                    record = json.loads(line)
+                    value = record.get("v")
+                    owner = (value.get("steam_id"), value.get("user_id")) if isinstance(value, dict) else ()
+                    if query == record.get("k") or query in owner:
+                        found[(record["c"], record["k"])] = record
+                        if len(found) >= limit:
+                            return list(found.values())
+        return list(found.values())
+
+    async def search(self, query: str, limit: int = 20) -> list:
+        """Archived records whose key, SteamID or Discord user ID equals query"""
+        return await run_blocking(self._search, query, limit)
+
+archive_tier = ArchiveTier(ARCHIVE_DIR, ARCHIVE_HOT_DAYS, ARCHIVE_INTERVAL)
+
+async def process_approved_payment(interaction, item_id, item_type, steam_id, coupon_code, amount, payment_id, user_id, override_script=None, variation_index=0, coupon_reservation=None):
+    try:
+        entry = catalog.get(item_id, item_type)
+        if not entry:
+            logger.error(f"Item/Pass {item_id} not found.")
+            if interaction:
+                await interaction.followup.send("Item not found.", ephemeral=True)
+            return False
+        # Use override_script if provided (from selected variation)
+        script_data = override_script or entry.script(variation_index)
+
+        # One delivery per payment, whoever asks (button, webhook, reconciler, retries)
+        if not delivery_ledger.reserve(payment_id):
+            logger.info(f"Payment {payment_id} already queued or delivered ({delivery_ledger.entries[payment_id]['state']})")
+            return True
+        # Journal the order; the outbox workers deliver it and retry on failure
+        try:
+            await delivery_outbox.enqueue({
+                "payment_id": payment_id,
+                "item_id": item_id,
+                "item_type": item_type,
+                "item_name": entry.name,
+                "vehicle_type": entry.vehicle_type,
+                "steam_id": steam_id,
+                "user_id": str(user_id),
+                "script": script_data,
+            })
+        except Exception:
+            delivery_ledger.release(payment_id)
+            raise
+        await delivery_ledger.persist(payment_id)
+
+        # Consume the coupon use held by this checkout
+        if coupon_code:
+            coupon_reservations.commit(coupon_code, coupon_reservation)
+
         if interaction:
             try:
-                await interaction.followup.send("✅ Item delivered successfully.", ephemeral=True)
+                await interaction.followup.send("✅ Order confirmed, delivery is in progress.", ephemeral=True)
             except:
                 pass
 
-        logger.info(f"Item {item_id} delivered to {steam_id}")
+        logger.info(f"Item {item_id} queued for delivery to {steam_id}")
         return True
     except Exception as e:
         logger.error(f"Error process_approved_payment: {traceback.format_exc()}")
@@ -1520,17 +3175,15 @@ class ItemViewForChannel(View):
     @discord.ui.button(label="🛒 Buy", style=discord.ButtonStyle.success)
     async def confirm_purchase(self, interaction: discord.Interaction, button: Button):
         # If item has multiple variations -> show selection view
-        variations = self.item_data.get('variations', [])
-        if variations and len(variations) > 1:
+        entry = catalog.get(self.item_id)
+        variations = entry.variations if entry else ()
+        if len(variations) > 1:
             # Build a temporary view with Select
             options = []
-            for idx, v in enumerate(variations):
-                label = v.get('name', f"Var{idx}")
-                desc = ""
+            for v in variations:
                 # optionally show if vehicle
-                if v.get('is_vehicle', False):
-                    desc = " (Vehicle)"
-                options.append(discord.SelectOption(label=label, value=str(idx), description=desc))
+                desc = " (Vehicle)" if v.is_vehicle else ""
+                options.append(discord.SelectOption(label=v.name, value=str(v.index), description=desc))
             class VariationSelectView(View):
                 def __init__(self, item_id, item_data):
                     super().__init__(timeout=60)
@@ -1553,9 +3206,196 @@ class ItemViewForChannel(View):
             modal = PurchaseSteamModal(self.item_id, 'item' if self.item_id in items_catalog else 'pass', self.item_data, variation_index=0)
             await interaction.response.send_modal(modal)
 
+# PayPal webhook: delivers as soon as PayPal reports the sale, without waiting for "Check Payment"
+async def verify_webhook_signature(request, event: dict) -> bool:
+    """Ask PayPal to verify the transmission signature of a webhook delivery"""
+    if WEBHOOK_VERIFY == 'off':
+        return True
+    if not PAYPAL_WEBHOOK_ID:
+        logger.error("PAYPAL_WEBHOOK_ID not set; rejecting webhook")
+        return False
+    headers = request.headers
+    payload = {
+        "auth_algo": headers.get("PAYPAL-AUTH-ALGO"),
+        "cert_url": headers.get("PAYPAL-CERT-URL"),
+        "transmission_id": headers.get("PAYPAL-TRANSMISSION-ID"),
+        "transmission_sig": headers.get("PAYPAL-TRANSMISSION-SIG"),
+        "transmission_time": headers.get("PAYPAL-TRANSMISSION-TIME"),
+        "webhook_id": PAYPAL_WEBHOOK_ID,
+        "webhook_event": event,
+    }
+    if not all(payload.values()):
+        return False
+    try:
+        status, result = await paypal_client.verify_webhook_signature(payload)
+        return status == 200 and result.get("verification_status") == "SUCCESS"
+    except Exception as e:
+        logger.error(f"Error verifying webhook signature: {str(e)}")
+        return False
+
+async def notify_payment_thread(payment_id: str, thread_id, message: str):
+    if not thread_id:
+        return
+    try:
+        thread = bot.get_channel(int(thread_id)) or await bot.fetch_channel(int(thread_id))
+        await thread.send(message)
+    except Exception as e:
+        logger.error(f"Error notifying thread of payment {payment_id}: {str(e)}")
+
+async def handle_paypal_webhook(request):
+    # Parsed once, before verification: a malformed body is a 400, never a 500 PayPal would keep retrying
+    try:
+        event = json.loads(await request.text())
+    except ValueError:
+        return web.Response(status=400, text="invalid body")
+    if not isinstance(event, dict):
+        return web.Response(status=400, text="invalid body")
+    if not await verify_webhook_signature(request, event):
+        logger.warning(f"Rejected webhook with invalid signature from {request.remote}")
+        return web.Response(status=400, text="invalid signature")
+    event_type = event.get("event_type")
+    resource = event.get("resource") or {}
+    logger.info(f"Webhook {event.get('id')} received: {event_type}")
+    if event_type != "PAYMENT.SALE.COMPLETED":
+        return web.Response(text="ignored")
+    payment_id = resource.get("parent_payment")
+    info = pending_payments.get(payment_id)
+    if not info:
+        # Already delivered through the button, or not an order of this bot; PayPal must not retry
+        return web.Response(text="ok")
+    try:
+        paid = round(float((resource.get("amount") or {}).get("total")), 2)
+    except (TypeError, ValueError):
+        paid = None
+    if paid != round(float(info.get("amount") or 0), 2):
+        logger.error(f"Webhook amount {paid} does not match order {payment_id} ({info.get('amount')}); not delivering")
+        return web.Response(text="amount mismatch")
+    thread_id = info.get("thread_id")
+    result = await finalize_payment(payment_id)
+    if result:
+        await notify_payment_thread(payment_id, thread_id, "✅ Payment received, your item will arrive in-game shortly! Use the insurance channel to activate.")
+    elif result is False:
+        # 5xx makes PayPal redeliver the event later
+        return web.Response(status=500, text="delivery failed")
+    return web.Response(text="ok")
+
+async def start_webhook_server():
+    """Serve the webhook on PORT (set by the host for the Procfile 'web' process); None if disabled"""
+    if not WEBHOOK_PORT:
+        return None
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle_paypal_webhook)
+    app.router.add_get("/", lambda request: web.Response(text="ok"))
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    if WEBHOOK_VERIFY == 'off':
+        logger.warning("Webhook signature verification is OFF; use only for local testing")
+    logger.info(f"PayPal webhook listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    return runner
+
+# Reconciliation: polls PayPal for open orders nobody checked, so paid orders are always delivered
+class PaymentReconciler:
+    TERMINAL = ("failed", "canceled", "expired")
+
+    def __init__(self, interval_min: float, interval_max: float, concurrency: int, max_age: float):
+        self.interval_min = max(1.0, interval_min)
+        self.interval_max = max(self.interval_min, interval_max)
+        self.concurrency = max(1, concurrency)
+        self.max_age = max_age
+        self._next_check = {}  # payment_id -> monotonic time of the next status check
+        self._task = None
+        self.stats = {"passes": 0, "checks": 0, "reconciled": 0, "expired": 0, "errors": 0}
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _delay(self, info: dict) -> float:
+        # Young orders are checked often, older ones back off: a tenth of their age, within bounds
+        age = time.time() - info.get("created_at", time.time())
+        return min(self.interval_max, max(self.interval_min, age / 10))
+
+    async def _run(self):
+        while True:
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.error(f"Error reconciling payments: {str(e)}")
+            await asyncio.sleep(self.interval_min)
+
+    async def _check(self, payment_id: str, semaphore: asyncio.Semaphore) -> str:
+        async with semaphore:
+            return await PayPalPayment.check_payment_status(payment_id)
+
+    async def reconcile(self, force: bool = False) -> dict:
+        """Check every due open order (all of them if force); returns counts for this pass"""
+        now = time.monotonic()
+        for payment_id in list(self._next_check):
+            if payment_id not in pending_payments:
+                del self._next_check[payment_id]
+        for pid, info in pending_payments.items():
+            if pid not in self._next_check:
+                # First sight (new order or bot restart): check once it is interval_min old
+                age = time.time() - info.get("created_at", time.time())
+                self._next_check[pid] = now + max(0.0, self.interval_min - age)
+        due = [pid for pid in pending_payments if force or self._next_check[pid] <= now]
+        result = {"checked": len(due), "reconciled": 0, "expired": 0}
+        expired = []
+        if not due:
+            return result
+        semaphore = asyncio.Semaphore(self.concurrency)
+        statuses = await asyncio.gather(*(self._check(pid, semaphore) for pid in due))
+        for payment_id, status in zip(due, statuses):
+            info = pending_payments.get(payment_id)
+            if info is None:
+                continue  # Finished by the button or the webhook meanwhile
+            if status == "approved":
+                thread_id = info.get("thread_id")
+                if await finalize_payment(payment_id):
+                    result["reconciled"] += 1
+                    await notify_payment_thread(payment_id, thread_id, "✅ Payment received, your item will arrive in-game shortly! Use the insurance channel to activate.")
+            elif status in self.TERMINAL or (self.max_age and time.time() - info.get("created_at", time.time()) > self.max_age and status == "pending"):
+                # PayPal will never approve it: drop the order and free its coupon use
+                pending_payments.pop(payment_id, None)
+                coupon_reservations.release(info.get("coupon_reservation"))
+                expired.append(payment_id)
+                result["expired"] += 1
+                logger.info(f"Open order {payment_id} closed as {status if status != 'pending' else 'abandoned'}")
+            else:
+                if status == "error":
+                    self.stats["errors"] += 1
+                self._next_check[payment_id] = time.monotonic() + self._delay(info)
+        if expired:
+            state_store.save('pending', *expired)
+        self.stats["passes"] += 1
+        self.stats["checks"] += result["checked"]
+        self.stats["reconciled"] += result["reconciled"]
+        self.stats["expired"] += result["expired"]
+        if result["reconciled"] or result["expired"]:
+            logger.info(f"Reconciliation: {result['checked']} checked, {result['reconciled']} delivered, {result['expired']} closed")
+        return result
+
+payment_reconciler = PaymentReconciler(RECONCILE_INTERVAL_MIN, RECONCILE_INTERVAL_MAX, RECONCILE_CONCURRENCY, RECONCILE_MAX_AGE)
+
 @bot.event
 async def on_ready():
     logger.info(f"Bot connected as {bot.user.name} (ID: {bot.user.id})")
+    write_behind.start()
+    delivery_outbox.start()
+    archive_tier.start()
+    payment_reconciler.start()
+    # Re-attach the buttons of every open order thread
+    for payment_id in pending_payments:
+        bot.add_view(ThreadPaymentView(payment_id))
+    if pending_payments:
+        logger.info(f"Re-registered payment views for {len(pending_payments)} open order(s)")
     logger.info(f"Admin ID: {ADMIN_ID}")
     sales_channel = bot.get_channel(SALES_CHANNEL_ID)
     seguros_channel = bot.get_channel(SEGUROS_CHANNEL_ID)  # NEW: Insurance channel
@@ -1616,7 +3456,7 @@ async def vincular_command(ctx, steam_id: str = None):
         if not validate_steam_id(steam_id):
             await ctx.send("Invalid SteamID."); return
         user_data[str(ctx.author.id)] = steam_id
-        save_json(USER_DATA_FILE, user_data)
+        state_store.save('users', str(ctx.author.id))
         await ctx.send("✅ SteamID linked.")
     else:
         await ctx.send("Usage: !vincular <steamid64>")
@@ -1626,7 +3466,7 @@ async def desvincular_command(ctx):
     uid = str(ctx.author.id)
     if uid in user_data:
         removed = user_data.pop(uid)
-        save_json(USER_DATA_FILE, user_data)
+        state_store.save('users', uid)
         await ctx.send(f"✅ Unlinked {removed}")
     else:
         await ctx.send("You don't have a linked SteamID.")
@@ -1744,13 +3584,199 @@ async def limpar_command(ctx, steam_id: str):
     else:
         await ctx.send("File not found.")
 
+async def _run_grant(ctx, grant_id: str):
+    grant = bulk_grants.grants[grant_id]
+    item_name = items_catalog.get(grant["item_id"], {}).get('name', grant["item_id"])
+    status_msg = await ctx.send(f"⏳ Grant `{grant_id}`: delivering **{item_name}** to {bulk_grants.summary(grant_id)['total']} SteamID(s)...")
+
+    async def progress(done, total):
+        try:
+            await status_msg.edit(content=f"⏳ Grant `{grant_id}`: {done}/{total} processed...")
+        except Exception:
+            pass
+
+    try:
+        counts = await bulk_grants.run(grant_id, progress)
+    except Exception as e:
+        await status_msg.edit(content=f"❌ Grant `{grant_id}` could not run: {str(e)}")
+        return
+    report = "\n".join(f"{sid}: {state}" for sid, state in grant["results"].items())
+    text = f"✅ Grant `{grant_id}` finished: {counts['ok']} ok, {counts['failed']} failed (of {counts['total']})."
+    if counts["failed"]:
+        text += f"\nRun `!grant resume {grant_id}` to retry the failed ones."
+    await status_msg.edit(content=text)
+    await ctx.send(file=discord.File(io.BytesIO(report.encode('utf-8')), filename=f"{grant_id}.txt"))
+
+@bot.command(name="grant")
+async def grant_command(ctx, *args):
+    if ctx.author.id != ADMIN_ID:
+        await ctx.send("You don't have permission."); return
+    if not args:
+        await ctx.send(
+            "Usage: `!grant <item_id> [variation] <steamid64 ...>` (or attach a .txt with SteamIDs)\n"
+            "`!grant resume <grant_id>` | `!grant status <grant_id>`"
+        )
+        return
+    if args[0] in ("resume", "status"):
+        grant_id = args[1] if len(args) > 1 else None
+        if grant_id not in bulk_grants.grants:
+            await ctx.send("Grant not found."); return
+        if args[0] == "status":
+            counts = bulk_grants.summary(grant_id)
+            await ctx.send(f"Grant `{grant_id}` ({bulk_grants.grants[grant_id]['status']}): {counts['ok']} ok, {counts['failed']} failed, {counts['pending']} pending (of {counts['total']}).")
+            return
+        await _run_grant(ctx, grant_id)
+        return
+
+    item_id = args[0]
+    entry = catalog.get(item_id)
+    if item_id not in items_catalog or not entry:
+        await ctx.send("Item not found."); return
+    rest = list(args[1:])
+    variation_index = 0
+    if rest and rest[0].isdigit() and len(rest[0]) < 17:
+        variation_index = int(rest.pop(0))
+    if variation_index >= len(entry.variations):
+        await ctx.send(f"Invalid variation. **{entry.name}** has {len(entry.variations)} variation(s): use 0 to {len(entry.variations) - 1}."); return
+    text = " ".join(rest)
+    for attachment in ctx.message.attachments:
+        text += "\n" + (await attachment.read()).decode('utf-8', errors='ignore')
+    steam_ids = list(dict.fromkeys(re.findall(r'(?<!\d)\d{17}(?!\d)', text)))
+    if not steam_ids:
+        await ctx.send("No valid SteamID64 found."); return
+    grant_id = await bulk_grants.create(item_id, variation_index, steam_ids, ctx.author.id)
+    await _run_grant(ctx, grant_id)
+
+@bot.command(name="outbox")
+async def outbox_command(ctx, action: str = None, job_id: str = None):
+    if ctx.author.id != ADMIN_ID:
+        await ctx.send("You don't have permission."); return
+    if action == "retry":
+        moved = await delivery_outbox.retry_dead(None if job_id in (None, "all") else job_id)
+        await ctx.send(f"✅ {moved} delivery(ies) moved back to the outbox.")
+        return
+    lines = [f"Pending deliveries: {len(delivery_outbox.pending)} | Dead letters: {len(delivery_outbox.dead)}"]
+    for jid, job in list(delivery_outbox.dead.items())[:15]:
+        lines.append(f"`{jid}` - {job.get('item_name')} -> `{job.get('steam_id')}` (payment {job.get('payment_id')}): {job.get('last_error')}")
+    if delivery_outbox.dead:
+        lines.append("Use `!outbox retry <job_id>` or `!outbox retry all` to redeliver.")
+    await ctx.send("\n".join(lines))
+
+@bot.command(name="flush")
+async def flush_command(ctx):
+    if ctx.author.id != ADMIN_ID:
+        await ctx.send("You don't have permission."); return
+    written = await write_behind.flush()
+    await ctx.send(f"✅ {written} file(s) flushed to disk.")
+
+@bot.command(name="sftp")
+async def sftp_stats_command(ctx):
+    if ctx.author.id != ADMIN_ID:
+        await ctx.send("You don't have permission."); return
+    if not sftp_pool:
+        await ctx.send("SFTP is disabled (USE_LOCAL=true)."); return
+    stats = sftp_pool.stats()
+    await ctx.send(
+        f"SFTP pool: {stats['idle']}/{stats['size']} idle | connects: {stats['connects']} | reuses: {stats['reuses']} | "
+        f"reconnects: {stats['reconnects']} | discarded: {stats['discarded']} | hit rate: {stats['hit_rate'] * 100:.1f}%"
+    )
+
+@bot.command(name="purchases")
+async def purchases_command(ctx, days: float = 7.0, limit: int = 20):
+    if ctx.author.id != ADMIN_ID:
+        await ctx.send("You don't have permission."); return
+    end = time.time()
+    found = purchases_between(end - days * 86400, end)
+    if not found:
+        await ctx.send(f"No purchases in the last {days:g} day(s)."); return
+    lines = [f"{len(found)} purchase(s) in the last {days:g} day(s), {sum(c.get('drops', 0) for c in found.values())} insurance drop(s) left:"]
+    for cid, compra in list(found.items())[-limit:]:
+        created = datetime.fromtimestamp(compra.get("created_at") or IdGenerator.timestamp(cid) or 0).strftime("%Y-%m-%d %H:%M")
+        lines.append(f"[{created}] `{cid}` - {compra.get('item_name')} | SteamID `{compra.get('steam_id')}` | user {compra.get('user_id')} | drops {compra.get('drops')}")
+    # Send in chunks to stay under Discord's message size limit
+    chunk = ""
+    for line in lines:
+        if len(chunk) + len(line) + 1 > 1900:
+            await ctx.send(chunk)
+            chunk = ""
+        chunk += line + "\n"
+    if chunk:
+        await ctx.send(chunk)
+
+@bot.command(name="lookup")
+async def lookup_command(ctx, query: str = None, limit: int = 20):
+    if ctx.author.id != ADMIN_ID:
+        await ctx.send("You don't have permission."); return
+    if not query:
+        await ctx.send("Usage: !lookup <steamid64|discord_user_id|purchase_id> [limit]"); return
+    lines = []
+    if query in seguros:
+        lines.append(f"Insurance balance for `{query}`: {seguros[query]}")
+    for cid, compra in compras.items():
+        if query in (cid, compra.get("steam_id"), compra.get("user_id")):
+            lines.append(f"`{cid}` - {compra.get('item_name')} | SteamID `{compra.get('steam_id')}` | user {compra.get('user_id')} | drops {compra.get('drops')}")
+    for record in await archive_tier.search(query, limit):
+        value = record["v"]
+        archived = datetime.fromtimestamp(record["archived_at"]).strftime("%Y-%m-%d")
+        if record["c"] == 'compras':
+            lines.append(f"[archived {archived}] `{record['k']}` - {value.get('item_name')} | SteamID `{value.get('steam_id')}` | user {value.get('user_id')} | drops {value.get('drops')}")
+        else:
+            lines.append(f"[archived {archived}] insurance `{record['k']}`: {value}")
+    if not lines:
+        await ctx.send("No records found."); return
+    # Send in chunks to stay under Discord's message size limit
+    chunk = ""
+    for line in lines:
+        if len(chunk) + len(line) + 1 > 1900:
+            await ctx.send(chunk)
+            chunk = ""
+        chunk += line + "\n"
+    if chunk:
+        await ctx.send(chunk)
+
+@bot.command(name="reconcile")
+async def reconcile_command(ctx):
+    if ctx.author.id != ADMIN_ID:
+        await ctx.send("You don't have permission."); return
+    result = await payment_reconciler.reconcile(force=True)
+    stats = payment_reconciler.stats
+    await ctx.send(
+        f"✅ Checked {result['checked']} open order(s): {result['reconciled']} delivered, {result['expired']} closed.\n"
+        f"Since start: {stats['reconciled']} reconciled, {stats['expired']} closed, {stats['checks']} checks, {stats['errors']} errors."
+    )
+
+@bot.command(name="paypal")
+async def paypal_stats_command(ctx):
+    if ctx.author.id != ADMIN_ID:
+        await ctx.send("You don't have permission."); return
+    metrics = paypal_client.metrics()
+    cache = payment_status_cache.stats
+    lines = [f"`{op}`: {m['calls']} calls, {m['errors']} errors | p50 {m['p50_ms']} ms | p95 {m['p95_ms']} ms | max {m['max_ms']} ms"
+             for op, m in metrics.items()] or ["No PayPal calls yet."]
+    lines.append(f"Status cache: {cache['hits']} hits | {cache['misses']} lookups | {cache['coalesced']} coalesced")
+    await ctx.send("\n".join(lines))
+
 async def main():
+    webhook_runner = None
     try:
+        webhook_runner = await start_webhook_server()
         async with bot:
             await bot.start(BOT_TOKEN)
     except Exception:
         logger.error(f"Error starting bot: {traceback.format_exc()}")
         sys.exit(1)
+    finally:
+        if webhook_runner:
+            await webhook_runner.cleanup()
+        await payment_reconciler.stop()
+        await paypal_client.close()
+        await archive_tier.stop()
+        await delivery_outbox.stop()
+        await write_behind.stop()
+        ftp_executor.shutdown(wait=True)
+        state_store.close()
+        if sftp_pool:
+            sftp_pool.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
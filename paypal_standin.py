@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""Local PayPal REST stand-in.
+
+Serves the endpoints the bot's PayPalClient uses (OAuth token, payment create,
+payment find, webhook signature verification) with aiohttp, so checkout can be
+run and load-tested without the PayPal sandbox. Approval timing, errors and
+latency are scriptable.
+
+Standalone:
+    python paypal_standin.py --port 8099 --approve-after 2 --latency 0.1 --fail-rate 0.05
+
+then start the bot with PAYPAL_API_BASE=http://127.0.0.1:8099. Open an order's
+approval link (or POST /approve/<payment_id>) to approve it immediately.
+"""
+import sys
+import time
+import uuid
+import base64
+import random
+import asyncio
+import logging
+import argparse
+from aiohttp import web
+
+logger = logging.getLogger("paypal_standin")
+
+
+class FaultInjector:
+    """Adds latency to every API call and fails a fraction of them with HTTP 500"""
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, fail_rate: float = 0.0, seed: int = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self._random = random.Random(seed)
+        self.calls = 0
+        self.failures = 0
+
+    async def hit(self) -> bool:
+        """Sleep for the simulated round-trip; return True if this call should fail"""
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+        fail = self.fail_rate > 0 and self._random.random() < self.fail_rate
+        self.calls += 1
+        if fail:
+            self.failures += 1
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return fail
+
+
+class PayPalStandin:
+    """In-process PayPal API. Use with 'async with' or await start()/stop().
+
+    approve_after: seconds after creation when the buyer approves (None = only on /approve)
+    approve_rate: fraction of payments the buyer approves; the rest end up 'canceled'
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, client_id: str = None, client_secret: str = None,
+                 faults: FaultInjector = None, approve_after: float = 0.0, approve_rate: float = 1.0,
+                 token_ttl: int = 32400, seed: int = None):
+        self.host = host
+        self.port = port
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.faults = faults or FaultInjector()
+        self.approve_after = approve_after
+        self.approve_rate = approve_rate
+        self.token_ttl = token_ttl
+        self._random = random.Random(seed)
+        self.payments = {}  # payment_id -> payment resource
+        self._decided = {}  # payment_id -> (monotonic time the buyer acts, final state)
+        self._tokens = {}  # access token -> expiry (monotonic)
+        self.counts = {"oauth": 0, "create": 0, "find": 0, "verify": 0, "unauthorized": 0}
+        self._runner = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def _app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/oauth2/token", self._oauth)
+        app.router.add_post("/v1/payments/payment", self._create)
+        app.router.add_get("/v1/payments/payment/{payment_id}", self._find)
+        app.router.add_post("/v1/notifications/verify-webhook-signature", self._verify)
+        app.router.add_route("*", "/approve/{payment_id}", self._approve_link)
+        return app
+
+    async def start(self):
+        self._runner = web.AppRunner(self._app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        logger.info(f"PayPal stand-in listening on {self.url}")
+        return self
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    def approve(self, payment_id: str) -> bool:
+        """Approve a payment now, as if the buyer finished the PayPal checkout"""
+        payment = self.payments.get(payment_id)
+        if not payment or payment["state"] != "created":
+            return False
+        payment["state"] = "approved"
+        payment["update_time"] = self._now()
+        return True
+
+    @staticmethod
+    def _now() -> str:
+        return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+    @staticmethod
+    def _error(status: int, name: str, message: str) -> web.Response:
+        return web.json_response({"name": name, "message": message, "debug_id": uuid.uuid4().hex[:13]}, status=status)
+
+    def _authorized(self, request) -> bool:
+        header = request.headers.get("Authorization", "")
+        expires = self._tokens.get(header[7:]) if header.startswith("Bearer ") else None
+        if expires is None or expires < time.monotonic():
+            self.counts["unauthorized"] += 1
+            return False
+        return True
+
+    def _settle(self, payment: dict):
+        """Apply the scripted buyer decision once its time has come"""
+        decided = self._decided.get(payment["id"])
+        if payment["state"] == "created" and decided and decided[0] <= time.monotonic():
+            payment["state"] = decided[1]
+            payment["update_time"] = self._now()
+
+    async def _oauth(self, request):
+        self.counts["oauth"] += 1
+        if await self.faults.hit():
+            return self._error(500, "INTERNAL_SERVICE_ERROR", "Injected failure")
+        auth = request.headers.get("Authorization", "")
+        if self.client_id is not None:
+            expected = base64.b64encode(f"{self.client_id}:{self.client_secret}".encode()).decode()
+            if auth != f"Basic {expected}":
+                return web.json_response({"error": "invalid_client", "error_description": "Client Authentication failed"}, status=401)
+        token = f"A21AA{uuid.uuid4().hex}"
+        self._tokens[token] = time.monotonic() + self.token_ttl
+        return web.json_response({"scope": "https://uri.paypal.com/services/payments/payment", "access_token": token,
+                                  "token_type": "Bearer", "app_id": "APP-STANDIN", "expires_in": self.token_ttl,
+                                  "nonce": uuid.uuid4().hex})
+
+    async def _create(self, request):
+        self.counts["create"] += 1
+        if not self._authorized(request):
+            return self._error(401, "AUTHENTICATION_FAILURE", "Authentication failed due to invalid authentication credentials")
+        if await self.faults.hit():
+            return self._error(500, "INTERNAL_SERVICE_ERROR", "Injected failure")
+        try:
+            body = await request.json()
+            transaction = body["transactions"][0]
+            float(transaction["amount"]["total"])
+        except (ValueError, KeyError, IndexError, TypeError):
+            return self._error(400, "VALIDATION_ERROR", "Invalid request - see details")
+        payment_id = f"PAYID-{uuid.uuid4().hex[:24].upper()}"
+        payment = {
+            "id": payment_id,
+            "intent": body.get("intent", "sale"),
+            "state": "created",
+            "payer": body.get("payer", {}),
+            "transactions": body["transactions"],
+            "create_time": self._now(),
+            "links": [
+                {"href": f"{self.url}/v1/payments/payment/{payment_id}", "rel": "self", "method": "GET"},
+                {"href": f"{self.url}/approve/{payment_id}", "rel": "approval_url", "method": "REDIRECT"},
+                {"href": f"{self.url}/v1/payments/payment/{payment_id}/execute", "rel": "execute", "method": "POST"},
+            ],
+        }
+        self.payments[payment_id] = payment
+        if self.approve_after is not None:
+            state = "approved" if self._random.random() < self.approve_rate else "canceled"
+            self._decided[payment_id] = (time.monotonic() + self.approve_after, state)
+        return web.json_response(payment, status=201)
+
+    async def _find(self, request):
+        self.counts["find"] += 1
+        if not self._authorized(request):
+            return self._error(401, "AUTHENTICATION_FAILURE", "Authentication failed due to invalid authentication credentials")
+        if await self.faults.hit():
+            return self._error(500, "INTERNAL_SERVICE_ERROR", "Injected failure")
+        payment = self.payments.get(request.match_info["payment_id"])
+        if not payment:
+            return self._error(404, "INVALID_RESOURCE_ID", "Requested resource ID was not found.")
+        self._settle(payment)
+        return web.json_response(payment)
+
+    async def _verify(self, request):
+        self.counts["verify"] += 1
+        if not self._authorized(request):
+            return self._error(401, "AUTHENTICATION_FAILURE", "Authentication failed due to invalid authentication credentials")
+        return web.json_response({"verification_status": "SUCCESS"})
+
+    async def _approve_link(self, request):
+        payment_id = request.match_info["payment_id"]
+        if self.approve(payment_id):
+            return web.Response(text=f"Payment {payment_id} approved. You can close this page.")
+        return web.Response(status=404, text=f"Payment {payment_id} not found or not awaiting approval.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local PayPal REST stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--approve-after", type=float, default=None, help="Seconds until the buyer approves (default: only via the approval link)")
+    parser.add_argument("--approve-rate", type=float, default=1.0, help="Fraction of payments approved; the rest are canceled")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every API call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random extra latency, 0..jitter seconds")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of API calls answered with HTTP 500")
+    parser.add_argument("--token-ttl", type=int, default=32400, help="Access token lifetime in seconds")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    faults = FaultInjector(latency=args.latency, jitter=args.jitter, fail_rate=args.fail_rate)
+    standin = PayPalStandin(host=args.host, port=args.port, faults=faults, approve_after=args.approve_after,
+                            approve_rate=args.approve_rate, token_ttl=args.token_ttl)
+
+    async def serve():
+        await standin.start()
+        print(f"PayPal stand-in on {standin.url}. Start the bot with PAYPAL_API_BASE={standin.url}. Ctrl+C to stop.")
+        try:
+            while True:
+                await asyncio.sleep(3600)
+        finally:
+            await standin.stop()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    print(f"Served {faults.calls} API calls, {faults.failures} injected failures: {standin.counts}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
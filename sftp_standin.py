@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""Local SFTP stand-in for the game server.
+
+Serves a directory over SFTP with paramiko so the bot's real SFTP delivery path
+(SFTPSessionPool + SFTPStorage) can be run and benchmarked without a DayZ host.
+Latency and failures can be injected per operation.
+
+Standalone:
+    python sftp_standin.py --port 2222 --root ./sftp_root --latency 0.05 --fail-rate 0.1
+
+then start the bot with USE_LOCAL=false, FTP_HOST=127.0.0.1, FTP_PORT=2222,
+FTP_USER=dayz, FTP_PASS=dayz.
+"""
+import os
+import sys
+import time
+import random
+import socket
+import logging
+import argparse
+import tempfile
+import threading
+import paramiko
+from paramiko import SFTPServer, SFTPServerInterface, SFTPAttributes, SFTPHandle, SFTP_OK, SFTP_FAILURE
+
+logger = logging.getLogger("sftp_standin")
+
+
+class FaultInjector:
+    """Adds latency to every SFTP operation and fails a fraction of them"""
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, fail_rate: float = 0.0, seed: int = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.operations = 0
+        self.failures = 0
+
+    def hit(self) -> bool:
+        """Sleep for the simulated round-trip; return True if this operation should fail"""
+        with self._lock:
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+            fail = self.fail_rate > 0 and self._random.random() < self.fail_rate
+            self.operations += 1
+            if fail:
+                self.failures += 1
+        if delay > 0:
+            time.sleep(delay)
+        return fail
+
+
+class _StandinServer(paramiko.ServerInterface):
+    def __init__(self, username: str, password: str):
+        self.username = username
+        self.password = password
+
+    def check_auth_password(self, username, password):
+        if username == self.username and password == self.password:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+
+class _StandinHandle(SFTPHandle):
+    def stat(self):
+        try:
+            return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        try:
+            SFTPServer.set_file_attr(self.filename, attr)
+            return SFTP_OK
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+
+class _StandinSFTP(SFTPServerInterface):
+    """Maps remote absolute paths onto a local root directory"""
+    def __init__(self, server, root: str, faults: FaultInjector, *args, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.root = root
+        self.faults = faults
+
+    def _local(self, path: str) -> str:
+        return os.path.join(self.root, self.canonicalize(path).lstrip('/'))
+
+    def list_folder(self, path):
+        if self.faults.hit():
+            return SFTP_FAILURE
+        local = self._local(path)
+        try:
+            out = []
+            for name in os.listdir(local):
+                attr = SFTPAttributes.from_stat(os.stat(os.path.join(local, name)))
+                attr.filename = name
+                out.append(attr)
+            return out
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        if self.faults.hit():
+            return SFTP_FAILURE
+        try:
+            return SFTPAttributes.from_stat(os.stat(self._local(path)))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        if self.faults.hit():
+            return SFTP_FAILURE
+        local = self._local(path)
+        try:
+            if flags & os.O_CREAT:
+                os.makedirs(os.path.dirname(local), exist_ok=True)
+            fd = os.open(local, flags | getattr(os, 'O_BINARY', 0), 0o666)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        if flags & os.O_WRONLY:
+            mode = 'ab' if flags & os.O_APPEND else 'wb'
+        elif flags & os.O_RDWR:
+            mode = 'a+b' if flags & os.O_APPEND else 'r+b'
+        else:
+            mode = 'rb'
+        f = os.fdopen(fd, mode)
+        handle = _StandinHandle(flags)
+        handle.filename = local
+        handle.readfile = f
+        handle.writefile = f
+        return handle
+
+    def remove(self, path):
+        if self.faults.hit():
+            return SFTP_FAILURE
+        try:
+            os.remove(self._local(path))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def rename(self, oldpath, newpath):
+        if self.faults.hit():
+            return SFTP_FAILURE
+        new_local = self._local(newpath)
+        if os.path.exists(new_local):
+            return SFTP_FAILURE
+        try:
+            os.rename(self._local(oldpath), new_local)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def posix_rename(self, oldpath, newpath):
+        if self.faults.hit():
+            return SFTP_FAILURE
+        try:
+            os.replace(self._local(oldpath), self._local(newpath))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def mkdir(self, path, attr):
+        try:
+            os.makedirs(self._local(path), exist_ok=True)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def rmdir(self, path):
+        try:
+            os.rmdir(self._local(path))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+
+class SFTPStandin:
+    """In-process SFTP server over a directory. Use as a context manager or start()/stop()"""
+    def __init__(self, root: str = None, host: str = "127.0.0.1", port: int = 0, username: str = "dayz",
+                 password: str = "dayz", faults: FaultInjector = None):
+        self._tmpdir = None
+        if root is None:
+            self._tmpdir = tempfile.TemporaryDirectory(prefix="sftp_standin_")
+            root = self._tmpdir.name
+        self.root = os.path.abspath(root)
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.faults = faults or FaultInjector()
+        self._host_key = paramiko.RSAKey.generate(2048)
+        self._sock = None
+        self._thread = None
+        self._transports = []
+        self._running = False
+
+    def start(self):
+        os.makedirs(self.root, exist_ok=True)
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((self.host, self.port))
+        self._sock.listen(100)
+        self.port = self._sock.getsockname()[1]
+        self._running = True
+        self._thread = threading.Thread(target=self._accept_loop, name="sftp-standin", daemon=True)
+        self._thread.start()
+        logger.info(f"SFTP stand-in serving {self.root} on {self.host}:{self.port}")
+        return self
+
+    def _accept_loop(self):
+        while self._running:
+            try:
+                client, _ = self._sock.accept()
+            except OSError:
+                break
+            transport = paramiko.Transport(client)
+            transport.add_server_key(self._host_key)
+            transport.set_subsystem_handler("sftp", SFTPServer, _StandinSFTP, self.root, self.faults)
+            try:
+                transport.start_server(server=_StandinServer(self.username, self.password))
+            except Exception as e:
+                logger.warning(f"SFTP stand-in handshake failed: {str(e)}")
+                continue
+            self._transports.append(transport)
+
+    def stop(self):
+        self._running = False
+        if self._sock:
+            self._sock.close()
+        for transport in self._transports:
+            transport.close()
+        self._transports = []
+        if self._tmpdir:
+            self._tmpdir.cleanup()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local SFTP stand-in for the DayZ game server")
+    parser.add_argument("--root", default="./sftp_root", help="Directory served as the remote filesystem")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2222)
+    parser.add_argument("--user", default="dayz")
+    parser.add_argument("--password", default="dayz")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every SFTP operation")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random extra latency, 0..jitter seconds")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of operations that fail (0..1)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    faults = FaultInjector(latency=args.latency, jitter=args.jitter, fail_rate=args.fail_rate)
+    server = SFTPStandin(root=args.root, host=args.host, port=args.port, username=args.user,
+                         password=args.password, faults=faults).start()
+    print(f"SFTP stand-in on {server.host}:{server.port} (user {args.user}), serving {server.root}. Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        print(f"Served {faults.operations} operations, {faults.failures} injected failures.")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
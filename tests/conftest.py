@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import asyncio
+import tempfile
+
+import pytest
+
+# bot.py reads its configuration and data files at import time: give it a scratch directory
+WORKDIR = tempfile.mkdtemp(prefix="bot_tests_")
+os.environ.update({
+    "BOT_TOKEN": "test", "SALES_CHANNEL_ID": "1", "ADMIN_ID": "1", "SEGUROS_CHANNEL_ID": "1",
+    "PAYPAL_CLIENT_ID": "test", "PAYPAL_CLIENT_SECRET": "test",
+    "USE_LOCAL": "true",
+    "LOCAL_BASE_PATH": os.path.join(WORKDIR, "players"),
+    "BANKING_PATH": os.path.join(WORKDIR, "banking"),
+    "VEHICLE_SPAWN_PATH": os.path.join(WORKDIR, "vehicles"),
+    "ARCHIVE_INTERVAL": "0",
+    "DELIVERY_RETRY_BASE": "0.01", "DELIVERY_RETRY_MAX": "0.05",
+})
+os.chdir(WORKDIR)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot as bot_module  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.run_until_complete(bot_module.paypal_client.close())
+    loop.close()
+    bot_module.ftp_executor.shutdown(wait=True)
+
+
+@pytest.fixture
+def run(loop):
+    """Run a coroutine on the session loop (the bot's locks and queues live on one loop)"""
+    return loop.run_until_complete
+
+
+@pytest.fixture
+def bot():
+    return bot_module
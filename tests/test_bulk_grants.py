@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+
+@pytest.fixture
+def two_variation_item(bot, monkeypatch):
+    monkeypatch.setattr(bot, "storage", bot.MemoryStorage())
+    bot.items_catalog["grant_test"] = {"name": "Grant test", "price": 1.0, "variations": [
+        {"name": "Red", "script": {"itemToGive": "RedCar"}},
+        {"name": "Blue", "script": {"itemToGive": "BlueCar"}},
+    ]}
+    bot.catalog.refresh('item', "grant_test")
+    yield "grant_test"
+    bot.items_catalog.pop("grant_test")
+    bot.catalog.refresh('item', "grant_test")
+
+
+def test_run_rejects_unknown_variation(bot, run, tmp_path, two_variation_item):
+    grants = bot.BulkGrantRunner(str(tmp_path / "grants.json"), concurrency=2)
+    grant_id = run(grants.create(two_variation_item, 7, ["76561198000000001"], admin_id=1))
+    with pytest.raises(ValueError):
+        run(grants.run(grant_id))
+    assert grants.summary(grant_id)["pending"] == 1
+
+
+def test_resume_without_compiled_catalog_entry(bot, run, tmp_path, two_variation_item):
+    grants = bot.BulkGrantRunner(str(tmp_path / "grants.json"), concurrency=2)
+    grant_id = run(grants.create("grant_stale", 0, ["76561198000000001"], admin_id=1))
+    # Present in the raw catalog but never compiled, e.g. edited on disk between restarts
+    bot.items_catalog["grant_stale"] = {"name": "Stale", "price": 1.0, "variations": []}
+    try:
+        with pytest.raises(KeyError):
+            run(grants.run(grant_id))
+    finally:
+        bot.items_catalog.pop("grant_stale")
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+
+def test_refresh_recompiles_only_the_edited_entry(bot):
+    items = {
+        "akm": {"name": "AKM", "price": "5.5", "variations": [{"name": "Default", "script": '{"itemToGive": "AKM"}'}]},
+        "jeep": {"name": "Jeep", "price": 10, "is_vehicle": True, "insurance_drops": "2",
+                 "variations": [{"name": "Red", "script": {"itemToGive": "Jeep_Red"}},
+                                {"name": "Plain", "script": {"itemToGive": "Jeep"}, "is_vehicle": False}]},
+    }
+    catalog = bot.Catalog(items, {})
+    akm = catalog.get("akm")
+    # Compiled once: scripts parsed, numbers coerced, flags resolved per variation
+    assert akm.price == 5.5 and akm.script() == {"itemToGive": "AKM"}
+    assert catalog.get("jeep").insured_drops(0) == 2 and catalog.get("jeep").insured_drops(1) == 0
+
+    items["jeep"]["insurance_drops"] = 3
+    catalog.refresh('item', "jeep")
+    assert catalog.get("jeep").insured_drops(0) == 3
+    assert catalog.get("akm") is akm
+
+    items["m4"] = {"name": "M4", "price": 7}
+    catalog.refresh('item', "m4")
+    del items["akm"]
+    catalog.refresh('item', "akm")
+    assert catalog.get("akm") is None and catalog.get("m4").name == "M4"
+
+
+def test_full_refresh_rebuilds_the_kind(bot):
+    items = {"akm": {"name": "AKM", "price": 5}}
+    passes = {"vip": {"name": "VIP", "price": 3, "script": '{"itemsToGive": ["Hat"]}'}}
+    catalog = bot.Catalog(items, passes)
+    items.clear()
+    items["m4"] = {"name": "M4", "price": 7}
+    catalog.refresh('item')
+    assert list(catalog.entries['item']) == ["m4"]
+    # Passes keep their script at the root and are untouched by an item refresh
+    assert catalog.get("vip", 'pass').script() == {"itemsToGive": ["Hat"]}
+
+
+def test_bad_variation_index_falls_back_to_the_first(bot):
+    entry = bot.CatalogEntry("akm", 'item', {"name": "AKM", "variations": [{"script": "not json"}]})
+    assert entry.variation(5) is entry.variations[0]
+    assert entry.script(5) == {} and entry.variations[0].name == "Var0"
+    assert bot.CatalogEntry("empty", 'item', {"name": "Empty"}).variation() is None
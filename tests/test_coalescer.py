@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+STEAM_ID = "76561198000000002"
+
+
+@pytest.fixture
+def memory(bot, monkeypatch):
+    storage = bot.MemoryStorage()
+    writes = []
+    update_json = storage.update_json
+
+    def counting_update_json(path, mutate, default):
+        writes.append(path)
+        return update_json(path, mutate, default)
+
+    storage.update_json = counting_update_json
+    storage.writes = writes
+    monkeypatch.setattr(bot, "storage", storage)
+    monkeypatch.setattr(bot, "PLAYER_FILES_PATH", "/players")
+    monkeypatch.setattr(bot, "BANKING_PATH", "/banking")
+    return storage
+
+
+def test_deliveries_in_one_window_merge_into_one_write_per_file(bot, run, memory):
+    coalescer = bot.DeliveryCoalescer(0.05)
+
+    async def burst():
+        return await asyncio.gather(
+            coalescer.add_items(STEAM_ID, item_name="AKM"),
+            coalescer.add_items(STEAM_ID, item_list=["M4", "Mag"]),
+            coalescer.set_banking(STEAM_ID, 1000),
+            coalescer.add_items(STEAM_ID, item_name="AKM"),
+            coalescer.set_banking(STEAM_ID, 5000),
+        )
+
+    assert run(burst()) == [True] * 5
+    assert sorted(memory.writes) == [f"/banking/{STEAM_ID}.json", f"/players/{STEAM_ID}.json"]
+    assert memory.read_json(f"/players/{STEAM_ID}.json")["itemsToGive"] == ["AKM", "M4", "Mag"]
+    # Banking sets an absolute balance: the latest request wins
+    assert memory.read_json(f"/banking/{STEAM_ID}.json") == {"m_OwnedCurrency": 5000}
+
+
+def test_delivery_after_a_flush_started_gets_its_own_write(bot, run, memory):
+    coalescer = bot.DeliveryCoalescer(0.02)
+
+    async def two_windows():
+        first = asyncio.ensure_future(coalescer.add_items(STEAM_ID, item_name="AKM"))
+        await asyncio.sleep(0.05)
+        second = await coalescer.add_items(STEAM_ID, item_name="M4")
+        return await first, second
+
+    assert run(two_windows()) == (True, True)
+    assert memory.writes == [f"/players/{STEAM_ID}.json"] * 2
+    assert memory.read_json(f"/players/{STEAM_ID}.json")["itemsToGive"] == ["AKM", "M4"]
+    assert not coalescer._pending and not coalescer._tails
+
+
+def test_failed_write_fails_every_merged_delivery(bot, run, memory):
+    coalescer = bot.DeliveryCoalescer(0.02)
+
+    def broken(path, mutate, default):
+        raise IOError("server gone")
+
+    memory.update_json = broken
+
+    async def burst():
+        return await asyncio.gather(*(coalescer.add_items(STEAM_ID, item_name=f"item{n}") for n in range(3)))
+
+    assert run(burst()) == [False] * 3
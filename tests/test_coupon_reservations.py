@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+
+@pytest.fixture
+def coupon(bot):
+    bot.coupons["TEST2"] = {"discount": 10, "uses": 2}
+    yield "TEST2"
+    bot.coupons.pop("TEST2")
+    bot.state_store.save('coupons', "TEST2")
+
+
+def test_reservations_hold_uses_until_released(bot, coupon):
+    reservations = bot.CouponReservations()
+    first = reservations.reserve(coupon)
+    second = reservations.reserve(coupon)
+    assert first and second
+    assert reservations.reserve(coupon) is None
+    reservations.release(first)
+    assert reservations.available(coupon) == 1
+    assert bot.coupons[coupon]["uses"] == 2
+
+
+def test_open_order_keeps_its_use_however_long_it_takes(bot, coupon, monkeypatch):
+    reservations = bot.CouponReservations()
+    rid = reservations.reserve(coupon)
+    reservations.reserve(coupon)
+    # Hours later, while the order is still open, nobody else can take its use
+    monkeypatch.setattr(bot.time, "time", lambda: 10 ** 10)
+    assert reservations.available(coupon) == 0
+    assert reservations.reserve(coupon) is None
+    assert reservations.commit(coupon, rid)
+    assert bot.coupons[coupon]["uses"] == 1
+
+
+def test_commit_without_reservation_never_oversells(bot, coupon):
+    reservations = bot.CouponReservations()
+    rid = reservations.reserve(coupon)
+    reservations.release(rid)
+    # The released use went to two other buyers
+    others = [reservations.reserve(coupon), reservations.reserve(coupon)]
+    assert all(others)
+    assert not reservations.commit(coupon, rid)
+    assert bot.coupons[coupon]["uses"] == 2
+    for other in others:
+        assert reservations.commit(coupon, other)
+    assert bot.coupons[coupon]["uses"] == 0
+
+
+def test_restore_rebuilds_holds_from_pending_payments(bot, coupon):
+    reservations = bot.CouponReservations()
+    rid = reservations.reserve(coupon)
+    pending = {"PAYID-1": {"coupon": coupon, "coupon_reservation": rid}}
+    restored = bot.CouponReservations()
+    restored.restore(pending)
+    assert restored.available(coupon) == 1
+    assert restored.commit(coupon, rid)
+    assert bot.coupons[coupon]["uses"] == 1
+    assert restored.available(coupon) == 1
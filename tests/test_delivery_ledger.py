@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import time
+import asyncio
+
+import pytest
+
+
+@pytest.fixture
+def shop(bot, run, monkeypatch):
+    """Catalog item delivering an item and bank currency, with delivery calls counted"""
+    calls = {"items": 0, "banking": 0, "banking_failures": 0}
+
+    async def add_items(steam_id, item_name=None, item_list=None):
+        calls["items"] += 1
+        return True
+
+    async def set_banking(steam_id, amount):
+        calls["banking"] += 1
+        if calls["banking_failures"]:
+            calls["banking_failures"] -= 1
+            return False
+        return True
+
+    monkeypatch.setattr(bot.delivery_queue, "add_items", add_items)
+    monkeypatch.setattr(bot.delivery_queue, "set_banking", set_banking)
+    bot.items_catalog["ledger_test"] = {"name": "Ledger test", "price": 1.0, "variations": [
+        {"name": "Default", "script": {"itemToGive": "AKM", "banking": True, "currencyAmount": 500}}]}
+    bot.catalog.refresh('item', "ledger_test")
+
+    async def start():
+        bot.delivery_outbox.start()
+
+    run(start())
+    yield calls
+    run(bot.delivery_outbox.stop())
+    bot.items_catalog.pop("ledger_test")
+    bot.catalog.refresh('item', "ledger_test")
+
+
+def purchase(bot, payment_id):
+    return bot.process_approved_payment(None, "ledger_test", "item", "76561198000000001", None, 1.0, payment_id, 1)
+
+
+def test_concurrent_duplicates_deliver_once(bot, run, shop):
+    async def scenario():
+        results = await asyncio.gather(*(purchase(bot, "PAY-LEDGER-DUP") for _ in range(3)))
+        assert results == [True, True, True]
+        assert await bot.delivery_outbox.wait_for_payment("PAY-LEDGER-DUP", timeout=5)
+        # A late retry (webhook after the button) is still a no-op
+        assert await purchase(bot, "PAY-LEDGER-DUP")
+        await asyncio.sleep(0.05)
+
+    run(scenario())
+    assert shop["items"] == 1 and shop["banking"] == 1
+    assert bot.delivery_ledger.entries["PAY-LEDGER-DUP"]["state"] == "delivered"
+
+
+def test_retry_resumes_from_the_failed_step(bot, run, shop):
+    shop["banking_failures"] = 2
+
+    async def scenario():
+        assert await purchase(bot, "PAY-LEDGER-RETRY")
+        assert await bot.delivery_outbox.wait_for_payment("PAY-LEDGER-RETRY", timeout=5)
+
+    run(scenario())
+    assert shop["items"] == 1 and shop["banking"] == 3
+    assert bot.delivery_ledger.entries["PAY-LEDGER-RETRY"]["steps"] == {"items": "done", "banking": "done"}
+
+
+def test_journal_replays_and_prunes_on_restart(bot, run, tmp_path):
+    filename = str(tmp_path / "ledger.json")
+    ledger = bot.DeliveryLedger(filename, retention_days=1, compact_bytes=10 ** 6, compact_interval=3600)
+    assert ledger.reserve("PAY-OLD") and ledger.reserve("PAY-NEW")
+    ledger.set_state("PAY-OLD", "delivered")
+    ledger.entries["PAY-OLD"]["updated_at"] = time.time() - 2 * 86400
+    ledger.entry("PAY-NEW")["steps"]["items"] = "done"
+    run(ledger.persist("PAY-OLD"))
+    run(ledger.persist("PAY-NEW"))
+    # Only the journal was written, not the snapshot
+    assert bot.load_json(filename, {}) == {}
+
+    reopened = bot.DeliveryLedger(filename, retention_days=1, compact_bytes=10 ** 6, compact_interval=3600)
+    assert list(reopened.entries) == ["PAY-NEW"]
+    assert reopened.entries["PAY-NEW"]["steps"] == {"items": "done"}
+    assert not reopened.reserve("PAY-NEW")
+
+
+def test_journal_is_compacted_when_it_grows(bot, run, tmp_path):
+    filename = str(tmp_path / "ledger.json")
+    ledger = bot.DeliveryLedger(filename, retention_days=1, compact_bytes=500, compact_interval=3600)
+    for n in range(20):
+        ledger.reserve(f"PAY-{n}")
+        run(ledger.persist(f"PAY-{n}"))
+    assert len(bot.load_json(filename, {})) >= 10
+    assert (tmp_path / "ledger.json.journal").stat().st_size < 500
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+import json
+
+
+def test_default_layout_is_unchanged(bot):
+    data = {"akm": {"name": "Fuzil ç", "price": 5.0}}
+    assert not bot.USE_ORJSON
+    assert bot.dump_json(data) == json.dumps(data, indent=4, ensure_ascii=False).encode('utf-8')
+
+
+def test_compact_layout(bot, monkeypatch):
+    monkeypatch.setattr(bot, "JSON_COMPACT", True)
+    assert bot.dump_json({"a": [1, 2]}) == b'{"a":[1,2]}'
+
+
+def test_saves_log_the_size_not_the_content(bot, tmp_path, caplog):
+    import logging
+    caplog.set_level(logging.INFO, logger=bot.logger.name)
+    bot.save_json(str(tmp_path / "coupons.json"), {"SECRET10": {"discount": 10, "uses": 3}})
+    assert "bytes) in" in caplog.text
+    assert "SECRET10" not in caplog.text
+    assert json.loads((tmp_path / "coupons.json").read_text(encoding='utf-8')) == {"SECRET10": {"discount": 10, "uses": 3}}
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+
+import pytest
+
+STEAM_ID = "76561198000000001"
+
+
+@pytest.fixture
+def memory(bot, monkeypatch):
+    storage = bot.MemoryStorage()
+    threads = []
+    update_json = storage.update_json
+
+    def recording_update_json(path, mutate, default):
+        threads.append(threading.current_thread().name)
+        return update_json(path, mutate, default)
+
+    storage.update_json = recording_update_json
+    storage.threads = threads
+    monkeypatch.setattr(bot, "storage", storage)
+    monkeypatch.setattr(bot, "PLAYER_FILES_PATH", "/players")
+    monkeypatch.setattr(bot, "BANKING_PATH", "/banking")
+    return storage
+
+
+def test_concurrent_deliveries_to_one_file_run_off_the_loop_without_lost_updates(bot, run, memory):
+    async def deliver():
+        return await asyncio.gather(*(bot.FTPManager.update_player_file_async(STEAM_ID, item_name=f"item{n}") for n in range(10)))
+
+    assert run(deliver()) == [True] * 10
+    data = memory.read_json(f"/players/{STEAM_ID}.json")
+    assert sorted(data["itemsToGive"]) == sorted(f"item{n}" for n in range(10))
+    assert all(name.startswith("ftp") for name in memory.threads)
+    assert not bot.file_locks._locks
+
+
+def test_invalid_steam_id_is_rejected_without_io(bot, run, memory):
+    assert run(bot.FTPManager.update_banking_file_async("123", 5000)) is False
+    assert memory.files == {} and memory.threads == []
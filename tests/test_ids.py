@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+import time
+
+
+def test_ids_are_unique_and_time_sortable(bot):
+    generated = [bot.generate_unique_id("compra") for _ in range(5000)]
+    assert len(set(generated)) == len(generated)
+    assert generated == sorted(generated)
+
+
+def test_purchases_between_includes_legacy_ids(bot, monkeypatch):
+    now = time.time()
+    new_id = bot.generate_unique_id("compra")
+    legacy_id = f"compra_{int(now) - 60}"
+    old_legacy_id = f"compra_{int(now) - 30 * 86400}"
+    for cid in (new_id, legacy_id, old_legacy_id):
+        bot.compras[cid] = {"user_id": "1", "steam_id": "76561198000000001", "item_id": "x", "drops": 1}
+        bot.state_store.save('compras', cid, event='purchase')
+    monkeypatch.setattr(bot, "legacy_purchase_ids", [legacy_id, old_legacy_id])
+    try:
+        found = bot.purchases_between(now - 3600, now + 3600)
+        assert list(found) == [legacy_id, new_id]
+    finally:
+        for cid in (new_id, legacy_id, old_legacy_id):
+            bot.compras.pop(cid)
+            bot.state_store.save('compras', cid)
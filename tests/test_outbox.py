@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+
+def test_worker_survives_bookkeeping_errors(bot, run, tmp_path, monkeypatch):
+    outbox = bot.DeliveryOutbox(str(tmp_path / "outbox.json"), workers=1, max_attempts=3, retry_base=0.01, retry_max=0.01)
+    failures = {"notify": 1, "persist": 1}
+
+    async def deliver(job):
+        return None
+
+    async def notify(job):
+        if failures["notify"]:
+            failures["notify"] -= 1
+            raise RuntimeError("channel unavailable")
+
+    persist = outbox._persist
+
+    async def flaky_persist():
+        # Fails once after job_b is delivered, as a full disk would
+        if failures["persist"]:
+            failures["persist"] -= 1
+            raise OSError("No space left on device")
+        await persist()
+
+    monkeypatch.setattr(outbox, "_deliver", deliver)
+    monkeypatch.setattr(outbox, "_notify_delivered", notify)
+
+    async def scenario():
+        outbox.start()
+        try:
+            await outbox.enqueue({"id": "job_a", "payment_id": "PAY-OUTBOX-A", "steam_id": "76561198000000001"})
+            assert await outbox.wait_for_payment("PAY-OUTBOX-A", timeout=5)
+            monkeypatch.setattr(outbox, "_persist", flaky_persist)
+            outbox.pending["job_b"] = {"id": "job_b", "payment_id": "PAY-OUTBOX-B", "steam_id": "76561198000000002"}
+            outbox._schedule("job_b", 0)
+            assert await outbox.wait_for_payment("PAY-OUTBOX-B", timeout=5)
+            await outbox.enqueue({"id": "job_c", "payment_id": "PAY-OUTBOX-C", "steam_id": "76561198000000003"})
+            assert await outbox.wait_for_payment("PAY-OUTBOX-C", timeout=5)
+        finally:
+            await outbox.stop()
+
+    run(scenario())
+    assert failures == {"notify": 0, "persist": 0}
+    assert not outbox.pending
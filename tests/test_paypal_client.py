@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+from paypal_standin import PayPalStandin
+
+ORDER = {"intent": "sale", "payer": {"payment_method": "paypal"},
+         "transactions": [{"amount": {"total": "9.99", "currency": "EUR"}, "description": "test"}]}
+
+
+@pytest.fixture
+def paypal(bot, run):
+    standin = PayPalStandin(client_id="id", client_secret="secret", approve_after=None)
+    run(standin.start())
+    client = bot.PayPalClient(standin.url, "id", "secret", timeout=5, pool_size=2)
+    yield standin, client
+    run(client.close())
+    run(standin.stop())
+
+
+def test_token_is_cached_and_shared(run, paypal):
+    standin, client = paypal
+
+    async def calls():
+        return await asyncio.gather(*(client.create_payment(ORDER) for _ in range(5)))
+
+    assert [status for status, _ in run(calls())] == [201] * 5
+    status, payment = run(client.find_payment(next(iter(standin.payments))))
+    assert status == 200 and payment["state"] == "created"
+    # Concurrent first calls waited for one token request
+    assert standin.counts["oauth"] == 1
+
+
+def test_rejected_token_is_refreshed_once(run, paypal):
+    standin, client = paypal
+    run(client.create_payment(ORDER))
+    # PayPal revoked the token before its advertised expiry
+    standin._tokens.clear()
+
+    status, payment = run(client.create_payment(ORDER))
+    assert status == 201 and payment["id"]
+    assert standin.counts["unauthorized"] == 1 and standin.counts["oauth"] == 2
+    assert client.metrics()["create_payment"]["errors"] == 1
+
+
+def test_persistent_401_is_returned_after_one_retry(run, paypal, monkeypatch):
+    standin, client = paypal
+    monkeypatch.setattr(standin, "_authorized", lambda request: False)
+    status, body = run(client.find_payment("PAYID-X"))
+    assert status == 401 and body["name"] == "AUTHENTICATION_FAILURE"
+    assert standin.counts["oauth"] == 2 and standin.counts["find"] == 2
+
+
+def test_bad_credentials_raise(bot, run, paypal):
+    standin, _ = paypal
+    client = bot.PayPalClient(standin.url, "id", "wrong", timeout=5, pool_size=1)
+    try:
+        with pytest.raises(RuntimeError, match="OAuth failed"):
+            run(client.find_payment("PAYID-X"))
+    finally:
+        run(client.close())
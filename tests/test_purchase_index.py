@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import time
+from types import SimpleNamespace
+
+STEAM_ID = "76561198000000007"
+
+
+def purchase(drops, user_id="1", steam_id=STEAM_ID, created_at=None):
+    return {"user_id": user_id, "steam_id": steam_id, "item_id": "jeep", "drops": drops,
+            "created_at": created_at or time.time()}
+
+
+def test_index_follows_grant_activation_and_archive(bot):
+    compras = {}
+    index = bot.PurchaseIndex(compras)
+    # Grant: new purchases join the owner's open list in purchase order
+    for cid in ("compra_a", "compra_b"):
+        compras[cid] = purchase(drops=1)
+        index.sync(cid)
+    compras["compra_other"] = purchase(drops=1, user_id="2")
+    index.sync("compra_other")
+    assert index.first_open(STEAM_ID, "1") == "compra_a"
+    assert index.first_open(STEAM_ID, "2") == "compra_other"
+
+    # Activation used the last drop of the oldest purchase
+    compras["compra_a"]["drops"] = 0
+    index.sync("compra_a")
+    assert index.first_open(STEAM_ID, "1") == "compra_b"
+
+    # Archive: the record leaves the dict
+    compras.pop("compra_a")
+    index.sync("compra_a")
+    compras.pop("compra_b")
+    index.sync("compra_b")
+    assert index.first_open(STEAM_ID, "1") is None
+    assert index._open == bot.PurchaseIndex(compras)._open
+
+
+class StubResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send_modal(self, modal):
+        self.interaction.modal = modal
+
+    async def send_message(self, content=None, **kwargs):
+        self.interaction.messages.append(content)
+
+    async def defer(self, **kwargs):
+        pass
+
+
+class StubInteraction:
+    def __init__(self, user_id):
+        self.user = SimpleNamespace(id=user_id)
+        self.messages = []
+        self.modal = None
+        self.response = StubResponse(self)
+        self.followup = SimpleNamespace(send=self.response.send_message)
+
+
+def test_insurance_activation_moves_to_the_next_purchase(bot, run, monkeypatch, tmp_path):
+    monkeypatch.setattr(bot, "storage", bot.MemoryStorage())
+    monkeypatch.setattr(bot, "PLAYER_FILES_PATH", "/players")
+    monkeypatch.setattr(bot, "SEGUROS_LOG", str(tmp_path / "seguros.log"))
+    monkeypatch.setattr(bot.delivery_queue, "window", 0)
+    monkeypatch.setitem(bot.items_catalog, "jeep", {"name": "Jeep", "price": 10.0, "is_vehicle": True, "insurance_drops": 1,
+                                                     "variations": [{"name": "Default", "script": {"itemToGive": "OffroadHatchback"}}]})
+    bot.catalog.refresh('item', "jeep")
+    first, second = bot.generate_unique_id("compra"), bot.generate_unique_id("compra")
+    for cid in (first, second):
+        bot.compras[cid] = purchase(drops=1, user_id="42")
+        bot.purchase_index.sync(cid)
+    bot.seguros[STEAM_ID] = 2
+
+    async def activate():
+        click = StubInteraction(42)
+        await bot.SegurosView().acionar_seguro.callback(click)
+        submit = StubInteraction(42)
+        click.modal._refresh(submit, [{"type": 1, "components": [{"type": 4, "custom_id": click.modal.steam.custom_id, "value": STEAM_ID}]}])
+        await click.modal.on_submit(submit)
+        return submit.messages[-1]
+
+    try:
+        assert run(activate()).startswith("✅ Insurance activated")
+        assert bot.compras[first]["drops"] == 0
+        assert bot.purchase_index.first_open(STEAM_ID, "42") == second
+        assert run(activate()).startswith("✅ Insurance activated")
+        assert bot.purchase_index.first_open(STEAM_ID, "42") is None
+    finally:
+        for cid in (first, second):
+            bot.compras.pop(cid, None)
+            bot.purchase_index.sync(cid)
+        bot.seguros.pop(STEAM_ID, None)
+        bot.items_catalog.pop("jeep", None)
+        bot.catalog.refresh('item', "jeep")
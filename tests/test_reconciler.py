@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import time
+
+import pytest
+
+
+@pytest.fixture
+def orders(bot, monkeypatch):
+    statuses = {}
+    checked = []
+
+    async def check_payment_status(payment_id):
+        checked.append(payment_id)
+        return statuses[payment_id]
+
+    monkeypatch.setattr(bot.PayPalPayment, "check_payment_status", check_payment_status)
+
+    def add(payment_id, status, age, **info):
+        statuses[payment_id] = status
+        bot.pending_payments[payment_id] = dict(info, user_id=1, item_id="x", created_at=time.time() - age)
+
+    add.checked = checked
+    yield add
+    for payment_id in statuses:
+        bot.pending_payments.pop(payment_id, None)
+        bot.state_store.save('pending', payment_id)
+
+
+def test_delay_backs_off_with_order_age(bot):
+    reconciler = bot.PaymentReconciler(15, 900, 4, 0)
+    now = time.time()
+    assert reconciler._delay({"created_at": now - 30}) == 15
+    assert reconciler._delay({"created_at": now - 1000}) == pytest.approx(100, rel=0.01)
+    assert reconciler._delay({"created_at": now - 86400}) == 900
+
+
+def test_orders_are_checked_once_due_and_then_back_off(bot, run, orders):
+    reconciler = bot.PaymentReconciler(15, 900, 4, 0)
+    orders("PAYID-NEW", "pending", age=1)
+    orders("PAYID-YOUNG", "pending", age=60)
+    orders("PAYID-OLD", "pending", age=5000)
+
+    result = run(reconciler.reconcile())
+    # A brand-new order waits until it is interval_min old
+    assert sorted(orders.checked) == ["PAYID-OLD", "PAYID-YOUNG"]
+    assert result == {"checked": 2, "reconciled": 0, "expired": 0}
+    now = time.monotonic()
+    assert reconciler._next_check["PAYID-YOUNG"] - now == pytest.approx(15, abs=1)
+    assert reconciler._next_check["PAYID-OLD"] - now == pytest.approx(500, abs=1)
+
+    # Nothing is due again right away
+    orders.checked.clear()
+    assert run(reconciler.reconcile())["checked"] == 0
+    assert orders.checked == []
+    assert run(reconciler.reconcile(force=True))["checked"] == 3
+
+
+def test_errors_are_retried_with_backoff(bot, run, orders):
+    reconciler = bot.PaymentReconciler(15, 900, 4, 0)
+    orders("PAYID-ERR", "error", age=3000)
+    run(reconciler.reconcile())
+    assert reconciler.stats["errors"] == 1
+    assert "PAYID-ERR" in bot.pending_payments
+    assert reconciler._next_check["PAYID-ERR"] - time.monotonic() == pytest.approx(300, abs=1)
+
+
+def test_terminal_and_abandoned_orders_are_closed(bot, run, orders):
+    reconciler = bot.PaymentReconciler(15, 900, 4, max_age=3600)
+    bot.coupons["RECON"] = {"discount": 10, "uses": 1}
+    rid = bot.coupon_reservations.reserve("RECON")
+    try:
+        orders("PAYID-CANCELED", "canceled", age=60, coupon="RECON", coupon_reservation=rid)
+        orders("PAYID-ABANDONED", "pending", age=7200)
+        orders("PAYID-OPEN", "pending", age=600)
+        result = run(reconciler.reconcile())
+        assert result["expired"] == 2
+        assert "PAYID-CANCELED" not in bot.pending_payments and "PAYID-ABANDONED" not in bot.pending_payments
+        assert "PAYID-OPEN" in bot.pending_payments
+        # The canceled order's coupon use is free again
+        assert bot.coupon_reservations.available("RECON") == 1
+    finally:
+        bot.coupon_reservations.release(rid)
+        bot.coupons.pop("RECON")
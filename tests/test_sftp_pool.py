@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import pytest
+
+from sftp_standin import SFTPStandin
+
+
+@pytest.fixture
+def server(tmp_path):
+    server = SFTPStandin(root=str(tmp_path)).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def pool(bot, server):
+    pool = bot.SFTPSessionPool("127.0.0.1", server.port, server.username, server.password, size=2, keepalive=0, idle_check=0)
+    yield pool
+    pool.close()
+
+
+def test_sessions_are_reused(pool):
+    for _ in range(3):
+        assert pool.run(lambda sftp: sftp.listdir('.')) == []
+    stats = pool.stats()
+    assert (stats["connects"], stats["reuses"], stats["idle"]) == (1, 2, 1)
+
+
+def test_checkouts_never_exceed_the_pool_size(pool):
+    inside, peak, lock = [0], [0], threading.Lock()
+    barrier = threading.Barrier(2)
+
+    def work(sftp):
+        with lock:
+            inside[0] += 1
+            peak[0] = max(peak[0], inside[0])
+        try:
+            barrier.wait(timeout=0.2)
+        except threading.BrokenBarrierError:
+            pass
+        sftp.listdir('.')
+        with lock:
+            inside[0] -= 1
+
+    threads = [threading.Thread(target=pool.run, args=(work,)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert peak[0] == 2
+    assert pool.stats()["connects"] == 2
+
+
+def test_dead_idle_session_is_evicted(pool):
+    pool.run(lambda sftp: sftp.listdir('.'))
+    sftp, transport, last_used = pool._idle.queue[0]
+    transport.close()
+
+    assert pool.run(lambda sftp: sftp.listdir('.')) == []
+    stats = pool.stats()
+    assert (stats["connects"], stats["reconnects"], stats["idle"]) == (2, 1, 1)
+
+
+def test_reused_session_dying_mid_operation_is_retried_once(pool):
+    pool.run(lambda sftp: sftp.listdir('.'))
+    calls = []
+
+    def work(sftp):
+        calls.append(sftp)
+        if len(calls) == 1:
+            # The server dropped the connection after the health check passed
+            sftp.get_channel().get_transport().close()
+            raise EOFError()
+        return sftp.listdir('.')
+
+    assert pool.run(work) == []
+    assert len(calls) == 2 and calls[0] is not calls[1]
+    assert pool.stats()["discarded"] == 1
+
+
+def test_operation_errors_keep_the_session(pool):
+    with pytest.raises(IOError):
+        pool.run(lambda sftp: sftp.stat("/missing.json"))
+    stats = pool.stats()
+    assert (stats["connects"], stats["discarded"], stats["idle"]) == (1, 0, 1)
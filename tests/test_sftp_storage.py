@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+from paramiko import SFTP_FAILURE, SFTP_OP_UNSUPPORTED
+
+import sftp_standin
+from sftp_standin import SFTPStandin
+
+
+@pytest.fixture
+def sftp_storage(bot, tmp_path):
+    server = SFTPStandin(root=str(tmp_path)).start()
+    pool = bot.SFTPSessionPool("127.0.0.1", server.port, server.username, server.password, size=2, keepalive=0, idle_check=0)
+    yield bot.SFTPStorage(pool), tmp_path
+    pool.close()
+    server.stop()
+
+
+def test_write_replaces_file_atomically(sftp_storage):
+    storage, root = sftp_storage
+    storage.write_json("/players/1.json", {"v": 1})
+    storage.write_json("/players/1.json", {"v": 2})
+    assert storage.read_json("/players/1.json") == {"v": 2}
+    assert os.listdir(root / "players") == ["1.json"]
+
+
+def test_failed_rename_keeps_the_existing_file(sftp_storage, monkeypatch):
+    storage, root = sftp_storage
+    storage.write_json("/players/1.json", {"v": 1})
+    # A permission error / full disk on the server must not fall back to remove-then-rename
+    monkeypatch.setattr(sftp_standin._StandinSFTP, "posix_rename", lambda self, old, new: SFTP_FAILURE)
+    with pytest.raises(IOError):
+        storage.write_json("/players/1.json", {"v": 2})
+    assert storage.read_json("/players/1.json") == {"v": 1}
+    assert os.listdir(root / "players") == ["1.json"]
+
+
+def test_server_without_posix_rename_falls_back(sftp_storage, monkeypatch):
+    storage, root = sftp_storage
+    storage.write_json("/players/1.json", {"v": 1})
+    monkeypatch.setattr(sftp_standin._StandinSFTP, "posix_rename", lambda self, old, new: SFTP_OP_UNSUPPORTED)
+    storage.write_json("/players/1.json", {"v": 2})
+    storage.write_json("/players/1.json", {"v": 3})
+    assert storage.read_json("/players/1.json") == {"v": 3}
+    assert os.listdir(root / "players") == ["1.json"]
+
+
+def test_update_is_one_in_memory_round_trip(sftp_storage, monkeypatch):
+    import tempfile
+    import paramiko
+    storage, root = sftp_storage
+
+    def no_local_files(*args, **kwargs):
+        raise AssertionError("SFTP updates must not go through local files")
+
+    for module, name in ((tempfile, "mkstemp"), (tempfile, "NamedTemporaryFile"),
+                         (paramiko.SFTPClient, "get"), (paramiko.SFTPClient, "put")):
+        monkeypatch.setattr(module, name, no_local_files)
+
+    storage.update_json("/players/2.json", lambda data: data["itemsToGive"].append("AKM"),
+                        default=lambda: {"itemToGive": "none", "itemsToGive": []})
+    storage.update_json("/players/2.json", lambda data: data["itemsToGive"].append("M4"), default=dict)
+
+    assert storage.read_json("/players/2.json") == {"itemToGive": "none", "itemsToGive": ["AKM", "M4"]}
+    # Read and write of each update shared one pooled session
+    stats = storage.pool.stats()
+    assert (stats["connects"], stats["reuses"]) == (1, 2)
+    assert os.listdir(root / "players") == ["2.json"]
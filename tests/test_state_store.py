@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+
+@pytest.fixture
+def store(bot, tmp_path):
+    store = bot.SQLiteStateStore(str(tmp_path / "state.db"))
+    yield store
+    store.close()
+
+
+def test_updates_keep_insertion_order_across_reload(bot, store, tmp_path):
+    compras = store.load('compras')
+    for n in range(5):
+        compras[f"compra_{n}"] = {"user_id": "1", "steam_id": "76561198000000001", "item_id": "x", "drops": 1}
+        store.save('compras', f"compra_{n}", event='purchase')
+    # Updating the oldest purchase must not move it to the end
+    compras["compra_0"]["drops"] = 0
+    store.save('compras', "compra_0", event='insurance_activation')
+    store.close()
+
+    reopened = bot.SQLiteStateStore(str(tmp_path / "state.db"))
+    try:
+        loaded = reopened.load('compras')
+        assert list(loaded) == [f"compra_{n}" for n in range(5)]
+        assert loaded["compra_0"]["drops"] == 0
+    finally:
+        reopened.close()
+
+
+def test_failed_save_inside_transaction_rolls_back_the_group(store):
+    seguros = store.load('seguros')
+    compras = store.load('compras')
+    seguros["76561198000000001"] = 3
+    compras["compra_bad"] = {"user_id": "1", "steam_id": "76561198000000001", "item_id": "x", "drops": "not a number"}
+    with pytest.raises(ValueError):
+        with store.transaction():
+            store.save('seguros', "76561198000000001", event='insurance_grant')
+            store.save('compras', "compra_bad", event='purchase')
+    assert store.conn.execute("SELECT COUNT(*) FROM insurance").fetchone()[0] == 0
+    assert store.conn.execute("SELECT COUNT(*) FROM events").fetchone()[0] == 0
+
+
+def test_failed_save_outside_transaction_is_logged(store, caplog):
+    compras = store.load('compras')
+    compras["compra_bad"] = {"user_id": "1", "steam_id": "76561198000000001", "item_id": "x", "drops": "not a number"}
+    store.save('compras', "compra_bad", event='purchase')
+    assert "Error saving compras" in caplog.text
+    assert store.conn.execute("SELECT COUNT(*) FROM purchases").fetchone()[0] == 0
+
+
+def test_pending_payments_are_saved_per_order(bot, store, tmp_path):
+    pending = store.load('pending')
+    pending["PAYID-1"] = {"user_id": 1, "item_id": "x", "amount": 9.99, "coupon_reservation": None}
+    pending["PAYID-2"] = {"user_id": 2, "item_id": "y", "amount": 4.99, "coupon_reservation": "resv_1"}
+    store.save('pending', "PAYID-1")
+    store.save('pending', "PAYID-2")
+    del pending["PAYID-1"]
+    store.save('pending', "PAYID-1")
+    store.close()
+
+    reopened = bot.SQLiteStateStore(str(tmp_path / "state.db"))
+    try:
+        assert reopened.load('pending') == {"PAYID-2": {"user_id": 2, "item_id": "y", "amount": 4.99, "coupon_reservation": "resv_1"}}
+    finally:
+        reopened.close()
+
+
+def test_pending_payments_file_is_imported_into_an_existing_database(bot, store, tmp_path):
+    # A database imported before pending payments lived in it only carries the old marker
+    store.conn.execute("INSERT INTO meta (key, value) VALUES ('json_imported', '2026-01-01')")
+    items = tmp_path / "items.json"
+    items.write_text('{"akm": {"name": "AKM", "price": 5.0}}', encoding='utf-8')
+    pending = tmp_path / "pending_payments.json"
+    pending.write_text('{"PAYID-1": {"user_id": 1, "item_id": "akm"}}', encoding='utf-8')
+
+    store.import_json_once({'items': str(items), 'pending': str(pending)})
+    store.import_json_once({'items': str(items), 'pending': str(pending)})
+
+    assert store.load('items') == {}
+    assert store.load('pending') == {"PAYID-1": {"user_id": 1, "item_id": "akm"}}
+
+
+def test_commits_run_on_the_writer_thread(store, monkeypatch):
+    import threading
+    threads = []
+    commit = store._commit
+    monkeypatch.setattr(store, "_commit", lambda batch: (threads.append(threading.current_thread().name), commit(batch)))
+    seguros = store.load('seguros')
+    with store.transaction():
+        for n in range(3):
+            seguros[f"7656119800000000{n}"] = n + 1
+            store.save('seguros', f"7656119800000000{n}", event='insurance_grant')
+    store.flush()
+    # One transaction, one commit, off the calling thread
+    assert len(threads) == 1 and threads[0] != threading.current_thread().name
+    assert store.conn.execute("SELECT COUNT(*) FROM insurance").fetchone()[0] == 3
+    assert store.conn.execute("SELECT COUNT(*) FROM events").fetchone()[0] == 3
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+
+class SlowFetch:
+    """PayPal lookup stand-in: counts calls and answers once released"""
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self, payment_id):
+        self.calls += 1
+        status = self.statuses.pop(0)
+        await self.release.wait()
+        return status
+
+
+def test_concurrent_checks_share_one_lookup(bot, run):
+    cache = bot.PaymentStatusCache(ttl=60)
+
+    async def burst():
+        fetch = SlowFetch(["pending"])
+        waiters = [asyncio.ensure_future(cache.get("PAYID-1", fetch)) for _ in range(10)]
+        await asyncio.sleep(0)
+        fetch.release.set()
+        return fetch, await asyncio.gather(*waiters)
+
+    fetch, statuses = run(burst())
+    assert statuses == ["pending"] * 10 and fetch.calls == 1
+    assert cache.stats == {"hits": 0, "misses": 1, "coalesced": 9}
+    assert not cache._inflight
+
+
+def test_caller_giving_up_does_not_cancel_the_shared_lookup(bot, run):
+    cache = bot.PaymentStatusCache(ttl=60)
+
+    async def scenario():
+        fetch = SlowFetch(["approved"])
+        impatient = asyncio.ensure_future(cache.get("PAYID-2", fetch))
+        patient = asyncio.ensure_future(cache.get("PAYID-2", fetch))
+        await asyncio.sleep(0)
+        impatient.cancel()
+        fetch.release.set()
+        return fetch, await patient
+
+    fetch, status = run(scenario())
+    assert status == "approved" and fetch.calls == 1
+
+
+def test_pending_expires_but_terminal_and_errors_behave(bot, run):
+    cache = bot.PaymentStatusCache(ttl=0)
+    fetch = SlowFetch(["pending", "error", "approved"])
+    fetch.release.set()
+    # ttl 0: a pending status is looked up again; errors are never cached
+    assert run(cache.get("PAYID-3", fetch)) == "pending"
+    assert run(cache.get("PAYID-3", fetch)) == "error"
+    assert run(cache.get("PAYID-3", fetch)) == "approved"
+    # Terminal states stay cached
+    assert run(cache.get("PAYID-3", fetch)) == "approved" and fetch.calls == 3
+
+
+def test_running_lookup_does_not_downgrade_delivered(bot, run):
+    cache = bot.PaymentStatusCache(ttl=60)
+
+    async def scenario():
+        fetch = SlowFetch(["approved"])
+        lookup = asyncio.ensure_future(cache.get("PAYID-4", fetch))
+        await asyncio.sleep(0)
+        # The webhook delivered the order while the lookup was in flight
+        cache.mark("PAYID-4", "delivered")
+        fetch.release.set()
+        return await lookup
+
+    assert run(scenario()) == "delivered"
+    assert cache._entries["PAYID-4"][0] == "delivered"
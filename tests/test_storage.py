@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+
+def test_backend_missing_operations_fails_at_construction(bot):
+    class ReadOnly(bot.StorageBackend):
+        def path(self, base, filename):
+            return f"{base}/{filename}"
+
+        def read_json(self, path):
+            return {}
+
+    with pytest.raises(TypeError):
+        ReadOnly()
+
+
+def test_memory_update_json_uses_default_for_missing_file(bot):
+    storage = bot.MemoryStorage()
+    path = storage.path("/players", "1.json")
+    storage.update_json(path, lambda data: data.setdefault("itemsToGive", []).append("AKM"), default=dict)
+    assert storage.read_json(path) == {"itemsToGive": ["AKM"]}
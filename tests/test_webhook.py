@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import json
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from paypal_standin import PayPalStandin
+
+SIGNATURE = {"PAYPAL-AUTH-ALGO": "SHA256withRSA", "PAYPAL-CERT-URL": "https://api.paypal.com/cert",
+             "PAYPAL-TRANSMISSION-ID": "1", "PAYPAL-TRANSMISSION-SIG": "sig", "PAYPAL-TRANSMISSION-TIME": "now"}
+
+
+@pytest.fixture
+def post(bot, run, monkeypatch):
+    """POST to the webhook handler, verifying signatures against the PayPal stand-in"""
+    standin = PayPalStandin(client_id=bot.PAYPAL_CLIENT_ID, client_secret=bot.PAYPAL_CLIENT_SECRET)
+    app = web.Application()
+    app.router.add_post("/webhook", bot.handle_paypal_webhook)
+    runner = web.AppRunner(app)
+
+    async def start():
+        await standin.start()
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        return site._server.sockets[0].getsockname()[1]
+
+    port = run(start())
+    monkeypatch.setattr(bot.paypal_client, "base_url", standin.url)
+    monkeypatch.setattr(bot, "WEBHOOK_VERIFY", "paypal")
+    monkeypatch.setattr(bot, "PAYPAL_WEBHOOK_ID", "WH-TEST")
+    monkeypatch.setattr(bot.paypal_client, "_token", None)
+
+    def send(body, headers=SIGNATURE):
+        async def _send():
+            async with aiohttp.ClientSession() as session:
+                async with session.post(f"http://127.0.0.1:{port}/webhook", data=body, headers=headers) as response:
+                    return response.status, await response.text(), standin.counts["verify"]
+        return run(_send())
+
+    yield send
+    run(runner.cleanup())
+    run(standin.stop())
+
+
+def test_malformed_body_is_rejected_before_verification(post):
+    assert post("{not json")[:2] == (400, "invalid body")
+    assert post("[1, 2]")[:2] == (400, "invalid body")
+    assert post("{not json")[2] == 0
+
+
+def test_unsigned_event_is_rejected(post):
+    event = {"id": "WH-1", "event_type": "PAYMENT.SALE.COMPLETED", "resource": {}}
+    assert post(json.dumps(event), headers={})[:2] == (400, "invalid signature")
+
+
+def test_verified_event_for_unknown_order_is_acknowledged(post):
+    event = {"id": "WH-2", "event_type": "PAYMENT.SALE.COMPLETED",
+             "resource": {"parent_payment": "PAYID-UNKNOWN", "amount": {"total": "1.00"}}}
+    status, text, verified = post(json.dumps(event))
+    assert (status, text, verified) == (200, "ok", 1)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+import asyncio
+
+
+def slow_writes(bot, monkeypatch, delay=0.03):
+    write = bot.write_file_atomic
+
+    def slow(filename, payload):
+        time.sleep(delay)
+        write(filename, payload)
+
+    monkeypatch.setattr(bot, "write_file_atomic", slow)
+
+
+def test_saves_are_merged_per_file(bot, run, tmp_path):
+    writes = []
+    wb = bot.WriteBehind(interval=3600, max_pending=1000)
+
+    async def scenario():
+        wb.start()
+        path = str(tmp_path / "a.json")
+        data = {}
+        for n in range(10):
+            data[str(n)] = n
+            wb.mark(path, data)
+        writes.append(await wb.flush())
+        await wb.stop()
+        return path
+
+    path = run(scenario())
+    assert writes == [1]
+    assert json.loads(open(path, encoding='utf-8').read()) == {str(n): n for n in range(10)}
+
+
+def test_stop_during_flush_writes_every_marked_file(bot, run, tmp_path, monkeypatch):
+    slow_writes(bot, monkeypatch)
+    wb = bot.WriteBehind(interval=3600, max_pending=5)
+    paths = [str(tmp_path / f"f{n}.json") for n in range(5)]
+
+    async def scenario():
+        wb.start()
+        for n, path in enumerate(paths):
+            wb.mark(path, {"n": n})  # the fifth mark wakes the flusher
+        await asyncio.sleep(0.05)  # flusher is now between file writes
+        late = str(tmp_path / "late.json")
+        wb.mark(late, {"n": "late"})
+        await wb.stop()
+        return late
+
+    late = run(scenario())
+    for n, path in enumerate(paths):
+        assert json.loads(open(path, encoding='utf-8').read()) == {"n": n}
+    assert json.loads(open(late, encoding='utf-8').read()) == {"n": "late"}
+    assert not wb.active
+
+
+def test_cancelled_flush_keeps_unwritten_files_dirty(bot, run, tmp_path, monkeypatch):
+    slow_writes(bot, monkeypatch)
+    wb = bot.WriteBehind(interval=3600, max_pending=1000)
+    paths = [str(tmp_path / f"c{n}.json") for n in range(5)]
+
+    async def scenario():
+        for n, path in enumerate(paths):
+            wb._dirty[path] = {"n": n}
+        task = asyncio.ensure_future(wb.flush())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await asyncio.sleep(0.1)  # let the write already running in the executor finish
+        await wb.flush()
+
+    run(scenario())
+    for n, path in enumerate(paths):
+        assert json.loads(open(path, encoding='utf-8').read()) == {"n": n}
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Replay PayPal webhook events against the bot's webhook listener.
+
+Posts recorded events (a JSON file holding one event, a list of events, or
+{"headers": {...}, "body": {...}} captures) to the listener, or builds a
+PAYMENT.SALE.COMPLETED event for an open order so delivery can be tested
+without PayPal. Start the bot for this with PORT=8080 and WEBHOOK_VERIFY=off;
+replayed captures keep their original PayPal signature headers, which only
+verify against the webhook they were recorded for.
+
+    python webhook_replay.py events/sale_completed.json
+    python webhook_replay.py --sale PAYID-ABC123 --amount 9.99
+    python webhook_replay.py --sale PAYID-ABC123 --amount 9.99 --repeat 3   # idempotency check
+"""
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+from datetime import datetime, timezone
+
+import aiohttp
+
+SIGNATURE_HEADERS = ("PAYPAL-AUTH-ALGO", "PAYPAL-CERT-URL", "PAYPAL-TRANSMISSION-ID",
+                     "PAYPAL-TRANSMISSION-SIG", "PAYPAL-TRANSMISSION-TIME")
+
+
+def sale_completed_event(payment_id: str, amount: float, currency: str) -> dict:
+    """Minimal PAYMENT.SALE.COMPLETED event as PayPal sends it for a v1 payment"""
+    now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return {
+        "id": f"WH-REPLAY-{uuid.uuid4().hex[:16].upper()}",
+        "event_version": "1.0",
+        "create_time": now,
+        "resource_type": "sale",
+        "event_type": "PAYMENT.SALE.COMPLETED",
+        "summary": f"Payment completed for {currency} {amount:.2f}",
+        "resource": {
+            "id": f"SALE{uuid.uuid4().hex[:13].upper()}",
+            "state": "completed",
+            "amount": {"total": f"{amount:.2f}", "currency": currency},
+            "parent_payment": payment_id,
+            "create_time": now,
+            "update_time": now,
+        },
+    }
+
+
+def load_captures(path: str) -> list:
+    """[(headers, body)] from a recording file"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    items = data if isinstance(data, list) else [data]
+    captures = []
+    for item in items:
+        if "body" in item:
+            captures.append(({k.upper(): v for k, v in (item.get("headers") or {}).items()}, item["body"]))
+        else:
+            captures.append(({}, item))
+    return captures
+
+
+async def post(session, url: str, headers: dict, body) -> tuple:
+    payload = body if isinstance(body, str) else json.dumps(body)
+    sent = {"Content-Type": "application/json"}
+    sent.update({k: v for k, v in headers.items() if k in SIGNATURE_HEADERS})
+    start = time.perf_counter()
+    async with session.post(url, data=payload, headers=sent) as response:
+        text = await response.text()
+    return response.status, text, (time.perf_counter() - start) * 1000
+
+
+async def main_async(args) -> int:
+    captures = []
+    for path in args.files:
+        captures.extend(load_captures(path))
+    if args.sale:
+        captures.append(({}, sale_completed_event(args.sale, args.amount, args.currency)))
+    if not captures:
+        print("Nothing to send: pass recording files or --sale PAYMENT_ID")
+        return 1
+    failures = 0
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30)) as session:
+        for headers, body in captures:
+            event = json.loads(body) if isinstance(body, str) else body
+            for attempt in range(args.repeat):
+                try:
+                    status, text, ms = await post(session, args.url, headers, body)
+                except aiohttp.ClientError as e:
+                    print(f"{event.get('event_type')} {event.get('id')}: connection error: {e}")
+                    failures += 1
+                    continue
+                if status >= 400:
+                    failures += 1
+                print(f"{event.get('event_type')} {event.get('id')} #{attempt + 1}: {status} {text!r} ({ms:.1f} ms)")
+                if args.delay:
+                    await asyncio.sleep(args.delay)
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay PayPal webhook events against the bot")
+    parser.add_argument("files", nargs="*", help="Recorded webhook events (JSON)")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/paypal/webhook", help="Webhook listener URL")
+    parser.add_argument("--sale", metavar="PAYMENT_ID", help="Send a PAYMENT.SALE.COMPLETED event for this payment")
+    parser.add_argument("--amount", type=float, default=0.0, help="Sale amount for --sale (must match the order)")
+    parser.add_argument("--currency", default="EUR", help="Sale currency for --sale")
+    parser.add_argument("--repeat", type=int, default=1, help="Send every event this many times")
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds between posts")
+    return asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    sys.exit(main())